@@ -148,6 +148,34 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # Notification settings
 
+# Monte Carlo Simulation Settings
+MONTE_CARLO_MAX_SIMULATIONS = int(os.getenv('MONTE_CARLO_MAX_SIMULATIONS', '1000000'))
+MONTE_CARLO_WORKERS = int(os.getenv('MONTE_CARLO_WORKERS', str(os.cpu_count() or 1)))
+MONTE_CARLO_PARALLEL_THRESHOLD = 100000  # Runs with at least this many iterations use the worker pool
+# Runs with at least this many iterations are queued as background jobs instead
+# of running inside the request, so the worker pool is only started by job workers
+MONTE_CARLO_BACKGROUND_THRESHOLD = MONTE_CARLO_PARALLEL_THRESHOLD
+MONTE_CARLO_CACHED_RUNS_PER_PROJECT = 20  # Stored simulation results kept per project
+# Baseline iteration totals kept on disk for what-if re-simulation of edited risks
+MONTE_CARLO_WHAT_IF_DIR = Path(os.getenv('MONTE_CARLO_WHAT_IF_DIR', BASE_DIR / 'what_if_baselines'))
+MONTE_CARLO_WHAT_IF_BASELINES = 20  # Most recently used baselines kept
+# Iterations a sensitivity analysis uses at most; it keeps the p90 tail row by
+# row for every risk, so its memory grows with iterations times risks
+MONTE_CARLO_SENSITIVITY_MAX_SIMULATIONS = 100000
+
+# Background Job Settings
+# When enabled, simulation and project-level AI views queue their work for the
+# run_background_jobs worker instead of doing it inside the request
+BACKGROUND_JOBS_ENABLED = os.getenv('BACKGROUND_JOBS_ENABLED', 'False').lower() == 'true'
+BACKGROUND_JOB_POLL_INTERVAL = 1.0  # Seconds the worker waits when the queue is empty
+BACKGROUND_JOB_HEARTBEAT_INTERVAL = 30  # Seconds between a worker's heartbeats for its running job
+BACKGROUND_JOB_STALE_AFTER = 300  # Seconds without a heartbeat before a running job is considered abandoned
+BACKGROUND_JOB_MAX_ATTEMPTS = 3  # Runs a job gets before an abandoned job is marked failed
+
+# Risk Similarity Index
+# Hashed n-gram vectors of every risk, used to find similar and duplicate risks
+RISK_SIMILARITY_INDEX_DIR = Path(os.getenv('RISK_SIMILARITY_INDEX_DIR', BASE_DIR / 'similarity_index'))
+
 # Google Gemini AI Configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
@@ -155,6 +183,38 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 AI_FEATURES_ENABLED = bool(GEMINI_API_KEY)  # Automatically enable AI if API key is present
 AI_REQUEST_TIMEOUT = 30  # Timeout for AI API requests in seconds
 AI_MAX_RETRIES = 3  # Maximum retries for failed AI requests
+AI_RETRY_BACKOFF = 0.5  # Seconds before the first retry; doubles on each further retry
+AI_RETRY_BACKOFF_MAX = 8.0  # Longest wait between retries
+# Circuit breaker: once AI_CIRCUIT_FAILURE_RATE of the last AI_CIRCUIT_WINDOW calls
+# (and at least AI_CIRCUIT_MIN_CALLS of them) have failed, AI features return their
+# fallback results without calling the API for AI_CIRCUIT_RESET_TIMEOUT seconds
+AI_CIRCUIT_WINDOW = 20
+AI_CIRCUIT_MIN_CALLS = 5
+AI_CIRCUIT_FAILURE_RATE = 0.5
+AI_CIRCUIT_RESET_TIMEOUT = 60
+
+# AI Response Cache
+# Identical prompts to the same model are answered from the database
+AI_RESPONSE_CACHE_ENABLED = os.getenv('AI_RESPONSE_CACHE_ENABLED', 'True').lower() == 'true'
+AI_RESPONSE_CACHE_TTL = int(os.getenv('AI_RESPONSE_CACHE_TTL', str(24 * 3600)))  # Seconds a cached response stays valid
+AI_RESPONSE_CACHE_MAX_ENTRIES = 5000  # Least recently used responses beyond this are evicted
+# ai_features functions that always call the API, e.g. "generate_executive_summary,smart_risk_search"
+AI_RESPONSE_CACHE_DISABLED_FUNCTIONS = [
+    name.strip() for name in os.getenv('AI_RESPONSE_CACHE_DISABLED_FUNCTIONS', '').split(',') if name.strip()
+]
+
+# Batch AI Backfill (manage.py ai_backfill)
+AI_BATCH_SIZE = 20  # Risks packed into one prompt
+AI_BATCH_CONCURRENCY = 4  # Prompts in flight at once
+AI_BATCH_MAX_ATTEMPTS = 3  # Tries per risk before it is reported as failed
+
+# Prompt Budget
+# Project-wide analyses (trends, dependencies) fit their risk list into this many
+# estimated tokens, shortening descriptions and then splitting the list into chunks
+AI_PROMPT_TOKEN_BUDGET = 6000
+AI_PROMPT_DESCRIPTION_TOKENS = 200  # Longest description included
+AI_PROMPT_MIN_DESCRIPTION_TOKENS = 30  # Shortest a description is cut before the list is chunked
+AI_PROMPT_MAX_CHUNKS = 4  # Chunks analyzed before merging; the lowest ranked risks beyond them are left out
 
 # Risk Management AI Settings
 RISK_NOTIFY_HIGH_RISKS = os.getenv('RISK_NOTIFY_HIGH_RISKS', 'True').lower() == 'true'
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Project, Risk, Category, RiskHistory, RiskResponse, UserProfile
+from . import search
+from .models import (Project, Risk, Category, CorrelationGroup, RiskHistory, RiskResponse, SimulationRun,
+                     BackgroundJob, ProjectRiskSummary, AIResponse, AICacheCounter, AIBackfillRun,
+                     UserProfile)
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
@@ -13,11 +16,26 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Risk)
 class RiskAdmin(admin.ModelAdmin):
-    list_display = ('title', 'project', 'category', 'risk_score', 'risk_level', 'status', 'owner')
-    list_filter = ('category', 'status', 'likelihood', 'impact')
+    list_display = ('title', 'project', 'category', 'score', 'level', 'status', 'owner')
+    list_filter = ('category', 'status', 'level', 'likelihood', 'impact', 'cost_distribution')
     search_fields = ('title', 'description', 'owner')
     list_editable = ('status', 'owner')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Title and description go through the full-text index; owner keeps
+        # the default substring match
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        matches = queryset.filter(search.matching_filter(search_term.split(), prefix=True))
+        owners = queryset.filter(owner__icontains=search_term)
+        return matches | owners, False
+
+@admin.register(CorrelationGroup)
+class CorrelationGroupAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project', 'correlation')
+    list_filter = ('project',)
+    search_fields = ('name',)
+
 @admin.register(RiskHistory)
 class RiskHistoryAdmin(admin.ModelAdmin):
     list_display = ('risk', 'changed_at', 'changed_by', 'status', 'likelihood', 'impact')
@@ -33,6 +51,44 @@ class RiskResponseAdmin(admin.ModelAdmin):
     search_fields = ('risk__title', 'description', 'responsible_person')
     date_hierarchy = 'created_at'
 
+@admin.register(SimulationRun)
+class SimulationRunAdmin(admin.ModelAdmin):
+    list_display = ('project', 'num_simulations', 'seed', 'risks_updated_at', 'created_at')
+    list_filter = ('project',)
+    readonly_fields = ('project', 'inputs_hash', 'num_simulations', 'seed', 'risks_updated_at',
+                      'result', 'created_at')
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('kind', 'params', 'result', 'error', 'attempts', 'created_by',
+                      'created_at', 'started_at', 'heartbeat_at', 'finished_at')
+
+@admin.register(ProjectRiskSummary)
+class ProjectRiskSummaryAdmin(admin.ModelAdmin):
+    list_display = ('project', 'category', 'status', 'likelihood', 'impact', 'level', 'risk_count', 'total_cost')
+    list_filter = ('status', 'level', 'category')
+    readonly_fields = ('project', 'category', 'status', 'likelihood', 'impact', 'risk_count', 'total_cost')
+
+@admin.register(AIResponse)
+class AIResponseAdmin(admin.ModelAdmin):
+    list_display = ('function', 'model_name', 'hits', 'created_at', 'last_used_at')
+    list_filter = ('function', 'model_name')
+    readonly_fields = ('key', 'function', 'model_name', 'response_text', 'hits', 'created_at', 'last_used_at')
+
+@admin.register(AICacheCounter)
+class AICacheCounterAdmin(admin.ModelAdmin):
+    list_display = ('function', 'hits', 'misses')
+    readonly_fields = ('function', 'hits', 'misses')
+
+@admin.register(AIBackfillRun)
+class AIBackfillRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'project', 'overwrite', 'status', 'last_risk_id', 'updated', 'updated_at')
+    list_filter = ('task', 'status')
+    readonly_fields = ('task', 'project', 'overwrite', 'status', 'last_risk_id', 'failed_ids', 'updated',
+                      'created_at', 'updated_at')
+
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'role', 'get_projects')
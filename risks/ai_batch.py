@@ -0,0 +1,187 @@
+"""
+Backfill risk categories or likelihood and impact scores with batched AI calls.
+
+Risks are read in id order and packed AI_BATCH_SIZE to a prompt, with up to
+AI_BATCH_CONCURRENCY prompts in flight at once. A risk the response did not
+answer validly goes back into the queue and joins a later batch, until it
+has been tried AI_BATCH_MAX_ATTEMPTS times. After each wave of prompts the
+run's AIBackfillRun row records how far it got, so an interrupted run can be
+resumed without paying for the same risks again.
+"""
+import asyncio
+from typing import Callable, Dict, List, Optional
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .ai_features import batch_ai_risk_scoring_async, batch_auto_categorize_risks_async
+from .models import AIBackfillRun, Category, Project, Risk, RiskHistory
+from .search import index_risk
+
+
+def target_risks(run: AIBackfillRun):
+    """
+    The risks a run fills in.
+
+    Without overwrite, categorizing covers risks with no category and scoring
+    covers risks still at the default likelihood and impact of 1.
+    """
+    risks = Risk.objects.all()
+    if run.project_id:
+        risks = risks.filter(project_id=run.project_id)
+    if not run.overwrite:
+        if run.task == 'categorize':
+            risks = risks.filter(category__isnull=True)
+        else:
+            risks = risks.filter(likelihood=1, impact=1)
+    return risks
+
+
+def start_run(task: str, project: Optional[Project] = None, overwrite: bool = False,
+              resume: bool = False) -> AIBackfillRun:
+    """
+    Create a backfill run, or with resume pick up the latest unfinished run
+    with the same task, project and overwrite setting.
+    """
+    if task not in dict(AIBackfillRun.TASK_CHOICES):
+        raise ValueError(f"Unknown backfill task: {task}")
+    if resume:
+        run = AIBackfillRun.objects.filter(task=task, project=project, overwrite=overwrite,
+                                           status='running').first()
+        if run is not None:
+            return run
+    return AIBackfillRun.objects.create(task=task, project=project, overwrite=overwrite)
+
+
+def _load_risks(run: AIBackfillRun, ids: Optional[List[int]] = None, limit: int = 0) -> List[Risk]:
+    """The given risks, or the next `limit` risks after the run's checkpoint"""
+    risks = target_risks(run).select_related('category')
+    if ids is not None:
+        return list(risks.filter(id__in=ids).order_by('id'))
+    if limit <= 0:
+        return []
+    return list(risks.filter(id__gt=run.last_risk_id).order_by('id')[:limit])
+
+
+def _prompt_rows(risks: List[Risk]) -> List[Dict]:
+    return [{
+        'title': risk.title,
+        'description': risk.description,
+        'category': risk.category.name if risk.category else '',
+    } for risk in risks]
+
+
+def _save_wave(run: AIBackfillRun, updates, page: List[Risk], failed_ids: List[int],
+               categories: Dict[str, Category]) -> None:
+    """Apply a wave's answers and move the checkpoint past it, in one transaction"""
+    with transaction.atomic():
+        history = []
+        for risk, result in updates:
+            if run.task == 'categorize':
+                risk.category = categories[result['suggested_category']]
+                risk.save(update_fields=['category', 'updated_at'])
+            else:
+                risk.likelihood, risk.impact = result['likelihood'], result['impact']
+                risk.save(update_fields=['likelihood', 'impact', 'updated_at'])
+            history.append(RiskHistory(
+                risk=risk,
+                title=risk.title,
+                description=risk.description,
+                category_name=risk.category.name if risk.category else '',
+                likelihood=risk.likelihood,
+                impact=risk.impact,
+                status=risk.status,
+                owner=risk.owner,
+                change_comment=f"AI backfill ({run.task}): {result['reasoning']}",
+            ))
+        RiskHistory.objects.bulk_create(history)
+        # bulk_create skips the post_save handler that indexes history comments
+        for risk, _ in updates:
+            index_risk(risk.id)
+
+        run.updated += len(updates)
+        if page:
+            run.last_risk_id = page[-1].id
+        run.failed_ids = failed_ids
+        run.save(update_fields=['updated', 'last_risk_id', 'failed_ids', 'updated_at'])
+
+
+def _finish_run(run: AIBackfillRun) -> None:
+    run.status = 'finished'
+    run.save(update_fields=['status', 'updated_at'])
+
+
+async def _backfill(run: AIBackfillRun, batch_size: int, concurrency: int, max_attempts: int,
+                    progress: Optional[Callable[[AIBackfillRun], None]]) -> AIBackfillRun:
+    categories = {}
+    if run.task == 'categorize':
+        categories = {category.name: category async for category in Category.objects.all()}
+        if not categories:
+            raise ValueError("There are no categories to assign")
+
+        async def analyze(rows):
+            return await batch_auto_categorize_risks_async(rows, list(categories))
+    else:
+        project = await Project.objects.filter(id=run.project_id).afirst() if run.project_id else None
+        context = f"{project.name}: {project.description}" if project else None
+
+        async def analyze(rows):
+            return await batch_ai_risk_scoring_async(rows, context)
+
+    # Risks left over from an interrupted run are retried first
+    retry_ids, given_up_ids, attempts = list(run.failed_ids), [], {}
+    wave_size = batch_size * concurrency
+    while True:
+        retry = await sync_to_async(_load_risks)(run, ids=retry_ids) if retry_ids else []
+        page = await sync_to_async(_load_risks)(run, limit=wave_size - len(retry))
+        risks = retry + page
+        if not risks:
+            break
+
+        batches = [risks[i:i + batch_size] for i in range(0, len(risks), batch_size)]
+        answers = await asyncio.gather(*(analyze(_prompt_rows(batch)) for batch in batches))
+
+        updates, failed_ids = [], []
+        for batch, results in zip(batches, answers):
+            for risk, result in zip(batch, results):
+                if result is None:
+                    failed_ids.append(risk.id)
+                else:
+                    updates.append((risk, result))
+        for risk_id in failed_ids:
+            attempts[risk_id] = attempts.get(risk_id, 0) + 1
+        retry_ids = [risk_id for risk_id in failed_ids if attempts[risk_id] < max_attempts]
+        given_up_ids += [risk_id for risk_id in failed_ids if attempts[risk_id] >= max_attempts]
+
+        await sync_to_async(_save_wave)(run, updates, page, retry_ids + given_up_ids, categories)
+        if progress:
+            progress(run)
+
+    await sync_to_async(_finish_run)(run)
+    return run
+
+
+def run_backfill(run: AIBackfillRun, batch_size: Optional[int] = None, concurrency: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 progress: Optional[Callable[[AIBackfillRun], None]] = None) -> AIBackfillRun:
+    """
+    Fill in categories or scores for the run's risks, continuing from its checkpoint.
+
+    Args:
+        run: Run from start_run()
+        batch_size: Risks per prompt (AI_BATCH_SIZE)
+        concurrency: Prompts in flight at once (AI_BATCH_CONCURRENCY)
+        max_attempts: Tries per risk before it is given up on (AI_BATCH_MAX_ATTEMPTS)
+        progress: Called with the run after each wave is saved
+
+    Returns:
+        The finished run; failed_ids lists the risks that never got a valid answer
+    """
+    return async_to_sync(_backfill)(
+        run,
+        batch_size or settings.AI_BATCH_SIZE,
+        concurrency or settings.AI_BATCH_CONCURRENCY,
+        max_attempts or settings.AI_BATCH_MAX_ATTEMPTS,
+        progress,
+    )
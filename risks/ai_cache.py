@@ -0,0 +1,164 @@
+"""
+Persistent cache of Gemini responses.
+
+A response is keyed by a hash of the calling ai_features function, the model
+name, the generation config (temperature and output token limit) and the
+prompt with its whitespace normalized, so re-running an analysis
+on unchanged inputs is answered from the database. Entries expire after
+AI_RESPONSE_CACHE_TTL seconds, and the least recently used ones are evicted
+beyond AI_RESPONSE_CACHE_MAX_ENTRIES. Functions listed in
+AI_RESPONSE_CACHE_DISABLED_FUNCTIONS always call the API.
+"""
+import hashlib
+import json
+import re
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import ai_client
+from .models import AICacheCounter, AIResponse
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse the indentation and blank lines of a prompt template"""
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cache_key(function: str, model_name: str, prompt: str, generation_config: Dict[str, Any]) -> str:
+    """Hash identifying a response"""
+    encoded = json.dumps([function, model_name, generation_config, normalize_prompt(prompt)],
+                         separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def is_enabled(function: str) -> bool:
+    """Whether responses of this function are cached"""
+    return (settings.AI_RESPONSE_CACHE_ENABLED
+            and function not in settings.AI_RESPONSE_CACHE_DISABLED_FUNCTIONS)
+
+
+def _count(function: str, field: str) -> None:
+    updated = AICacheCounter.objects.filter(function=function).update(**{field: F(field) + 1})
+    if not updated:
+        counter, created = AICacheCounter.objects.get_or_create(function=function, defaults={field: 1})
+        if not created:
+            AICacheCounter.objects.filter(pk=counter.pk).update(**{field: F(field) + 1})
+
+
+def lookup(function: str, model_name: str, prompt: str, generation_config: Dict[str, Any]) -> Optional[str]:
+    """Return the cached response text, or None on a miss; counts the hit or miss"""
+    key = cache_key(function, model_name, prompt, generation_config)
+    fresh_after = timezone.now() - timedelta(seconds=settings.AI_RESPONSE_CACHE_TTL)
+    entry = AIResponse.objects.filter(key=key, created_at__gte=fresh_after).only('response_text').first()
+    if entry is None:
+        _count(function, 'misses')
+        return None
+    AIResponse.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count(function, 'hits')
+    return entry.response_text
+
+
+def store(function: str, model_name: str, prompt: str, generation_config: Dict[str, Any],
+          response_text: str) -> None:
+    """Save a response, then drop expired and least recently used entries"""
+    now = timezone.now()
+    AIResponse.objects.update_or_create(
+        key=cache_key(function, model_name, prompt, generation_config),
+        defaults={
+            'function': function,
+            'model_name': model_name,
+            'response_text': response_text,
+            'hits': 0,
+            'created_at': now,
+            'last_used_at': now,
+        },
+    )
+    AIResponse.objects.filter(created_at__lt=now - timedelta(seconds=settings.AI_RESPONSE_CACHE_TTL)).delete()
+    evicted_ids = AIResponse.objects.order_by('-last_used_at').values_list('id', flat=True)[
+        settings.AI_RESPONSE_CACHE_MAX_ENTRIES:]
+    AIResponse.objects.filter(id__in=list(evicted_ids)).delete()
+
+
+def _is_json(response_text: str) -> bool:
+    # Imported here: ai_features imports this module
+    from .ai_features import extract_json_from_response
+    try:
+        json.loads(extract_json_from_response(response_text))
+    except ValueError:
+        return False
+    return True
+
+
+def generate_text(function: str, model, prompt: str) -> str:
+    """
+    Call the model through the cache, with ai_client's deadline, retries and
+    circuit breaker applied to cache misses.
+
+    Only responses that parse as JSON are stored, so a malformed answer is
+    retried on the next call rather than replayed.
+
+    Args:
+        function: Name of the calling ai_features function
+        model: Gemini GenerativeModel
+        prompt: Prompt text
+
+    Returns:
+        The response text
+    """
+    if not is_enabled(function):
+        return ai_client.generate(model, prompt)
+    model_name = getattr(model, 'model_name', '')
+    # get_model() builds every model from these settings
+    config = ai_client.generation_settings()
+    cached = lookup(function, model_name, prompt, config)
+    if cached is not None:
+        return cached
+    response_text = ai_client.generate(model, prompt)
+    if _is_json(response_text):
+        store(function, model_name, prompt, config, response_text)
+    return response_text
+
+
+async def generate_text_async(function: str, model, prompt: str) -> str:
+    """Coroutine version of generate_text(), calling the async Gemini API on a miss"""
+    if not is_enabled(function):
+        return await ai_client.generate_async(model, prompt)
+    model_name = getattr(model, 'model_name', '')
+    config = ai_client.generation_settings()
+    cached = await sync_to_async(lookup)(function, model_name, prompt, config)
+    if cached is not None:
+        return cached
+    response_text = await ai_client.generate_async(model, prompt)
+    if _is_json(response_text):
+        await sync_to_async(store)(function, model_name, prompt, config, response_text)
+    return response_text
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hits, misses, hit rate and stored entries per function"""
+    entries = dict(AIResponse.objects.values_list('function').annotate(count=Count('id')).order_by())
+    stats = {}
+    for counter in AICacheCounter.objects.order_by('function'):
+        total = counter.hits + counter.misses
+        stats[counter.function] = {
+            'hits': counter.hits,
+            'misses': counter.misses,
+            'hit_rate': round(counter.hits / total, 3) if total else 0.0,
+            'entries': entries.pop(counter.function, 0),
+        }
+    for function, count in entries.items():
+        stats[function] = {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'entries': count}
+    return stats
+
+
+def clear(function: Optional[str] = None) -> int:
+    """Delete cached responses (of one function, or all); returns the number deleted"""
+    entries = AIResponse.objects.all()
+    if function:
+        entries = entries.filter(function=function)
+    return entries.delete()[0]
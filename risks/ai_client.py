@@ -0,0 +1,274 @@
+"""
+Process-wide registry of configured Gemini models.
+
+google.generativeai keeps one API client, and with it one open connection,
+per process until genai.configure is called again, which discards it. The
+registry configures the library once per API key and hands out a shared
+GenerativeModel per model settings, so every AI call reuses the same
+connection and picks up AI_MODEL_NAME, AI_TEMPERATURE and AI_MAX_OUTPUT_TOKENS.
+
+Calls go through generate() or generate_async(), which bound each call by
+AI_REQUEST_TIMEOUT, retry transient failures with exponential backoff, and
+trip a circuit breaker when too many recent calls have failed so that an
+outage costs callers nothing until the API recovers. The breaker is per
+process.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import google.generativeai as genai
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+_lock = threading.Lock()
+_configured_api_key = None
+_models = {}
+
+
+def configure() -> None:
+    """
+    Configure the Gemini API with the key from settings, once per key.
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    global _configured_api_key
+    api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not set in settings")
+    with _lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+            _models.clear()
+
+
+def generation_settings() -> Dict[str, Any]:
+    """The generation config every model is created with, from settings"""
+    return {
+        'temperature': settings.AI_TEMPERATURE,
+        'max_output_tokens': settings.AI_MAX_OUTPUT_TOKENS,
+    }
+
+
+def get_model(model_name: Optional[str] = None):
+    """
+    The shared GenerativeModel for the configured model and generation settings.
+
+    Args:
+        model_name: Model to use instead of AI_MODEL_NAME
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    configure()
+    model_name = model_name or settings.AI_MODEL_NAME
+    config = generation_settings()
+    key = (model_name, *sorted(config.items()))
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name, generation_config=genai.GenerationConfig(**config))
+            _models[key] = model
+    return model
+
+
+def reset() -> None:
+    """Forget the configuration and models, e.g. after rotating the API key"""
+    global _configured_api_key
+    with _lock:
+        _configured_api_key = None
+        _models.clear()
+
+
+# Failures worth retrying: server errors (including deadline exceeded),
+# rate limiting and network trouble
+TRANSIENT_ERRORS = (
+    google_exceptions.ServerError,
+    google_exceptions.TooManyRequests,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent AI calls and stops further calls while too
+    many of them fail.
+
+    Closed: calls go through. Open: calls are refused until
+    AI_CIRCUIT_RESET_TIMEOUT has passed. Half-open: a single trial call goes
+    through; its success closes the breaker and its failure re-opens it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._trial_running or time.monotonic() - self._opened_at >= settings.AI_CIRCUIT_RESET_TIMEOUT:
+                return 'half-open'
+            return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < settings.AI_CIRCUIT_RESET_TIMEOUT:
+                return False
+            self._trial_running = True
+            return True
+
+    def record(self, success: bool) -> None:
+        """Count the outcome of a call that allow() let through"""
+        with self._lock:
+            if self._opened_at is not None:
+                self._trial_running = False
+                if success:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                else:
+                    self._opened_at = time.monotonic()
+                return
+            self._outcomes.append(success)
+            while len(self._outcomes) > settings.AI_CIRCUIT_WINDOW:
+                self._outcomes.popleft()
+            failures = self._outcomes.count(False)
+            if (len(self._outcomes) >= settings.AI_CIRCUIT_MIN_CALLS
+                    and failures / len(self._outcomes) >= settings.AI_CIRCUIT_FAILURE_RATE):
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Give up a call that allow() let through without counting its outcome,
+        so that a cancelled half-open trial does not keep the breaker shut
+        """
+        with self._lock:
+            if self._opened_at is not None:
+                self._trial_running = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._outcomes.clear()
+            self._opened_at = None
+            self._trial_running = False
+
+
+breaker = CircuitBreaker()
+
+
+def _backoff(retry: int) -> float:
+    # Exponential, with jitter so that workers do not retry in lockstep
+    delay = min(settings.AI_RETRY_BACKOFF_MAX, settings.AI_RETRY_BACKOFF * 2 ** retry)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _retry_delay(retry: int, deadline: float) -> Optional[float]:
+    """Seconds to wait before retrying a transient failure, or None to give up"""
+    delay = _backoff(retry)
+    if retry >= settings.AI_MAX_RETRIES or time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def _time_left(deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"AI request did not finish within {settings.AI_REQUEST_TIMEOUT} seconds")
+    return remaining
+
+
+def generate(model, prompt: str) -> str:
+    """
+    Call model.generate_content within the deadline, retrying transient failures.
+
+    The whole call, retries included, finishes within AI_REQUEST_TIMEOUT
+    seconds; each attempt is given the time that remains.
+
+    Returns:
+        The response text
+
+    Raises:
+        CircuitOpenError: If the circuit breaker is open
+        Exception: The last API error once retries or time have run out
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("AI service temporarily unavailable after repeated failures")
+    deadline = time.monotonic() + settings.AI_REQUEST_TIMEOUT
+    retry = 0
+    try:
+        while True:
+            try:
+                remaining = _time_left(deadline)
+                text = model.generate_content(prompt, request_options={'timeout': remaining}).text
+            except TRANSIENT_ERRORS:
+                delay = _retry_delay(retry, deadline)
+                if delay is None:
+                    breaker.record(False)
+                    raise
+                retry += 1
+                time.sleep(delay)
+            except Exception:
+                breaker.record(False)
+                raise
+            else:
+                breaker.record(True)
+                return text
+    except BaseException as error:
+        if not isinstance(error, Exception):
+            # Cancelled or interrupted, possibly while waiting to retry: the
+            # outcome is unknown, so free a half-open trial without counting it
+            breaker.release()
+        raise
+
+
+async def generate_async(model, prompt: str) -> str:
+    """
+    Coroutine version of generate(), using the async API so that waiting on
+    Gemini does not hold a thread. The deadline is also enforced locally.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("AI service temporarily unavailable after repeated failures")
+    deadline = time.monotonic() + settings.AI_REQUEST_TIMEOUT
+    retry = 0
+    try:
+        while True:
+            try:
+                remaining = _time_left(deadline)
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, request_options={'timeout': remaining}), remaining)
+                text = response.text
+            except TRANSIENT_ERRORS:
+                delay = _retry_delay(retry, deadline)
+                if delay is None:
+                    breaker.record(False)
+                    raise
+                retry += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                breaker.record(False)
+                raise
+            else:
+                breaker.record(True)
+                return text
+    except BaseException as error:
+        if not isinstance(error, Exception):
+            # Cancelled or interrupted, possibly while waiting to retry: the
+            # outcome is unknown, so free a half-open trial without counting it
+            breaker.release()
+        raise
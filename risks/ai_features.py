@@ -3,19 +3,22 @@ AI-powered features for the Risk Management System using Google's Gemini 1.5 Fla
 """
 import os
 import json
+import asyncio
+import functools
+import logging
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
-import google.generativeai as genai
 from django.conf import settings
+from . import ai_client, prompt_budget
+from .ai_cache import generate_text, generate_text_async
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 # Configure the Gemini API
 def setup_gemini_api():
-    """Initialize the Gemini API with the API key from settings"""
-    api_key = getattr(settings, 'GEMINI_API_KEY', None)
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not set in settings")
-    genai.configure(api_key=api_key)
+    """Initialize the Gemini API with the API key from settings (only the first call does any work)"""
+    ai_client.configure()
 
 def extract_json_from_response(response_text: str) -> str:
     """
@@ -42,6 +45,118 @@ def extract_json_from_response(response_text: str) -> str:
     # If no markdown markers, return as is
     return response_text.strip()
 
+def _resume(steps, response=None, error=None):
+    """
+    Resume an AI function generator with a response, or raise an error at its yield.
+    
+    Returns:
+        (True, result) once the function returns, or (False, request) when
+        it asks for another response
+    """
+    try:
+        return False, steps.throw(error) if error is not None else steps.send(response)
+    except StopIteration as stop:
+        return True, stop.value
+
+def gemini_call(function):
+    """
+    Turn a generator that yields its prompt into a function that calls Gemini.
+    
+    The decorated function builds a prompt, receives the response text as the
+    value of `yield prompt`, and parses it; an API error is raised at the
+    yield, so the function's own except clause supplies the fallback result.
+    A missing GEMINI_API_KEY raises ValueError to the caller instead.
+    It may also yield a list of prompts and receive a list of responses, and
+    may yield more than once, e.g. to merge the answers to several prompts.
+    The returned function calls the API synchronously, and its `asynchronous`
+    attribute is a coroutine function doing the same with the async API, which
+    sends a list of prompts concurrently.
+    """
+    name = function.__name__
+    
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        # Outside the generator: a missing API key is a configuration error
+        # for the caller, not a failed call for the fallback to cover
+        model = ai_client.get_model()
+        steps = function(*args, **kwargs)
+        request = next(steps)
+        while True:
+            try:
+                if isinstance(request, list):
+                    response = [generate_text(name, model, prompt) for prompt in request]
+                else:
+                    response = generate_text(name, model, request)
+            except Exception as e:
+                done, request = _resume(steps, error=e)
+            else:
+                done, request = _resume(steps, response)
+            if done:
+                return request
+    
+    async def call_async(*args, **kwargs):
+        model = ai_client.get_model()
+        steps = function(*args, **kwargs)
+        request = next(steps)
+        while True:
+            try:
+                if isinstance(request, list):
+                    response = list(await asyncio.gather(
+                        *(generate_text_async(name, model, prompt) for prompt in request)))
+                else:
+                    response = await generate_text_async(name, model, request)
+            except Exception as e:
+                done, request = _resume(steps, error=e)
+            else:
+                done, request = _resume(steps, response)
+            if done:
+                return request
+    
+    call_async.__name__ = f'{name}_async'
+    call.asynchronous = call_async
+    return call
+
+def _analyze_in_chunks(chunks: List[List[str]], omitted: int, build_prompt, response_format: str):
+    """
+    Ask for a project analysis over risk entries packed by prompt_budget.pack.
+    
+    Used with `yield from` inside a gemini_call function. A single chunk is
+    analyzed by one prompt; several are analyzed concurrently and their
+    answers merged by a further prompt.
+    
+    Args:
+        chunks: Rendered risk entries per chunk
+        omitted: Number of risks left out of the chunks
+        build_prompt: Makes the prompt from the risk list text and a note on its scope
+        response_format: The JSON format both the chunk and merge prompts answer in
+        
+    Returns:
+        The text of the final response
+    """
+    omitted_note = f"{omitted} lower-priority risks were left out for length." if omitted else ""
+    if len(chunks) == 1:
+        return (yield build_prompt("\n\n".join(chunks[0]), omitted_note))
+    
+    partial_texts = yield [
+        build_prompt("\n\n".join(chunk), f"These risks are part {part} of {len(chunks)} of the project's risks.")
+        for part, chunk in enumerate(chunks, 1)
+    ]
+    partials = [json.loads(extract_json_from_response(text)) for text in partial_texts]
+    
+    return (yield f"""
+    As a risk management consultant, merge these {len(partials)} analyses of parts of the same project's
+    risks into one analysis of the whole project. Combine findings that describe the same thing, keep the
+    most significant ones, and connect findings from different parts where they relate.
+    {omitted_note}
+    
+    PARTIAL ANALYSES (JSON):
+    {prompt_budget.fit_json(partials)}
+    
+    FORMAT YOUR RESPONSE AS JSON:
+    {response_format}
+    """)
+
+@gemini_call
 def enhance_risk_description(raw_description: str, category: str = None) -> Dict[str, Any]:
     """
     Use Gemini to enhance and standardize risk descriptions.
@@ -53,14 +168,9 @@ def enhance_risk_description(raw_description: str, category: str = None) -> Dict
     Returns:
         Dictionary with enhanced description and suggested improvements
     """
-    setup_gemini_api()
-    
     # Create a system prompt with formatting instructions
     context = f"Category: {category}" if category else "No category specified"
     
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
     # Create the prompt with guidance for the model
     prompt = f"""
     As a risk management expert, improve this risk description to be clearer and more specific.
@@ -88,10 +198,10 @@ def enhance_risk_description(raw_description: str, category: str = None) -> Dict
     
     try:
         # Generate the response
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         
         # Extract clean JSON from response (handles markdown code blocks)
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
         
         # Parse the JSON response
         result = json.loads(clean_json)
@@ -107,10 +217,35 @@ def enhance_risk_description(raw_description: str, category: str = None) -> Dict
             "clarity_score": 5
         }
 
+# Response format of analyze_risk_trend, for its chunk and merge prompts
+RISK_TREND_FORMAT = """{
+      "identified_patterns": [
+        {
+          "pattern": "Pattern name",
+          "description": "Pattern description",
+          "affected_risks": [risk numbers]
+        }
+      ],
+      "mitigation_recommendations": [
+        {
+          "recommendation": "Specific recommendation",
+          "addresses_patterns": [pattern names]
+        }
+      ],
+      "potential_blind_spots": [
+        "Blind spot description"
+      ]
+    }"""
+
+@gemini_call
 def analyze_risk_trend(risk_titles: List[str], risk_descriptions: List[str]) -> Dict[str, Any]:
     """
     Analyze trends across multiple project risks to identify common themes or patterns.
     
+    The risks should come most important first: if they do not fit the prompt
+    budget, descriptions are shortened and the list is analyzed in chunks,
+    leaving out the last risks if there are too many.
+    
     Args:
         risk_titles: List of risk titles
         risk_descriptions: List of risk descriptions
@@ -118,21 +253,17 @@ def analyze_risk_trend(risk_titles: List[str], risk_descriptions: List[str]) ->
     Returns:
         Dictionary with identified patterns and recommendations
     """
-    setup_gemini_api()
-    
     # Prepare input data - combine titles and descriptions
-    risks_data = []
-    for i, (title, desc) in enumerate(zip(risk_titles, risk_descriptions)):
-        risks_data.append(f"Risk {i+1}: {title} - {desc}")
-    
-    risks_text = "\n\n".join(risks_data)
-    
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    entries = [
+        (f"Risk {i+1}: {title} - {{description}}", desc)
+        for i, (title, desc) in enumerate(zip(risk_titles, risk_descriptions))
+    ]
+    chunks, omitted = prompt_budget.pack(entries)
     
-    # Create the prompt
-    prompt = f"""
+    def build_prompt(risks_text, note):
+        return f"""
     As a risk management consultant, analyze these project risks to identify patterns and provide recommendations.
+    The risks are listed most important first. {note}
     
     PROJECT RISKS:
     {risks_text}
@@ -144,34 +275,20 @@ def analyze_risk_trend(risk_titles: List[str], risk_descriptions: List[str]) ->
     4. Return your analysis as structured JSON
     
     FORMAT YOUR RESPONSE AS JSON:
-    {{
-      "identified_patterns": [
-        {{
-          "pattern": "Pattern name",
-          "description": "Pattern description",
-          "affected_risks": [risk numbers]
-        }}
-      ],
-      "mitigation_recommendations": [
-        {{
-          "recommendation": "Specific recommendation",
-          "addresses_patterns": [pattern names]
-        }}
-      ],
-      "potential_blind_spots": [
-        "Blind spot description"
-      ]
-    }}
+    {RISK_TREND_FORMAT}
     """
+    
     try:
         # Generate the response
-        response = model.generate_content(prompt)
+        response_text = yield from _analyze_in_chunks(chunks, omitted, build_prompt, RISK_TREND_FORMAT)
         
         # Extract clean JSON from response (handles markdown code blocks)
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
         
         # Parse the JSON response
         result = json.loads(clean_json)
+        if omitted:
+            result['omitted_risks'] = omitted
         return result
     
     except Exception as e:
@@ -183,6 +300,7 @@ def analyze_risk_trend(risk_titles: List[str], risk_descriptions: List[str]) ->
             "potential_blind_spots": ["AI analysis unavailable"]
         }
 
+@gemini_call
 def generate_risk_response_suggestions(risk_description: str, risk_category: str, 
                                       likelihood: int, impact: int) -> List[Dict[str, str]]:
     """
@@ -197,15 +315,10 @@ def generate_risk_response_suggestions(risk_description: str, risk_category: str
     Returns:
         List of response strategy dictionaries
     """
-    setup_gemini_api()
-    
     # Map numeric values to text representations
     likelihood_text = {1: "Low", 2: "Medium", 3: "High"}.get(likelihood, "Medium")
     impact_text = {1: "Low", 2: "Medium", 3: "High"}.get(impact, "Medium")
     
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
     # Create the prompt
     prompt = f"""
     As a risk management consultant, suggest response strategies for this risk.
@@ -238,10 +351,10 @@ def generate_risk_response_suggestions(risk_description: str, risk_category: str
     """
     try:
         # Generate the response
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         
         # Extract clean JSON from response (handles markdown code blocks)
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
         
         # Parse the JSON response
         result = json.loads(clean_json)
@@ -259,6 +372,7 @@ def generate_risk_response_suggestions(risk_description: str, risk_category: str
             "resources_required": "Standard resources"
         }]
 
+@gemini_call
 def smart_risk_search(query: str, project_context: str = None) -> Dict[str, Any]:
     """
     Semantic search for risks using natural language understanding.
@@ -270,10 +384,6 @@ def smart_risk_search(query: str, project_context: str = None) -> Dict[str, Any]
     Returns:
         Dictionary with search interpretation and search parameters
     """
-    setup_gemini_api()
-    
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
     # Create the prompt
     context = f"Project context: {project_context}" if project_context else "No specific project context provided"
@@ -308,10 +418,10 @@ def smart_risk_search(query: str, project_context: str = None) -> Dict[str, Any]
     """
     try:
         # Generate the response
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         
         # Extract clean JSON from response (handles markdown code blocks)
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
         
         # Parse the JSON response
         result = json.loads(clean_json)
@@ -331,6 +441,7 @@ def smart_risk_search(query: str, project_context: str = None) -> Dict[str, Any]
             },            "rewritten_query": query
         }
 
+@gemini_call
 def ai_risk_scoring_assistant(risk_title: str, risk_description: str, 
                             risk_category: str = None, project_context: str = None) -> Dict[str, Any]:
     """
@@ -345,8 +456,6 @@ def ai_risk_scoring_assistant(risk_title: str, risk_description: str,
     Returns:
         Dictionary with suggested scores and detailed reasoning
     """
-    setup_gemini_api()
-    
     # Prepare context information
     context_info = []
     if risk_category:
@@ -356,9 +465,6 @@ def ai_risk_scoring_assistant(risk_title: str, risk_description: str,
     
     context_text = "\n".join(context_info) if context_info else "No additional context provided"
     
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
     # Create the comprehensive prompt for risk scoring
     prompt = f"""
     As an expert risk management consultant with deep knowledge of risk assessment methodologies, 
@@ -437,17 +543,17 @@ def ai_risk_scoring_assistant(risk_title: str, risk_description: str,
     
     try:
         # Generate the response
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         
         # Extract clean JSON from response (handles markdown code blocks)
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
         
         # Parse the JSON response
         result = json.loads(clean_json)
         
         # Add metadata
         result['ai_analysis_timestamp'] = str(datetime.now())
-        result['model_used'] = 'gemini-1.5-flash'
+        result['model_used'] = settings.AI_MODEL_NAME
         
         return result
     
@@ -481,6 +587,7 @@ def ai_risk_scoring_assistant(risk_title: str, risk_description: str,
             "assessment_notes": f"AI analysis failed: {str(e)}"
         }
 
+@gemini_call
 def auto_categorize_risk(risk_description: str, available_categories: List[str]) -> Dict[str, Any]:
     """
     Automatically suggest the most appropriate risk category based on description.
@@ -492,8 +599,6 @@ def auto_categorize_risk(risk_description: str, available_categories: List[str])
     Returns:
         Dictionary with suggested category and confidence
     """
-    setup_gemini_api()
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
     categories_text = ", ".join(available_categories)
     
@@ -521,10 +626,10 @@ def auto_categorize_risk(risk_description: str, available_categories: List[str])
     """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         # Extract clean JSON from response (handles markdown code blocks)
 
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
 
         result = json.loads(clean_json)
         
@@ -545,6 +650,188 @@ def auto_categorize_risk(risk_description: str, available_categories: List[str])
             "keywords_identified": []
         }
 
+def _indexed_results(response_text: str, count: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Parse a JSON array of objects carrying an "index" field into {index: object}.
+    
+    Items with a missing or out-of-range index are dropped, as are indexes
+    that appear more than once, since it is unclear which answer is meant.
+    """
+    items = json.loads(extract_json_from_response(response_text))
+    if isinstance(items, dict):
+        items = items.get('results', [])
+    results, repeated = {}, set()
+    for item in items:
+        index = item.get('index') if isinstance(item, dict) else None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < count:
+            continue
+        if index in results:
+            repeated.add(index)
+        results[index] = item
+    return {index: item for index, item in results.items() if index not in repeated}
+
+def _risk_lines(risks: List[Dict]) -> str:
+    """Number the risks of a batch prompt by their position"""
+    lines = []
+    for index, risk in enumerate(risks):
+        line = f"[{index}] Title: {risk.get('title', '')} | Description: {risk.get('description', '')}"
+        if risk.get('category'):
+            line += f" | Category: {risk['category']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def _score(value) -> Optional[int]:
+    """A 1-3 likelihood or impact score, or None if the value is not one"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if isinstance(value, bool) or not isinstance(value, int):
+        return None
+    return value if 1 <= value <= 3 else None
+
+@gemini_call
+def batch_auto_categorize_risks(risks: List[Dict], available_categories: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Suggest categories for several risks with one API call.
+    
+    Args:
+        risks: Dictionaries with the title and description of each risk
+        available_categories: List of available category names
+        
+    Returns:
+        One entry per risk, in order: a dictionary with the suggested category,
+        confidence and reasoning, or None where the response had no valid answer
+    """
+    categories_text = ", ".join(available_categories)
+    
+    prompt = f"""
+    As a risk management expert, categorize each of the following {len(risks)} risks.
+    
+    AVAILABLE CATEGORIES: {categories_text}
+    
+    RISKS:
+    {_risk_lines(risks)}
+    
+    INSTRUCTIONS:
+    1. Choose exactly one category from the available options for every risk
+    2. Answer every risk, identified by the number in square brackets
+    3. Keep the reasoning to one sentence
+    
+    FORMAT AS A JSON ARRAY WITH ONE OBJECT PER RISK:
+    [
+      {{
+        "index": 0,
+        "suggested_category": "Category name from available list",
+        "confidence": 0.0-1.0,
+        "reasoning": "One sentence explaining the choice"
+      }}
+    ]
+    """
+    
+    try:
+        response_text = yield prompt
+        answers = _indexed_results(response_text, len(risks))
+    except Exception:
+        # Every risk counts as unanswered, so a backfill retries or gives up on them
+        logger.exception("Batch auto categorization failed")
+        return [None] * len(risks)
+    
+    # Category names are matched case-insensitively but returned as listed
+    categories = {name.lower(): name for name in available_categories}
+    results = []
+    for index in range(len(risks)):
+        answer = answers.get(index, {})
+        category = categories.get(str(answer.get('suggested_category', '')).strip().lower())
+        try:
+            confidence = min(max(float(answer.get('confidence', 0.5)), 0.0), 1.0)
+        except (TypeError, ValueError):
+            confidence = None
+        if category is None or confidence is None:
+            results.append(None)
+            continue
+        results.append({
+            'suggested_category': category,
+            'confidence': confidence,
+            'reasoning': str(answer.get('reasoning', '')),
+        })
+    return results
+
+@gemini_call
+def batch_ai_risk_scoring(risks: List[Dict], project_context: str = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Suggest likelihood and impact scores for several risks with one API call.
+    
+    Args:
+        risks: Dictionaries with the title, description and optional category of each risk
+        project_context: Optional context about the project
+        
+    Returns:
+        One entry per risk, in order: a dictionary with the likelihood and
+        impact scores (1-3), confidence level and reasoning, or None where the
+        response had no valid answer
+    """
+    context_text = f"Project Context: {project_context}" if project_context else "No additional context provided"
+    
+    prompt = f"""
+    As an expert risk management consultant, score each of the following {len(risks)} risks.
+    
+    {context_text}
+    
+    RISKS:
+    {_risk_lines(risks)}
+    
+    SCORING CRITERIA:
+    
+    LIKELIHOOD SCALE (1-3):
+    - 1 (Low): 0-33% chance of occurring within project timeframe
+    - 2 (Medium): 34-66% chance of occurring within project timeframe
+    - 3 (High): 67-100% chance of occurring within project timeframe
+    
+    IMPACT SCALE (1-3):
+    - 1 (Low): Minor impact on project objectives, timeline, or budget (<10% impact)
+    - 2 (Medium): Moderate impact on project objectives, timeline, or budget (10-25% impact)
+    - 3 (High): Major impact on project objectives, timeline, or budget (>25% impact)
+    
+    INSTRUCTIONS:
+    1. Score every risk, identified by the number in square brackets
+    2. Keep the reasoning to one sentence
+    
+    FORMAT AS A JSON ARRAY WITH ONE OBJECT PER RISK:
+    [
+      {{
+        "index": 0,
+        "likelihood": 1-3,
+        "impact": 1-3,
+        "confidence_level": "High/Medium/Low",
+        "reasoning": "One sentence explaining both scores"
+      }}
+    ]
+    """
+    
+    try:
+        response_text = yield prompt
+        answers = _indexed_results(response_text, len(risks))
+    except Exception:
+        # Every risk counts as unanswered, so a backfill retries or gives up on them
+        logger.exception("Batch AI risk scoring failed")
+        return [None] * len(risks)
+    
+    results = []
+    for index in range(len(risks)):
+        answer = answers.get(index, {})
+        likelihood, impact = _score(answer.get('likelihood')), _score(answer.get('impact'))
+        if likelihood is None or impact is None:
+            results.append(None)
+            continue
+        confidence_level = str(answer.get('confidence_level', 'Medium')).capitalize()
+        results.append({
+            'likelihood': likelihood,
+            'impact': impact,
+            'confidence_level': confidence_level if confidence_level in ('High', 'Medium', 'Low') else 'Medium',
+            'reasoning': str(answer.get('reasoning', '')),
+        })
+    return results
+
+@gemini_call
 def optimize_monte_carlo_estimates(risk_description: str, category: str = None, 
                                   historical_data: List[Dict] = None) -> Dict[str, Any]:
     """
@@ -558,8 +845,6 @@ def optimize_monte_carlo_estimates(risk_description: str, category: str = None,
     Returns:
         Dictionary with suggested cost estimates and probability
     """
-    setup_gemini_api()
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
     context = f"Category: {category}" if category else "No category specified"
     historical_context = ""
@@ -597,10 +882,10 @@ def optimize_monte_carlo_estimates(risk_description: str, category: str = None,
     """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         # Extract clean JSON from response (handles markdown code blocks)
 
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
 
         return json.loads(clean_json)
     except Exception as e:
@@ -616,9 +901,48 @@ def optimize_monte_carlo_estimates(risk_description: str, category: str = None,
             "confidence_level": "Low"
         }
 
+# Response format of analyze_risk_dependencies, for its chunk and merge prompts
+RISK_DEPENDENCY_FORMAT = """{
+      "risk_dependencies": [
+        {
+          "primary_risk": "Risk title",
+          "dependent_risks": ["Risk title 1", "Risk title 2"],
+          "dependency_type": "Triggers/Amplifies/Enables",
+          "impact_description": "How the dependency works"
+        }
+      ],
+      "cascade_scenarios": [
+        {
+          "trigger_risk": "Risk title",
+          "cascade_path": ["Risk 1", "Risk 2", "Risk 3"],
+          "total_impact": "High/Medium/Low",
+          "scenario_description": "Description of cascade effect"
+        }
+      ],
+      "risk_clusters": [
+        {
+          "cluster_name": "Cluster description",
+          "risks": ["Risk 1", "Risk 2", "Risk 3"],
+          "management_strategy": "How to manage this cluster together"
+        }
+      ],
+      "critical_risks": [
+        {
+          "risk": "Risk title",
+          "criticality_reason": "Why this risk is critical",
+          "affected_risks_count": 3
+        }
+      ]
+    }"""
+
+@gemini_call
 def analyze_risk_dependencies(project_risks: List[Dict]) -> Dict[str, Any]:
     """
-    Identify potential relationships and cascading effects between project risks.
+    Identify potential relationships and cascade effects between project risks.
+    
+    The risks should come most important first: if they do not fit the prompt
+    budget, descriptions are shortened and the list is analyzed in chunks,
+    leaving out the last risks if there are too many.
     
     Args:
         project_risks: List of risk dictionaries with title, description, category, etc.
@@ -626,18 +950,21 @@ def analyze_risk_dependencies(project_risks: List[Dict]) -> Dict[str, Any]:
     Returns:
         Dictionary with identified dependencies and cascade effects
     """
-    setup_gemini_api()
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
-    risks_text = ""
-    for i, risk in enumerate(project_risks):
-        risks_text += f"Risk {i+1}: {risk.get('title', 'Untitled')}\n"
-        risks_text += f"  Category: {risk.get('category', 'N/A')}\n"
-        risks_text += f"  Description: {risk.get('description', 'No description')}\n"
-        risks_text += f"  Risk Score: {risk.get('risk_score', 'N/A')}\n\n"
+    entries = [
+        (f"Risk {i+1}: {risk.get('title', 'Untitled')}\n"
+         f"  Category: {risk.get('category', 'N/A')}\n"
+         f"  Description: {{description}}\n"
+         f"  Risk Score: {risk.get('risk_score', 'N/A')}",
+         risk.get('description') or 'No description')
+        for i, risk in enumerate(project_risks)
+    ]
+    chunks, omitted = prompt_budget.pack(entries)
     
-    prompt = f"""
+    def build_prompt(risks_text, note):
+        return f"""
     As a risk management expert, analyze these project risks to identify dependencies and potential cascade effects.
+    The risks are listed most important first. {note}
     
     PROJECT RISKS:
     {risks_text}
@@ -650,47 +977,19 @@ def analyze_risk_dependencies(project_risks: List[Dict]) -> Dict[str, Any]:
     5. Provide mitigation strategies for high-impact dependencies
     
     FORMAT AS JSON:
-    {{
-      "risk_dependencies": [
-        {{
-          "primary_risk": "Risk title",
-          "dependent_risks": ["Risk title 1", "Risk title 2"],
-          "dependency_type": "Triggers/Amplifies/Enables",
-          "impact_description": "How the dependency works"
-        }}
-      ],
-      "cascade_scenarios": [
-        {{
-          "trigger_risk": "Risk title",
-          "cascade_path": ["Risk 1", "Risk 2", "Risk 3"],
-          "total_impact": "High/Medium/Low",
-          "scenario_description": "Description of cascade effect"
-        }}
-      ],
-      "risk_clusters": [
-        {{
-          "cluster_name": "Cluster description",
-          "risks": ["Risk 1", "Risk 2", "Risk 3"],
-          "management_strategy": "How to manage this cluster together"
-        }}
-      ],
-      "critical_risks": [
-        {{
-          "risk": "Risk title",
-          "criticality_reason": "Why this risk is critical",
-          "affected_risks_count": 3
-        }}
-      ]
-    }}
+    {RISK_DEPENDENCY_FORMAT}
     """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = yield from _analyze_in_chunks(chunks, omitted, build_prompt, RISK_DEPENDENCY_FORMAT)
         # Extract clean JSON from response (handles markdown code blocks)
 
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
 
-        return json.loads(clean_json)
+        result = json.loads(clean_json)
+        if omitted:
+            result['omitted_risks'] = omitted
+        return result
     except Exception as e:
         print(f"Error in risk dependency analysis: {e}")
         return {
@@ -700,6 +999,7 @@ def analyze_risk_dependencies(project_risks: List[Dict]) -> Dict[str, Any]:
             "critical_risks": []
         }
 
+@gemini_call
 def generate_executive_summary(project_risks: List[Dict], monte_carlo_results: Dict = None) -> Dict[str, Any]:
     """
     Create executive-friendly risk summaries with key insights and recommendations.
@@ -711,8 +1011,6 @@ def generate_executive_summary(project_risks: List[Dict], monte_carlo_results: D
     Returns:
         Dictionary with executive summary components
     """
-    setup_gemini_api()
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
     # Prepare risk summary
     total_risks = len(project_risks)
@@ -785,10 +1083,10 @@ def generate_executive_summary(project_risks: List[Dict], monte_carlo_results: D
     """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         # Extract clean JSON from response (handles markdown code blocks)
 
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
 
         return json.loads(clean_json)
     except Exception as e:
@@ -805,6 +1103,7 @@ def generate_executive_summary(project_risks: List[Dict], monte_carlo_results: D
             "next_steps": ["Conduct manual risk review"]
         }
 
+@gemini_call
 def generate_mitigation_timeline(risk_responses: List[Dict], project_constraints: Dict = None) -> Dict[str, Any]:
     """
     AI suggests optimal sequencing and timing for risk response activities.
@@ -816,8 +1115,6 @@ def generate_mitigation_timeline(risk_responses: List[Dict], project_constraints
     Returns:
         Dictionary with suggested timeline and prioritization
     """
-    setup_gemini_api()
-    model = genai.GenerativeModel('gemini-1.5-flash')
     
     responses_text = ""
     for i, response in enumerate(risk_responses):
@@ -891,10 +1188,10 @@ def generate_mitigation_timeline(risk_responses: List[Dict], project_constraints
     """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = yield prompt
         # Extract clean JSON from response (handles markdown code blocks)
 
-        clean_json = extract_json_from_response(response.text)
+        clean_json = extract_json_from_response(response_text)
 
         return json.loads(clean_json)
     except Exception as e:
@@ -910,3 +1207,17 @@ def generate_mitigation_timeline(risk_responses: List[Dict], project_constraints
             "dependencies": [],
             "risk_timeline_summary": "AI timeline generation unavailable - manual planning required"
         }
+
+# Coroutine versions of the AI functions, for async views
+enhance_risk_description_async = enhance_risk_description.asynchronous
+analyze_risk_trend_async = analyze_risk_trend.asynchronous
+generate_risk_response_suggestions_async = generate_risk_response_suggestions.asynchronous
+smart_risk_search_async = smart_risk_search.asynchronous
+ai_risk_scoring_assistant_async = ai_risk_scoring_assistant.asynchronous
+auto_categorize_risk_async = auto_categorize_risk.asynchronous
+batch_auto_categorize_risks_async = batch_auto_categorize_risks.asynchronous
+batch_ai_risk_scoring_async = batch_ai_risk_scoring.asynchronous
+optimize_monte_carlo_estimates_async = optimize_monte_carlo_estimates.asynchronous
+analyze_risk_dependencies_async = analyze_risk_dependencies.asynchronous
+generate_executive_summary_async = generate_executive_summary.asynchronous
+generate_mitigation_timeline_async = generate_mitigation_timeline.asynchronous
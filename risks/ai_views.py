@@ -1,25 +1,56 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, aget_object_or_404
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+import asyncio
 import json
-from .models import Risk, Project
+import logging
+from .models import Risk, Project, Category
 from .ai_features import (
-    enhance_risk_description, 
-    analyze_risk_trend, 
-    generate_risk_response_suggestions,
-    smart_risk_search,
-    ai_risk_scoring_assistant,
-    auto_categorize_risk,
-    optimize_monte_carlo_estimates,
+    enhance_risk_description_async,
+    analyze_risk_trend,
+    analyze_risk_trend_async,
+    generate_risk_response_suggestions_async,
+    smart_risk_search_async,
+    ai_risk_scoring_assistant_async,
+    auto_categorize_risk_async,
+    optimize_monte_carlo_estimates_async,
     analyze_risk_dependencies,
+    analyze_risk_dependencies_async,
     generate_executive_summary,
-    generate_mitigation_timeline
+    generate_executive_summary_async,
+    generate_mitigation_timeline,
+    generate_mitigation_timeline_async
 )
+from .jobs import check_param_names, job_project_id, should_run_in_background
+from .prompt_budget import by_importance
+from .search import apply_search_parameters
+from .similarity import similar_risks as find_similar_risks
+from .views import register_row
+from .job_views import background_job_response
+
+# The AI views are async: under ASGI a worker keeps serving other requests
+# while Gemini answers. Database work runs through sync_to_async.
+
+logger = logging.getLogger(__name__)
+
+def _build_payload(load_inputs, result_key, analyze, *args):
+    """Load a project analysis' inputs, run the analysis and add its result to the payload"""
+    payload, inputs = load_inputs(*args)
+    if inputs is not None:
+        payload[result_key] = analyze(*inputs)
+    return payload
+
+async def _build_payload_async(load_inputs, result_key, analyze_async, *args):
+    payload, inputs = await sync_to_async(load_inputs)(*args)
+    if inputs is not None:
+        payload[result_key] = await analyze_async(*inputs)
+    return payload
 
 @require_POST
 @login_required
-def enhance_risk_description_view(request):
+async def enhance_risk_description_view(request):
     """API endpoint to enhance risk descriptions using Gemini"""
     try:
         data = json.loads(request.body)
@@ -29,7 +60,7 @@ def enhance_risk_description_view(request):
         if not description:
             return JsonResponse({'error': 'No description provided'}, status=400)
         
-        result = enhance_risk_description(description, category)
+        result = await enhance_risk_description_async(description, category)
         
         return JsonResponse({
             'success': True,
@@ -42,39 +73,52 @@ def enhance_risk_description_view(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-@login_required
-def analyze_risk_trends_view(request, project_id):
-    """Analyze trends across project risks"""
-    project = get_object_or_404(Project, id=project_id)
+def _risk_trends_inputs(project_id):
+    """The trend payload without its analysis, and the analyze_risk_trend arguments (None if nothing to analyze)"""
+    project = Project.objects.get(id=project_id)
     
-    # Get all active risks for the project
-    risks = project.risks.filter(status='Open')
+    # Get all active risks for the project, most important first so they
+    # survive if the prompt has to be cut down
+    risks = by_importance(project.risks.filter(status='Open'))
     
     if not risks:
-        return JsonResponse({
+        return {
             'success': False,
             'message': 'No active risks found for analysis'
-        })
+        }, None
     
     # Extract risk data
     risk_titles = [risk.title for risk in risks]
     risk_descriptions = [risk.description for risk in risks]
     
-    # Get the analysis
-    analysis = analyze_risk_trend(risk_titles, risk_descriptions)
-    
-    # Return the results
-    return JsonResponse({
+    return {
         'success': True,
         'project_name': project.name,
-        'analysis': analysis,
         'risk_count': len(risk_titles)
-    })
+    }, (risk_titles, risk_descriptions)
+
+def risk_trends_payload(project_id):
+    """Analyze trends across a project's open risks and build the JSON payload"""
+    return _build_payload(_risk_trends_inputs, 'analysis', analyze_risk_trend, project_id)
+
+async def risk_trends_payload_async(project_id):
+    return await _build_payload_async(_risk_trends_inputs, 'analysis', analyze_risk_trend_async, project_id)
+
+@login_required
+async def analyze_risk_trends_view(request, project_id):
+    """Analyze trends across project risks"""
+    project = await aget_object_or_404(Project, id=project_id)
+    
+    if should_run_in_background(request):
+        return await sync_to_async(background_job_response)(request, 'analyze_risk_trends', {'project_id': project.id})
+    
+    # Return the results
+    return JsonResponse(await risk_trends_payload_async(project.id))
 
 @login_required
-def generate_risk_response_suggestions_view(request, risk_id):
+async def generate_risk_response_suggestions_view(request, risk_id):
     """Generate AI-powered risk response suggestions"""
-    risk = get_object_or_404(Risk, id=risk_id)
+    risk = await aget_object_or_404(Risk.objects.select_related('category'), id=risk_id)
     
     # Convert likelihood and impact to integer values (1, 2, 3)
     likelihood = risk.likelihood
@@ -84,7 +128,7 @@ def generate_risk_response_suggestions_view(request, risk_id):
     category = risk.category.name if risk.category else "General"
     
     # Generate suggestions
-    suggestions = generate_risk_response_suggestions(
+    suggestions = await generate_risk_response_suggestions_async(
         risk.description,
         category,
         likelihood,
@@ -99,10 +143,12 @@ def generate_risk_response_suggestions_view(request, risk_id):
 
 @require_POST
 @login_required
-def smart_risk_search_view(request):
+async def smart_risk_search_view(request):
     """Natural language search for risks using Gemini"""
     try:
         data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
         query = data.get('query', '')
         project_id = data.get('project_id', None)
         
@@ -112,23 +158,36 @@ def smart_risk_search_view(request):
         # Get project context if provided
         project_context = None
         if project_id:
-            project = get_object_or_404(Project, id=project_id)
+            project = await aget_object_or_404(Project, id=project_id)
             project_context = f"Project: {project.name} - {project.description}"
         
         # Process the search
-        search_result = smart_risk_search(query, project_context)
+        search_result = await smart_risk_search_async(query, project_context)
+        if not isinstance(search_result, dict) or not isinstance(search_result.get('search_parameters') or {}, dict):
+            return JsonResponse({'error': 'The AI returned a search in an unexpected format'}, status=502)
+        
+        # Run the interpreted parameters against the search index
+        def matching_rows():
+            risks = Risk.objects.filter(project_id=project_id) if project_id else Risk.objects.all()
+            matches = apply_search_parameters(search_result.get('search_parameters') or {}, risks)
+            return [dict(register_row(risk), rank=rank) for risk, rank in matches]
         
         return JsonResponse({
             'success': True,
             'search_result': search_result,
+            'results': await sync_to_async(matching_rows)(),
         })
         
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    except ValueError as e:
+        # Malformed JSON or search parameters that cannot be applied
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception:
+        logger.exception('Smart risk search failed')
+        return JsonResponse({'error': 'Smart search failed'}, status=500)
 
 @require_POST
 @login_required
-def ai_risk_scoring_assistant_view(request):
+async def ai_risk_scoring_assistant_view(request):
     """AI-powered risk scoring suggestions with reasoning"""
     try:
         data = json.loads(request.body)
@@ -139,23 +198,26 @@ def ai_risk_scoring_assistant_view(request):
         if not description:
             return JsonResponse({'error': 'No risk description provided'}, status=400)
         
-        # Get similar risks for context if project is specified
-        similar_risks = []
+        # Describe the project and its risks nearest to this description, for context
+        project_context = None
         if project_id:
-            project = get_object_or_404(Project, id=project_id)
-            # Get similar risks from the same project
-            project_risks = project.risks.all()[:5]  # Limit to 5 for context
-            similar_risks = [
-                {
-                    'title': risk.title,
-                    'likelihood': risk.likelihood,
-                    'impact': risk.impact,
-                    'risk_score': risk.risk_score
-                }
-                for risk in project_risks
-            ]
-        
-        result = ai_risk_scoring_assistant(description, category, similar_risks)
+            project = await aget_object_or_404(Project, id=project_id)
+            similar_risks = await sync_to_async(find_similar_risks)(description, k=5, project_id=project.id)
+            context_lines = [f"{project.name} - {project.description}"]
+            if similar_risks:
+                context_lines.append("Similar risks already in this project:")
+                context_lines.extend(
+                    f"- {risk.title} (likelihood {risk.likelihood}, impact {risk.impact}, score {risk.score})"
+                    for risk, _ in similar_risks
+                )
+            project_context = "\n".join(context_lines)
+        
+        result = await ai_risk_scoring_assistant_async(
+            risk_title=data.get('title') or description,
+            risk_description=description,
+            risk_category=category,
+            project_context=project_context,
+        )
         
         return JsonResponse({
             'success': True,
@@ -167,7 +229,7 @@ def ai_risk_scoring_assistant_view(request):
 
 @require_POST
 @login_required
-def auto_categorize_risk_view(request):
+async def auto_categorize_risk_view(request):
     """Auto-categorize risk based on description using AI"""
     try:
         data = json.loads(request.body)
@@ -177,14 +239,13 @@ def auto_categorize_risk_view(request):
             return JsonResponse({'error': 'No risk description provided'}, status=400)
         
         # Get available categories from the database
-        from .models import Category
-        available_categories = list(Category.objects.values_list('name', flat=True))
+        available_categories = [name async for name in Category.objects.values_list('name', flat=True)]
         
         if not available_categories:
             # Fallback to default categories if none exist in database
             available_categories = ['Technical', 'Financial', 'Operational', 'Legal']
         
-        result = auto_categorize_risk(description, available_categories)
+        result = await auto_categorize_risk_async(description, available_categories)
         
         return JsonResponse({
             'success': True,
@@ -196,7 +257,7 @@ def auto_categorize_risk_view(request):
 
 @require_POST
 @login_required
-def optimize_monte_carlo_estimates_view(request):
+async def optimize_monte_carlo_estimates_view(request):
     """AI-powered Monte Carlo parameter optimization"""
     try:
         data = json.loads(request.body)
@@ -210,24 +271,23 @@ def optimize_monte_carlo_estimates_view(request):
         # Get historical cost data for context if project is specified
         historical_data = []
         if project_id:
-            project = get_object_or_404(Project, id=project_id)
-            # Get historical cost data from similar risks
-            project_risks = project.risks.exclude(
-                most_likely_cost_impact=0
-            ).values(
-                'title', 'description', 'most_likely_cost_impact', 'category__name'
-            )[:5]
+            project = await aget_object_or_404(Project, id=project_id)
+            # Get historical cost data from the most similar costed risks
+            project_risks = await sync_to_async(find_similar_risks)(
+                description, k=5, project_id=project.id,
+                risks=project.risks.exclude(most_likely_cost_impact=0)
+            )
             
             historical_data = [
                 {
-                    'description': risk['title'],
-                    'cost': float(risk['most_likely_cost_impact']),
-                    'category': risk['category__name']
+                    'description': risk.title,
+                    'cost': float(risk.most_likely_cost_impact),
+                    'category': risk.category.name if risk.category else None
                 }
-                for risk in project_risks
+                for risk, _ in project_risks
             ]
         
-        result = optimize_monte_carlo_estimates(description, category, historical_data)
+        result = await optimize_monte_carlo_estimates_async(description, category, historical_data)
         
         return JsonResponse({
             'success': True,
@@ -237,100 +297,180 @@ def optimize_monte_carlo_estimates_view(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _risk_dependencies_inputs(project_id):
+    """The dependency payload without its analysis, and the analyze_risk_dependencies arguments"""
+    project = Project.objects.get(id=project_id)
+    
+    # Get all risks for the project, most important first
+    risks = by_importance(project.risks.select_related('category'))
+    
+    if not risks:
+        return {
+            'success': False,
+            'message': 'No risks found for dependency analysis'
+        }, None
+    
+    # Prepare risk data for analysis
+    project_risks = []
+    for risk in risks:
+        project_risks.append({
+            'title': risk.title,
+            'description': risk.description,
+            'category': risk.category.name if risk.category else 'N/A',
+            'risk_score': risk.score,
+            'likelihood': risk.likelihood,
+            'impact': risk.impact,
+            'status': risk.status
+        })
+    
+    return {
+        'success': True,
+        'project_name': project.name,
+        'total_risks_analyzed': len(project_risks)
+    }, (project_risks,)
+
+def risk_dependencies_payload(project_id):
+    """Analyze dependencies between a project's risks and build the JSON payload"""
+    return _build_payload(_risk_dependencies_inputs, 'dependency_analysis', analyze_risk_dependencies, project_id)
+
+async def risk_dependencies_payload_async(project_id):
+    return await _build_payload_async(_risk_dependencies_inputs, 'dependency_analysis',
+                                      analyze_risk_dependencies_async, project_id)
+
 @login_required
-def analyze_risk_dependencies_view(request, project_id):
+async def analyze_risk_dependencies_view(request, project_id):
     """Analyze risk dependencies and cascade effects for a project"""
     try:
-        project = get_object_or_404(Project, id=project_id)
-        
-        # Get all risks for the project
-        risks = project.risks.all()
-        
-        if not risks:
-            return JsonResponse({
-                'success': False,
-                'message': 'No risks found for dependency analysis'
-            })
-        
-        # Prepare risk data for analysis
-        project_risks = []
-        for risk in risks:
-            project_risks.append({
-                'title': risk.title,
-                'description': risk.description,
-                'category': risk.category.name if risk.category else 'N/A',
-                'risk_score': risk.risk_score,
-                'likelihood': risk.likelihood,
-                'impact': risk.impact,
-                'status': risk.status
-            })
-        
-        result = analyze_risk_dependencies(project_risks)
+        project = await aget_object_or_404(Project, id=project_id)
         
-        return JsonResponse({
-            'success': True,
-            'project_name': project.name,
-            'dependency_analysis': result,
-            'total_risks_analyzed': len(project_risks)
-        })
+        if should_run_in_background(request):
+            return await sync_to_async(background_job_response)(
+                request, 'analyze_risk_dependencies', {'project_id': project.id})
+        
+        return JsonResponse(await risk_dependencies_payload_async(project.id))
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _executive_summary_inputs(project_id):
+    """The executive summary payload without the summary, and the generate_executive_summary arguments"""
+    project = Project.objects.get(id=project_id)
+    
+    # Get all risks for the project
+    risks = project.risks.select_related('category')
+    
+    if not risks:
+        return {
+            'success': False,
+            'message': 'No risks found for executive summary'
+        }, None
+    
+    # Prepare risk data
+    project_risks = []
+    for risk in risks:
+        project_risks.append({
+            'title': risk.title,
+            'description': risk.description,
+            'category': risk.category.name if risk.category else 'N/A',
+            'risk_score': risk.score,
+            'likelihood': risk.likelihood,
+            'impact': risk.impact,
+            'status': risk.status,
+            'most_likely_cost': float(risk.most_likely_cost_impact) if risk.most_likely_cost_impact else 0
+        })
+    
+    # Calculate basic Monte Carlo context (simplified)
+    monte_carlo_results = None
+    total_exposure = sum([risk['most_likely_cost'] for risk in project_risks])
+    if total_exposure > 0:
+        monte_carlo_results = {
+            'expected_value': total_exposure,
+            'percentile_95': total_exposure * 1.5  # Simplified calculation
+        }
+    
+    return {
+        'success': True,
+        'project_name': project.name,
+        'total_risks': len(project_risks),
+        'total_financial_exposure': total_exposure
+    }, (project_risks, monte_carlo_results)
+
+def executive_summary_payload(project_id):
+    """Generate an executive summary of a project's risks and build the JSON payload"""
+    return _build_payload(_executive_summary_inputs, 'executive_summary', generate_executive_summary, project_id)
+
+async def executive_summary_payload_async(project_id):
+    return await _build_payload_async(_executive_summary_inputs, 'executive_summary',
+                                      generate_executive_summary_async, project_id)
+
 @login_required
-def generate_executive_summary_view(request, project_id):
+async def generate_executive_summary_view(request, project_id):
     """Generate executive summary for project risks"""
     try:
-        project = get_object_or_404(Project, id=project_id)
-        
-        # Get all risks for the project
-        risks = project.risks.all()
-        
-        if not risks:
-            return JsonResponse({
-                'success': False,
-                'message': 'No risks found for executive summary'
-            })
-        
-        # Prepare risk data
-        project_risks = []
-        for risk in risks:
-            project_risks.append({
-                'title': risk.title,
-                'description': risk.description,
-                'category': risk.category.name if risk.category else 'N/A',
-                'risk_score': risk.risk_score,
-                'likelihood': risk.likelihood,
-                'impact': risk.impact,
-                'status': risk.status,
-                'most_likely_cost': float(risk.most_likely_cost_impact) if risk.most_likely_cost_impact else 0
-            })
-        
-        # Calculate basic Monte Carlo context (simplified)
-        monte_carlo_results = None
-        total_exposure = sum([risk['most_likely_cost'] for risk in project_risks])
-        if total_exposure > 0:
-            monte_carlo_results = {
-                'expected_value': total_exposure,
-                'percentile_95': total_exposure * 1.5  # Simplified calculation
-            }
-        
-        result = generate_executive_summary(project_risks, monte_carlo_results)
+        project = await aget_object_or_404(Project, id=project_id)
         
-        return JsonResponse({
-            'success': True,
-            'project_name': project.name,
-            'executive_summary': result,
-            'total_risks': len(project_risks),
-            'total_financial_exposure': total_exposure
-        })
+        if should_run_in_background(request):
+            return await sync_to_async(background_job_response)(
+                request, 'generate_executive_summary', {'project_id': project.id})
+        
+        return JsonResponse(await executive_summary_payload_async(project.id))
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _mitigation_timeline_inputs(project_id, constraints=None):
+    """The timeline payload without the timeline, and the generate_mitigation_timeline arguments"""
+    project = Project.objects.get(id=project_id)
+    
+    # Get risk responses - for now we'll simulate based on existing risks
+    # In a full implementation, you'd have a RiskResponse model
+    risks = project.risks.filter(status='Open').select_related('category')
+    
+    if not risks:
+        return {
+            'success': False,
+            'message': 'No open risks found for timeline generation'
+        }, None
+    
+    # Create simulated risk responses based on existing risks
+    risk_responses = []
+    for risk in risks:
+        # Generate a basic response for each risk
+        risk_responses.append({
+            'strategy': f"Mitigate {risk.title}",
+            'risk_title': risk.title,
+            'type': 'Mitigate',
+            'implementation_complexity': 'Medium' if risk.level == 'High' else 'Low',
+            'estimated_effectiveness': 70 if risk.level == 'High' else 50,
+            'resources_required': f"Team effort for {risk.category.name if risk.category else 'general'} risk"
+        })
+    
+    return {
+        'success': True,
+        'project_name': project.name,
+        'total_responses': len(risk_responses)
+    }, (risk_responses, constraints or {})
+
+def mitigation_timeline_payload(project_id, constraints=None):
+    """Generate a mitigation timeline for a project's open risks and build the JSON payload"""
+    return _build_payload(_mitigation_timeline_inputs, 'mitigation_timeline', generate_mitigation_timeline,
+                          project_id, constraints)
+
+async def mitigation_timeline_payload_async(project_id, constraints=None):
+    return await _build_payload_async(_mitigation_timeline_inputs, 'mitigation_timeline',
+                                      generate_mitigation_timeline_async, project_id, constraints)
+
+def mitigation_timeline_job_params(params):
+    """Check the params submitted for a mitigation timeline job"""
+    check_param_names(params, ('project_id', 'constraints'))
+    constraints = params.get('constraints', {})
+    if not isinstance(constraints, dict):
+        raise ValueError('constraints must be an object')
+    return {'project_id': job_project_id(params), 'constraints': constraints}
+
 @require_POST
 @login_required
-def generate_mitigation_timeline_view(request):
+async def generate_mitigation_timeline_view(request):
     """Generate optimal timeline for risk mitigation activities"""
     try:
         data = json.loads(request.body)
@@ -340,39 +480,36 @@ def generate_mitigation_timeline_view(request):
         if not project_id:
             return JsonResponse({'error': 'Project ID required'}, status=400)
         
-        project = get_object_or_404(Project, id=project_id)
-        
-        # Get risk responses - for now we'll simulate based on existing risks
-        # In a full implementation, you'd have a RiskResponse model
-        risks = project.risks.filter(status='Open')
-        
-        if not risks:
-            return JsonResponse({
-                'success': False,
-                'message': 'No open risks found for timeline generation'
-            })
-        
-        # Create simulated risk responses based on existing risks
-        risk_responses = []
-        for risk in risks:
-            # Generate a basic response for each risk
-            risk_responses.append({
-                'strategy': f"Mitigate {risk.title}",
-                'risk_title': risk.title,
-                'type': 'Mitigate',
-                'implementation_complexity': 'Medium' if risk.risk_score >= 6 else 'Low',
-                'estimated_effectiveness': 70 if risk.risk_score >= 6 else 50,
-                'resources_required': f"Team effort for {risk.category.name if risk.category else 'general'} risk"
-            })
-        
-        result = generate_mitigation_timeline(risk_responses, constraints)
+        project = await aget_object_or_404(Project, id=project_id)
         
-        return JsonResponse({
-            'success': True,
-            'project_name': project.name,
-            'mitigation_timeline': result,
-            'total_responses': len(risk_responses)
-        })
+        params = {'project_id': project.id, 'constraints': constraints}
+        if should_run_in_background(request) or data.get('background'):
+            return await sync_to_async(background_job_response)(request, 'generate_mitigation_timeline', params)
+        
+        return JsonResponse(await mitigation_timeline_payload_async(**params))
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+@login_required
+async def project_analysis_view(request, project_id):
+    """
+    Run the trend, dependency, executive summary and mitigation timeline
+    analyses of a project concurrently, so the response takes as long as the
+    slowest of them rather than their sum.
+    """
+    project = await aget_object_or_404(Project, id=project_id)
+    
+    sections = {
+        'trends': risk_trends_payload_async(project.id),
+        'dependencies': risk_dependencies_payload_async(project.id),
+        'executive_summary': executive_summary_payload_async(project.id),
+        'mitigation_timeline': mitigation_timeline_payload_async(project.id),
+    }
+    results = await asyncio.gather(*sections.values(), return_exceptions=True)
+    
+    # One failed analysis does not sink the others
+    response = {'success': True, 'project_name': project.name}
+    for name, result in zip(sections, results):
+        response[name] = {'success': False, 'error': str(result)} if isinstance(result, Exception) else result
+    return JsonResponse(response)
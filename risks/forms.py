@@ -1,5 +1,5 @@
 from django import forms
-from .models import Project, Risk, Category, RiskResponse, UserProfile, RiskHistory
+from .models import Project, Risk, Category, CorrelationGroup, RiskResponse, UserProfile, RiskHistory
 
 class ProjectForm(forms.ModelForm):
     class Meta:
@@ -18,10 +18,18 @@ class CategoryForm(forms.ModelForm):
         }
 
 class RiskForm(forms.ModelForm):
+    def __init__(self, *args, project=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if project is not None:
+            self.instance.project = project
+        # Only the groups of the risk's own project can be chosen
+        self.fields['correlation_group'].queryset = CorrelationGroup.objects.filter(project=self.instance.project_id)
+    
     class Meta:
         model = Risk
         fields = ['title', 'description', 'category', 'likelihood', 'impact', 'owner', 'status',
-                 'likelihood_percentage', 'optimistic_cost_impact', 'most_likely_cost_impact', 'pessimistic_cost_impact']
+                 'likelihood_percentage', 'optimistic_cost_impact', 'most_likely_cost_impact', 'pessimistic_cost_impact',
+                 'cost_distribution', 'correlation_group']
         widgets = {
             'description': forms.Textarea(attrs={'rows': 3}),
             'likelihood': forms.Select(attrs={'class': 'form-select'}),
@@ -32,6 +40,8 @@ class RiskForm(forms.ModelForm):
             'optimistic_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
             'most_likely_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
             'pessimistic_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
+            'cost_distribution': forms.Select(attrs={'class': 'form-select'}),
+            'correlation_group': forms.Select(attrs={'class': 'form-select'}),
         }
         
     def clean(self):
@@ -48,6 +58,30 @@ class RiskForm(forms.ModelForm):
         
         return cleaned_data
 
+class RiskWhatIfForm(forms.ModelForm):
+    """Simulation inputs of a risk to try out in a what-if, without saving them"""
+    class Meta:
+        model = Risk
+        fields = ['likelihood_percentage', 'optimistic_cost_impact', 'most_likely_cost_impact',
+                  'pessimistic_cost_impact', 'cost_distribution', 'status']
+        
+    def clean(self):
+        cleaned_data = super().clean()
+        likelihood = cleaned_data.get('likelihood_percentage')
+        optimistic = cleaned_data.get('optimistic_cost_impact')
+        most_likely = cleaned_data.get('most_likely_cost_impact')
+        pessimistic = cleaned_data.get('pessimistic_cost_impact')
+        
+        if likelihood is not None and not (0 <= likelihood <= 100):
+            raise forms.ValidationError("Likelihood percentage must be between 0 and 100")
+        if optimistic and most_likely and pessimistic:
+            if not (optimistic <= most_likely <= pessimistic):
+                raise forms.ValidationError(
+                    "Cost impacts must be in order: Optimistic ≤ Most Likely ≤ Pessimistic"
+                )
+        
+        return cleaned_data
+
 class RiskHistoryForm(forms.ModelForm):
     class Meta:
         model = RiskHistory
@@ -85,10 +119,16 @@ class RiskEditForm(forms.ModelForm):
         required=False
     )
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the groups of the risk's own project can be chosen
+        self.fields['correlation_group'].queryset = CorrelationGroup.objects.filter(project=self.instance.project_id)
+    
     class Meta:
         model = Risk
         fields = ['title', 'description', 'category', 'likelihood', 'impact', 'owner', 'status',
-                 'likelihood_percentage', 'optimistic_cost_impact', 'most_likely_cost_impact', 'pessimistic_cost_impact']
+                 'likelihood_percentage', 'optimistic_cost_impact', 'most_likely_cost_impact', 'pessimistic_cost_impact',
+                 'cost_distribution', 'correlation_group']
         widgets = {
             'description': forms.Textarea(attrs={'rows': 3}),
             'likelihood': forms.Select(attrs={'class': 'form-select'}),
@@ -99,6 +139,8 @@ class RiskEditForm(forms.ModelForm):
             'optimistic_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
             'most_likely_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
             'pessimistic_cost_impact': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
+            'cost_distribution': forms.Select(attrs={'class': 'form-select'}),
+            'correlation_group': forms.Select(attrs={'class': 'form-select'}),
         }
         
     def clean(self):
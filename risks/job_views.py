@@ -0,0 +1,84 @@
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
+from django.urls import reverse
+import json
+from .models import BackgroundJob
+from .jobs import enqueue_job, parse_job_params
+
+def background_job_response(request, kind, params, extra=None):
+    """
+    Queue a job and return its id and polling URLs with HTTP 202.
+    
+    Entries of extra are added to the response, e.g. the parameters a view
+    chose that the client must send again once the job is done.
+    """
+    job = enqueue_job(kind, params, request.user)
+    return JsonResponse({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('job_status', args=[job.id]),
+        'result_url': reverse('job_result', args=[job.id]),
+        **(extra or {}),
+    }, status=202)
+
+def _get_job_for_user(request, job_id):
+    job = get_object_or_404(BackgroundJob, id=job_id)
+    if job.created_by_id not in (None, request.user.id) and not request.user.is_staff:
+        return None
+    return job
+
+@require_POST
+@login_required
+def submit_job(request):
+    """Queue a background job of a registered kind"""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'The body must be a JSON object'}, status=400)
+    
+    kind = data.get('kind')
+    try:
+        # Clients go through the same parsing and limits as the typed views
+        params = parse_job_params(kind, data.get('params', {}))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return background_job_response(request, kind, params)
+
+@login_required
+def job_status(request, job_id):
+    """Poll the state of a background job"""
+    job = _get_job_for_user(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Not allowed to view this job'}, status=403)
+    
+    return JsonResponse({
+        'success': True,
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'result_url': reverse('job_result', args=[job.id]),
+    })
+
+@login_required
+def job_result(request, job_id):
+    """Return the payload of a finished job, in the same shape the inline view returns"""
+    job = _get_job_for_user(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Not allowed to view this job'}, status=403)
+    
+    if job.status == 'succeeded':
+        return JsonResponse(job.result, safe=False)
+    if job.status == 'failed':
+        return JsonResponse({'success': False, 'error': job.error}, status=500)
+    return JsonResponse({'success': False, 'status': job.status}, status=202)
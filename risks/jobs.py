@@ -0,0 +1,211 @@
+"""
+Database-backed queue for slow work such as Monte Carlo runs and AI analyses.
+
+Views enqueue a BackgroundJob and return its id straight away; the
+run_background_jobs management command claims queued jobs and runs them
+outside the web workers. Jobs are claimed with a conditional UPDATE, so
+several workers can share the queue on SQLite without an external broker.
+A worker refreshes its running job's heartbeat; jobs whose heartbeat stops
+are requeued, or failed once they have used up their attempts.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BackgroundJob, Project
+
+logger = logging.getLogger(__name__)
+
+# Job kinds and the functions that run them. Each function takes the job's
+# params as keyword arguments and returns a JSON-serializable payload.
+JOB_HANDLERS = {
+    'monte_carlo': 'risks.views.monte_carlo_payload',
+    'monte_carlo_samples': 'risks.views.monte_carlo_samples_payload',
+    'monte_carlo_sensitivity': 'risks.views.monte_carlo_sensitivity_payload',
+    'portfolio_monte_carlo': 'risks.views.portfolio_monte_carlo_payload',
+    'analyze_risk_trends': 'risks.ai_views.risk_trends_payload',
+    'analyze_risk_dependencies': 'risks.ai_views.risk_dependencies_payload',
+    'generate_executive_summary': 'risks.ai_views.executive_summary_payload',
+    'generate_mitigation_timeline': 'risks.ai_views.mitigation_timeline_payload',
+    'rebuild_similarity_index': 'risks.similarity.rebuild_index_payload',
+}
+
+# Functions that check the params a client submits to the generic job
+# endpoint. Each takes the submitted params and returns the params to queue,
+# raising ValueError with a user-facing message for invalid input.
+JOB_PARAMETER_PARSERS = {
+    'monte_carlo': 'risks.views.monte_carlo_job_params',
+    'monte_carlo_samples': 'risks.views.monte_carlo_samples_job_params',
+    'monte_carlo_sensitivity': 'risks.views.monte_carlo_sensitivity_job_params',
+    'portfolio_monte_carlo': 'risks.views.portfolio_monte_carlo_job_params',
+    'analyze_risk_trends': 'risks.jobs.project_job_params',
+    'analyze_risk_dependencies': 'risks.jobs.project_job_params',
+    'generate_executive_summary': 'risks.jobs.project_job_params',
+    'generate_mitigation_timeline': 'risks.ai_views.mitigation_timeline_job_params',
+    'rebuild_similarity_index': 'risks.similarity.rebuild_index_job_params',
+}
+
+
+def parse_job_params(kind: str, params) -> dict:
+    """
+    Validate the params submitted for a job of a registered kind.
+    
+    Returns the params to queue; raises ValueError for an unknown kind or
+    invalid params.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    return import_string(JOB_PARAMETER_PARSERS[kind])(params)
+
+
+def check_param_names(params: dict, allowed: tuple) -> None:
+    """Raise ValueError if params has keys outside allowed"""
+    unknown = set(params) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown params: {', '.join(sorted(unknown))}")
+
+
+def job_project_id(params: dict) -> int:
+    """The id of an existing project named by params['project_id']"""
+    project_id = params.get('project_id')
+    if type(project_id) is not int or not Project.objects.filter(id=project_id).exists():
+        raise ValueError('project_id must be the id of an existing project')
+    return project_id
+
+
+def project_job_params(params: dict) -> dict:
+    """Params of a job that only takes a project"""
+    check_param_names(params, ('project_id',))
+    return {'project_id': job_project_id(params)}
+
+
+def should_run_in_background(request) -> bool:
+    """Whether a request's work should be queued instead of done inline"""
+    return settings.BACKGROUND_JOBS_ENABLED or request.GET.get('background') in ('1', 'true')
+
+
+def enqueue_job(kind: str, params: dict, user=None) -> BackgroundJob:
+    """Queue a job of a registered kind"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if user is not None and not user.is_authenticated:
+        user = None
+    return BackgroundJob.objects.create(kind=kind, params=params, created_by=user)
+
+
+def claim_next_job() -> Optional[BackgroundJob]:
+    """
+    Atomically take the oldest queued job and mark it running.
+    
+    Returns None when the queue is empty.
+    """
+    while True:
+        job = BackgroundJob.objects.filter(status='queued').order_by('id').first()
+        if job is None:
+            return None
+        
+        now = timezone.now()
+        claimed = BackgroundJob.objects.filter(id=job.id, status='queued').update(
+            status='running',
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+        # Another worker claimed it first; try the next one
+
+
+def _beat(job_id: int, stop: threading.Event, interval: float) -> None:
+    """Refresh a running job's heartbeat every interval seconds until stopped"""
+    try:
+        while not stop.wait(interval):
+            BackgroundJob.objects.filter(id=job_id, status='running').update(heartbeat_at=timezone.now())
+    finally:
+        # The thread has its own database connection
+        connection.close()
+
+
+@contextmanager
+def _heartbeat(job: BackgroundJob):
+    """Keep the job's heartbeat fresh while the body runs"""
+    stop = threading.Event()
+    thread = threading.Thread(target=_beat, args=(job.id, stop, settings.BACKGROUND_JOB_HEARTBEAT_INTERVAL),
+                              name=f'job-{job.id}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job: BackgroundJob) -> BackgroundJob:
+    """Run a claimed job and record its result or error"""
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        with _heartbeat(job):
+            job.result = handler(**job.params)
+        job.status = 'succeeded'
+        job.error = ''
+    except Exception as e:
+        job.status = 'failed'
+        job.error = f"{type(e).__name__}: {e}"
+    job.finished_at = timezone.now()
+    # Only while the job is still this worker's run: if it was given up on as
+    # abandoned, the requeued, failed or reclaimed row is left alone
+    recorded = BackgroundJob.objects.filter(id=job.id, status='running', attempts=job.attempts).update(
+        result=job.result,
+        status=job.status,
+        error=job.error,
+        finished_at=job.finished_at,
+    )
+    if not recorded:
+        logger.warning('Discarded the outcome of %s: it was requeued or failed while it ran', job)
+        job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs(stale_after: int, max_attempts: int) -> tuple:
+    """
+    Put back jobs left running by a worker that died.
+    
+    A job is abandoned once its heartbeat is older than stale_after; jobs
+    that have already been run max_attempts times are marked failed instead
+    of being requeued, so a job that kills its worker is not retried forever.
+    
+    Args:
+        stale_after: Seconds without a heartbeat after which a running job is considered abandoned
+        max_attempts: Runs a job gets before it is given up on
+        
+    Returns:
+        Number of jobs requeued and number of jobs failed
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=stale_after)
+    stale = BackgroundJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status='running',
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='failed',
+        error=f'Abandoned by its worker after {max_attempts} attempt(s)',
+        finished_at=now,
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status='queued',
+        started_at=None,
+        heartbeat_at=None,
+    )
+    return requeued, failed
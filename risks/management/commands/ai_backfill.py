@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from risks.ai_batch import run_backfill, start_run, target_risks
+from risks.models import Project
+
+class Command(BaseCommand):
+    help = 'Fill in risk categories or likelihood and impact scores with batched AI calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', choices=['categorize', 'score'], help='What to fill in')
+        parser.add_argument('--project', type=int, help='Only risks of this project id')
+        parser.add_argument(
+            '--overwrite',
+            action='store_true',
+            help='Include risks that already have a category (or non-default scores)',
+        )
+        parser.add_argument('--resume', action='store_true', help='Continue the last unfinished run')
+        parser.add_argument('--batch-size', type=int, help='Risks per prompt (default AI_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, help='Prompts in flight at once (default AI_BATCH_CONCURRENCY)')
+        parser.add_argument('--max-attempts', type=int, help='Tries per risk (default AI_BATCH_MAX_ATTEMPTS)')
+
+    def handle(self, *args, **options):
+        project = None
+        if options['project']:
+            try:
+                project = Project.objects.get(id=options['project'])
+            except Project.DoesNotExist:
+                raise CommandError(f"Project {options['project']} does not exist")
+
+        run = start_run(options['task'], project, options['overwrite'], options['resume'])
+        pending = target_risks(run).filter(id__gt=run.last_risk_id).count() + len(run.failed_ids)
+        self.stdout.write(f'Backfill run #{run.id}: {pending} risk(s) to {options["task"]}...')
+
+        def progress(run):
+            self.stdout.write(f'  up to risk #{run.last_risk_id}: {run.updated} updated, '
+                              f'{len(run.failed_ids)} pending retry')
+
+        try:
+            run = run_backfill(run, options['batch_size'], options['concurrency'], options['max_attempts'],
+                               progress)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'Backfill run #{run.id} finished: {run.updated} risk(s) updated.'))
+        if run.failed_ids:
+            self.stdout.write(self.style.WARNING(
+                f'{len(run.failed_ids)} risk(s) got no valid answer: {", ".join(map(str, run.failed_ids))}'
+            ))
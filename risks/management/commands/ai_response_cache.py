@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from risks.ai_cache import cache_stats, clear
+
+class Command(BaseCommand):
+    help = 'Show hit and miss counts of the AI response cache, or clear it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Delete cached responses')
+        parser.add_argument('--function', help='Limit --clear to one ai_features function')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = clear(options['function'])
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} cached responses.'))
+            return
+        stats = cache_stats()
+        if not stats:
+            self.stdout.write('The AI response cache is empty.')
+            return
+        for function, counts in stats.items():
+            self.stdout.write(
+                f"{function}: {counts['hits']} hits, {counts['misses']} misses "
+                f"({counts['hit_rate']:.0%} hit rate), {counts['entries']} cached"
+            )
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from risks.models import Project, Risk, Category, RiskResponse
+from risks.models import Project, Risk, Category, CorrelationGroup, RiskResponse
 from decimal import Decimal
 import random
 from datetime import datetime, timedelta
@@ -97,6 +97,7 @@ class Command(BaseCommand):
                 'description': 'Primary database server could fail during migration causing extended downtime.',
                 'likelihood': 3, 'impact': 3, 'status': 'Open',
                 'category': 'Technical Risk',
+                'correlation_group': 'Data center infrastructure',
                 'likelihood_percentage': 75,
                 'optimistic_cost_impact': Decimal('50000'),
                 'most_likely_cost_impact': Decimal('150000'),
@@ -119,6 +120,7 @@ class Command(BaseCommand):
                 'description': 'Sensitive customer data could be exposed during the migration process.',
                 'likelihood': 2, 'impact': 3, 'status': 'Open',
                 'category': 'Security Risk',
+                'cost_distribution': 'lognormal',
                 'likelihood_percentage': 35,
                 'optimistic_cost_impact': Decimal('200000'),
                 'most_likely_cost_impact': Decimal('1000000'),
@@ -129,6 +131,7 @@ class Command(BaseCommand):
                 'description': 'New system may not meet updated compliance requirements.',
                 'likelihood': 2, 'impact': 3, 'status': 'Mitigated',
                 'category': 'Compliance Risk',
+                'cost_distribution': 'pert',
                 'likelihood_percentage': 40,
                 'optimistic_cost_impact': Decimal('50000'),
                 'most_likely_cost_impact': Decimal('250000'),
@@ -141,6 +144,7 @@ class Command(BaseCommand):
                 'description': 'Natural disaster could destroy the new data center facility.',
                 'likelihood': 1, 'impact': 3, 'status': 'Open',
                 'category': 'Operational Risk',
+                'correlation_group': 'Data center infrastructure',
                 'likelihood_percentage': 5,
                 'optimistic_cost_impact': Decimal('500000'),
                 'most_likely_cost_impact': Decimal('2000000'),
@@ -257,6 +261,15 @@ class Command(BaseCommand):
             project = projects[i % len(projects)]
             category = next((cat for cat in categories if cat.name == risk_data['category']), categories[0])
             
+            # Risks sharing a root cause are simulated as correlated
+            correlation_group = None
+            if 'correlation_group' in risk_data:
+                correlation_group, _ = CorrelationGroup.objects.get_or_create(
+                    project=project,
+                    name=risk_data['correlation_group'],
+                    defaults={'correlation': 0.6}
+                )
+            
             risk, created = Risk.objects.get_or_create(
                 title=risk_data['title'],
                 project=project,
@@ -270,7 +283,9 @@ class Command(BaseCommand):
                     'likelihood_percentage': risk_data['likelihood_percentage'],
                     'optimistic_cost_impact': risk_data['optimistic_cost_impact'],
                     'most_likely_cost_impact': risk_data['most_likely_cost_impact'],
-                    'pessimistic_cost_impact': risk_data['pessimistic_cost_impact']
+                    'pessimistic_cost_impact': risk_data['pessimistic_cost_impact'],
+                    'cost_distribution': risk_data.get('cost_distribution', 'triangular'),
+                    'correlation_group': correlation_group
                 }
             )
             if created:
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from risks.models import ProjectRiskSummary
+
+class Command(BaseCommand):
+    help = 'Recount the materialized per-project risk summaries from the Risk table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='projects',
+            help='Only rebuild this project id (may be given more than once)',
+        )
+
+    def handle(self, *args, **options):
+        rows = ProjectRiskSummary.rebuild(options['projects'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt risk summaries ({rows} rows).'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from risks.search import backend, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over risk titles, descriptions and history comments'
+
+    def handle(self, *args, **options):
+        if backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no full-text index; searches use substring matching.'))
+            return
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} risks.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from risks.similarity import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Build or rebuild the risk similarity index, dropping the slots left by deleted risks'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} risks.'))
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+
+from risks.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (Monte Carlo simulations and AI analyses)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the jobs currently queued and exit instead of polling',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.BACKGROUND_JOB_POLL_INTERVAL,
+            help='Seconds to wait between polls when the queue is empty',
+        )
+
+    def requeue_stale_jobs(self):
+        requeued, failed = requeue_stale_jobs(settings.BACKGROUND_JOB_STALE_AFTER,
+                                              settings.BACKGROUND_JOB_MAX_ATTEMPTS)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} abandoned job(s).'))
+        if failed:
+            self.stdout.write(self.style.ERROR(f'Failed {failed} abandoned job(s) out of attempts.'))
+
+    def handle(self, *args, **options):
+        self.stdout.write('Waiting for background jobs...')
+        while True:
+            # Checked on every poll: jobs are judged by their heartbeat, so a
+            # job another worker is still running is never taken over
+            self.requeue_stale_jobs()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Running {job}...')
+            job = run_job(job)
+            if job.status == 'succeeded':
+                self.stdout.write(self.style.SUCCESS(f'Finished {job}.'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{job} failed: {job.error}'))
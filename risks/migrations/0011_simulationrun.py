@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0010_risk_likelihood_percentage_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inputs_hash', models.CharField(max_length=64)),
+                ('num_simulations', models.IntegerField()),
+                ('seed', models.BigIntegerField()),
+                ('risks_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='simulation_runs', to='risks.project')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['project', 'inputs_hash'], name='risks_simul_project_7445de_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:04
+
+import django.db.models.expressions
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0012_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='risk',
+            name='level',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.GreaterThanOrEqual(django.db.models.expressions.CombinedExpression(models.F('likelihood'), '*', models.F('impact')), 6), then=models.Value('High')), models.When(django.db.models.lookups.GreaterThanOrEqual(django.db.models.expressions.CombinedExpression(models.F('likelihood'), '*', models.F('impact')), 3), then=models.Value('Medium')), default=models.Value('Low')), output_field=models.CharField(max_length=10)),
+        ),
+        migrations.AddField(
+            model_name='risk',
+            name='score',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('likelihood'), '*', models.F('impact')), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['project', 'status', 'level'], name='risks_risk_project_e821d8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['status', 'likelihood', 'impact'], name='risks_risk_status_2b45ad_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:06
+
+import django.db.models.deletion
+import django.db.models.expressions
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    Risk = apps.get_model('risks', 'Risk')
+    ProjectRiskSummary = apps.get_model('risks', 'ProjectRiskSummary')
+    groups = (Risk.objects.values('project_id', 'category_id', 'status', 'likelihood', 'impact')
+              .annotate(risk_count=models.Count('id'),
+                        total_cost=models.Sum('most_likely_cost_impact'))
+              .order_by())
+    ProjectRiskSummary.objects.bulk_create(ProjectRiskSummary(**group) for group in groups)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0013_risk_score_level'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectRiskSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('likelihood', models.IntegerField()),
+                ('impact', models.IntegerField()),
+                ('level', models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.GreaterThanOrEqual(django.db.models.expressions.CombinedExpression(models.F('likelihood'), '*', models.F('impact')), 6), then=models.Value('High')), models.When(django.db.models.lookups.GreaterThanOrEqual(django.db.models.expressions.CombinedExpression(models.F('likelihood'), '*', models.F('impact')), 3), then=models.Value('Medium')), default=models.Value('Low')), output_field=models.CharField(max_length=10))),
+                ('risk_count', models.IntegerField(default=0)),
+                ('total_cost', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='risks.category')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='risk_summaries', to='risks.project')),
+            ],
+            options={
+                'verbose_name_plural': 'Project risk summaries',
+                'indexes': [models.Index(fields=['project', 'category', 'status', 'likelihood', 'impact'], name='risks_proje_project_773d78_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
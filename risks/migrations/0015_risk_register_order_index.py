@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0014_projectrisksummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['-likelihood', '-impact', 'title', 'id'], name='risk_register_order'),
+        ),
+    ]
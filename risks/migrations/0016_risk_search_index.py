@@ -0,0 +1,60 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE risks_risk_fts USING fts5("
+            "title, description, comments, tokenize = 'porter unicode61')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE risks_risk_search ("
+            "risk_id bigint PRIMARY KEY REFERENCES risks_risk (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute("CREATE INDEX risks_risk_search_document ON risks_risk_search USING GIN (document)")
+    else:
+        return
+
+    # Index the risks that already exist
+    Risk = apps.get_model('risks', 'Risk')
+    RiskHistory = apps.get_model('risks', 'RiskHistory')
+    for risk in Risk.objects.only('id', 'title', 'description').iterator():
+        comments = '\n'.join(
+            RiskHistory.objects.filter(risk_id=risk.id).exclude(change_comment='')
+            .values_list('change_comment', flat=True)
+        )
+        if vendor == 'sqlite':
+            schema_editor.execute(
+                "INSERT INTO risks_risk_fts (rowid, title, description, comments) VALUES (%s, %s, %s, %s)",
+                [risk.id, risk.title, risk.description, comments],
+            )
+        else:
+            schema_editor.execute(
+                "INSERT INTO risks_risk_search (risk_id, document) VALUES (%s, "
+                "setweight(to_tsvector('english', %s), 'A') || "
+                "setweight(to_tsvector('english', %s), 'B') || "
+                "setweight(to_tsvector('english', %s), 'C'))",
+                [risk.id, risk.title, risk.description, comments],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS risks_risk_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS risks_risk_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0015_risk_register_order_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
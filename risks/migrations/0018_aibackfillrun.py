@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0017_airesponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIBackfillRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(choices=[('categorize', 'Categorize'), ('score', 'Score')], max_length=20)),
+                ('overwrite', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('finished', 'Finished')], default='running', max_length=20)),
+                ('last_risk_id', models.BigIntegerField(default=0)),
+                ('failed_ids', models.JSONField(blank=True, default=list)),
+                ('updated', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ai_backfill_runs', to='risks.project')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:43
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0018_aibackfillrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorrelationGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('correlation', models.FloatField(default=0.5, help_text='Correlation (0 to 1) between the occurrence, and between the cost, of any two risks in the group', validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)])),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='correlation_groups', to='risks.project')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='risk',
+            name='correlation_group',
+            field=models.ForeignKey(blank=True, help_text='Risks sharing a root cause; simulated as correlated', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='risks', to='risks.correlationgroup'),
+        ),
+        migrations.AddConstraint(
+            model_name='correlationgroup',
+            constraint=models.UniqueConstraint(fields=('project', 'name'), name='unique_correlation_group_name'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0019_correlationgroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='risk',
+            name='cost_distribution',
+            field=models.CharField(choices=[('triangular', 'Triangular'), ('pert', 'PERT-Beta'), ('lognormal', 'Lognormal'), ('uniform', 'Uniform')], default='triangular', help_text='Shape of the cost impact between the optimistic and pessimistic costs', max_length=20),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
 from django.dispatch import receiver
 
 class Project(models.Model):
@@ -22,6 +26,35 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class CorrelationGroup(models.Model):
+    """
+    Risks of a project that share a root cause, which the Monte Carlo
+    simulation samples as correlated instead of independent
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='correlation_groups')
+    name = models.CharField(max_length=100)
+    correlation = models.FloatField(
+        default=0.5,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Correlation (0 to 1) between the occurrence, and between the cost, of any two risks in the group"
+    )
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'name'], name='unique_correlation_group_name'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.project.name})"
+
+# Lowest risk scores (likelihood x impact) of the High and Medium risk levels
+HIGH_RISK_SCORE = 6
+MEDIUM_RISK_SCORE = 3
+
+def _score_at_least(threshold):
+    return GreaterThanOrEqual(models.F('likelihood') * models.F('impact'), threshold)
+
 class Risk(models.Model):
     LIKELIHOOD_CHOICES = [
         (1, 'Low'),
@@ -47,6 +80,13 @@ class Risk(models.Model):
         ('Mitigated', 'Mitigated'),
         ('Closed', 'Closed'),
     ]
+    
+    COST_DISTRIBUTION_CHOICES = [
+        ('triangular', 'Triangular'),
+        ('pert', 'PERT-Beta'),
+        ('lognormal', 'Lognormal'),
+        ('uniform', 'Uniform'),
+    ]
 
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='risks')
     title = models.CharField(max_length=100)
@@ -78,11 +118,51 @@ class Risk(models.Model):
         default=0,
         help_text="Worst-case cost impact if risk occurs"
     )
+    cost_distribution = models.CharField(
+        max_length=20,
+        choices=COST_DISTRIBUTION_CHOICES,
+        default='triangular',
+        help_text="Shape of the cost impact between the optimistic and pessimistic costs"
+    )
     
     owner = models.CharField(max_length=100, blank=True)  # Risk Owner
+    correlation_group = models.ForeignKey(
+        CorrelationGroup, on_delete=models.SET_NULL, null=True, blank=True, related_name='risks',
+        help_text="Risks sharing a root cause; simulated as correlated"
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Open')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    
+    # Stored copies of risk_score and risk_level, computed by the database so
+    # they stay in sync on save() and on queryset update(); use these to
+    # filter, sort and group in SQL
+    score = models.GeneratedField(
+        expression=models.F('likelihood') * models.F('impact'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    level = models.GeneratedField(
+        expression=models.Case(
+            models.When(_score_at_least(HIGH_RISK_SCORE), then=models.Value('High')),
+            models.When(_score_at_least(MEDIUM_RISK_SCORE), then=models.Value('Medium')),
+            default=models.Value('Low'),
+        ),
+        output_field=models.CharField(max_length=10),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'status', 'level']),
+            models.Index(fields=['status', 'likelihood', 'impact']),
+            # Matches the register ordering used for keyset pagination
+            models.Index(fields=['-likelihood', '-impact', 'title', 'id'], name='risk_register_order'),
+        ]
+
+    def clean(self):
+        if self.correlation_group_id and self.correlation_group.project_id != self.project_id:
+            raise ValidationError({'correlation_group': "The correlation group belongs to another project."})
 
     @property
     def risk_score(self):
@@ -91,9 +171,9 @@ class Risk(models.Model):
     @property
     def risk_level(self):
         score = self.risk_score
-        if score >= 6:
+        if score >= HIGH_RISK_SCORE:
             return 'High'
-        elif score >= 3:
+        elif score >= MEDIUM_RISK_SCORE:
             return 'Medium'
         else:
             return 'Low'
@@ -166,6 +246,117 @@ class RiskResponse(models.Model):
         }
         return currency_symbols.get(self.currency, '$')
 
+class SimulationRun(models.Model):
+    """A stored Monte Carlo result, keyed by a hash of everything that determines it"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='simulation_runs')
+    inputs_hash = models.CharField(max_length=64)
+    num_simulations = models.IntegerField()
+    seed = models.BigIntegerField()
+    risks_updated_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['project', 'inputs_hash']),
+        ]
+
+    def __str__(self):
+        return f"{self.project.name} - {self.num_simulations} runs (seed {self.seed})"
+
+class BackgroundJob(models.Model):
+    """A unit of slow work (simulation, AI analysis) queued for the job worker"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='background_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs, so a live job is never
+    # mistaken for one abandoned by a dead worker
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+class AIResponse(models.Model):
+    """A cached Gemini response, keyed by a hash of the function, model and normalized prompt"""
+    key = models.CharField(max_length=64, unique=True)
+    function = models.CharField(max_length=100, db_index=True)
+    model_name = models.CharField(max_length=100)
+    response_text = models.TextField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-last_used_at']
+
+    def __str__(self):
+        return f"{self.function} ({self.model_name})"
+
+class AICacheCounter(models.Model):
+    """Hit and miss counts of the AI response cache for one function"""
+    function = models.CharField(max_length=100, unique=True)
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.function}: {self.hits} hits, {self.misses} misses"
+
+class AIBackfillRun(models.Model):
+    """Progress of an ai_backfill command run, so an interrupted run can resume"""
+    TASK_CHOICES = [
+        ('categorize', 'Categorize'),
+        ('score', 'Score'),
+    ]
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('finished', 'Finished'),
+    ]
+
+    task = models.CharField(max_length=20, choices=TASK_CHOICES)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='ai_backfill_runs')
+    overwrite = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    # Every risk with an id up to last_risk_id has been handled, except failed_ids
+    last_risk_id = models.BigIntegerField(default=0)
+    failed_ids = models.JSONField(default=list, blank=True)
+    updated = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        scope = self.project.name if self.project else 'all projects'
+        return f"{self.task} backfill of {scope} ({self.status})"
+
 class UserProfile(models.Model):
     ROLE_CHOICES = [
         ('viewer', 'Viewer'),
@@ -193,8 +384,173 @@ class UserProfile(models.Model):
     def is_contributor(self):
         return self.role in ['contributor', 'manager', 'admin']
 
+
+class ProjectRiskSummary(models.Model):
+    """
+    Materialized risk counts and cost for one project.
+    
+    Each row holds the number of risks and their summed most-likely cost for a
+    (category, status, likelihood, impact) combination. Signal handlers on Risk
+    apply deltas as risks are saved and deleted; reports add up rows instead of
+    scanning risks. Rows for the same key may be duplicated under concurrent
+    writes, so read them with Sum rather than get(). Queryset update() and
+    bulk_create() bypass the handlers; run rebuild_risk_summaries afterwards.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='risk_summaries')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, related_name='+')
+    status = models.CharField(max_length=20)
+    likelihood = models.IntegerField()
+    impact = models.IntegerField()
+    level = models.GeneratedField(
+        expression=models.Case(
+            models.When(_score_at_least(HIGH_RISK_SCORE), then=models.Value('High')),
+            models.When(_score_at_least(MEDIUM_RISK_SCORE), then=models.Value('Medium')),
+            default=models.Value('Low'),
+        ),
+        output_field=models.CharField(max_length=10),
+        db_persist=True,
+    )
+    risk_count = models.IntegerField(default=0)
+    total_cost = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "Project risk summaries"
+        indexes = [
+            models.Index(fields=['project', 'category', 'status', 'likelihood', 'impact']),
+        ]
+
+    def __str__(self):
+        return f"{self.project_id}: {self.status} {self.likelihood}x{self.impact} ({self.risk_count})"
+
+    @staticmethod
+    def risk_total(filter=None):
+        """Aggregate expression summing risk_count over the rows matching filter"""
+        return Coalesce(models.Sum('risk_count', filter=filter), 0)
+
+    @classmethod
+    def apply_delta(cls, key, count, cost):
+        """Add count risks and cost to the row for key, creating or removing it as needed"""
+        rows = cls.objects.filter(**key)
+        updated = rows.update(
+            risk_count=models.F('risk_count') + count,
+            total_cost=models.F('total_cost') + cost,
+        )
+        if not updated and count > 0:
+            cls.objects.create(risk_count=count, total_cost=cost, **key)
+        elif count < 0:
+            rows.filter(risk_count__lte=0).delete()
+
+    @classmethod
+    def rebuild(cls, project_ids=None):
+        """
+        Recount summaries from the Risk table.
+        
+        Args:
+            project_ids: Projects to rebuild; all projects when None
+            
+        Returns:
+            Number of summary rows written
+        """
+        risks = Risk.objects.all()
+        summaries = cls.objects.all()
+        if project_ids is not None:
+            risks = risks.filter(project_id__in=project_ids)
+            summaries = summaries.filter(project_id__in=project_ids)
+        
+        groups = (risks.values('project_id', 'category_id', 'status', 'likelihood', 'impact')
+                  .annotate(risk_count=models.Count('id'),
+                            total_cost=models.Sum('most_likely_cost_impact'))
+                  .order_by())
+        with transaction.atomic():
+            summaries.delete()
+            created = cls.objects.bulk_create(cls(**group) for group in groups)
+        return len(created)
+
+# Fields of Risk that determine its ProjectRiskSummary row
+SUMMARY_KEY_FIELDS = ('project_id', 'category_id', 'status', 'likelihood', 'impact')
+
+def _risk_summary_state(risk):
+    """(key, cost) of a risk as loaded, or None if any needed field is deferred"""
+    values = risk.__dict__
+    if any(field not in values for field in SUMMARY_KEY_FIELDS + ('most_likely_cost_impact',)):
+        return None
+    key = {field: values[field] for field in SUMMARY_KEY_FIELDS}
+    return key, values['most_likely_cost_impact'] or 0
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create a UserProfile for every new User"""
     if created:
-        UserProfile.objects.create(user=instance)
\ No newline at end of file
+        UserProfile.objects.create(user=instance)
+
+@receiver(post_init, sender=Risk)
+def remember_risk_summary_state(sender, instance, **kwargs):
+    """Snapshot the loaded state so a later save knows which summary row to adjust"""
+    instance._summary_state = _risk_summary_state(instance) if instance.pk else None
+
+@receiver(post_save, sender=Risk)
+def update_risk_summary_on_save(sender, instance, created, **kwargs):
+    """Move the risk's count and cost from its old summary row to its new one"""
+    old_state = None if created else instance._summary_state
+    new_state = _risk_summary_state(instance)
+    if new_state is None or (old_state is None and not created):
+        # The previous state is unknown, so recount the project instead
+        ProjectRiskSummary.rebuild([instance.project_id])
+    elif old_state != new_state:
+        if old_state is not None:
+            ProjectRiskSummary.apply_delta(old_state[0], -1, -old_state[1])
+        ProjectRiskSummary.apply_delta(new_state[0], 1, new_state[1])
+    instance._summary_state = _risk_summary_state(instance)
+
+@receiver(post_delete, sender=Risk)
+def update_risk_summary_on_delete(sender, instance, **kwargs):
+    """Remove a deleted risk from its summary row"""
+    state = instance._summary_state
+    if state is None:
+        ProjectRiskSummary.rebuild([instance.project_id])
+    else:
+        ProjectRiskSummary.apply_delta(state[0], -1, -state[1])
+
+@receiver(pre_delete, sender=Category)
+def remember_category_projects(sender, instance, **kwargs):
+    """Note the projects whose summaries change when a category is deleted"""
+    instance._summary_project_ids = list(
+        instance.risks.values_list('project_id', flat=True).distinct()
+    )
+
+@receiver(post_delete, sender=Category)
+def rebuild_summaries_for_category(sender, instance, **kwargs):
+    """Deleting a category uncategorizes its risks in bulk, without Risk signals"""
+    project_ids = getattr(instance, '_summary_project_ids', None)
+    if project_ids:
+        ProjectRiskSummary.rebuild(project_ids)
+
+@receiver(post_save, sender=Risk)
+def update_search_index_on_save(sender, instance, **kwargs):
+    """Keep the full-text search entry in step with the risk's text"""
+    from .search import index_risk
+    index_risk(instance.id)
+
+@receiver(post_delete, sender=Risk)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    from .search import remove_risk
+    remove_risk(instance.id)
+
+@receiver(post_save, sender=RiskHistory)
+@receiver(post_delete, sender=RiskHistory)
+def update_search_index_for_history(sender, instance, **kwargs):
+    """History comments are indexed with their risk"""
+    from .search import index_risk
+    index_risk(instance.risk_id)
+
+@receiver(post_save, sender=Risk)
+def update_similarity_index_on_save(sender, instance, **kwargs):
+    """Refresh the risk's vector once the save is committed (the index is a file, not a table)"""
+    from .similarity import index_risk
+    transaction.on_commit(lambda: index_risk(instance))
+
+@receiver(post_delete, sender=Risk)
+def update_similarity_index_on_delete(sender, instance, **kwargs):
+    from .similarity import remove_risk
+    risk_id = instance.id
+    transaction.on_commit(lambda: remove_risk(risk_id))
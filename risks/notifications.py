@@ -3,7 +3,7 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import Risk, RiskHistory
+from .models import Risk, RiskHistory, ProjectRiskSummary
 
 def send_high_risk_notification(risk):
     """Send notification when a high risk is created"""
@@ -101,34 +101,35 @@ def send_weekly_summary():
     if not admin_emails:
         return
     
-    # Count risks by level
-    from django.db.models import Count
-    
-    risks = Risk.objects.all()
-    high_risks = sum(1 for risk in risks if risk.risk_level == 'High')
-    medium_risks = sum(1 for risk in risks if risk.risk_level == 'Medium')
-    low_risks = sum(1 for risk in risks if risk.risk_level == 'Low')
-    
-    # Risk status counts
-    open_risks = risks.filter(status='Open').count()
-    mitigated_risks = risks.filter(status='Mitigated').count()
-    closed_risks = risks.filter(status='Closed').count()
+    # Count risks by level and status in one query
+    from django.db.models import Q
+    
+    total = ProjectRiskSummary.risk_total
+    counts = ProjectRiskSummary.objects.aggregate(
+        total_risks=total(),
+        high_risks=total(Q(level='High')),
+        medium_risks=total(Q(level='Medium')),
+        low_risks=total(Q(level='Low')),
+        open_risks=total(Q(status='Open')),
+        mitigated_risks=total(Q(status='Mitigated')),
+        closed_risks=total(Q(status='Closed')),
+    )
     
     subject = '[Weekly Report] Risk Management Summary'
     message = f'''
     Weekly Risk Management Summary:
     
-    Total Risks: {len(risks)}
+    Total Risks: {counts['total_risks']}
     
     By Severity:
-    - High Risks: {high_risks}
-    - Medium Risks: {medium_risks}
-    - Low Risks: {low_risks}
+    - High Risks: {counts['high_risks']}
+    - Medium Risks: {counts['medium_risks']}
+    - Low Risks: {counts['low_risks']}
     
     By Status:
-    - Open: {open_risks}
-    - Mitigated: {mitigated_risks}
-    - Closed: {closed_risks}
+    - Open: {counts['open_risks']}
+    - Mitigated: {counts['mitigated_risks']}
+    - Closed: {counts['closed_risks']}
     
     Please login to the system to view detailed reports.
     '''
@@ -0,0 +1,126 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page starts after the sort key of the last row of the
+previous page, which the client passes back as an opaque cursor. The query
+then seeks straight to the page through an index on the ordering, so deep
+pages cost the same as the first one. The ordering must end in a unique,
+non-null field (such as id) so that every row has a distinct position.
+"""
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Order of the Complete Risk Register: highest likelihood and impact first.
+# Backed by the risk_register_order index on Risk.
+REGISTER_ORDERING = ('-likelihood', '-impact', 'title', 'id')
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Turn sort key values into an opaque URL-safe cursor"""
+    data = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, ordering: Sequence[str], model=None) -> List:
+    """
+    Read sort key values back from a cursor.
+
+    Every value must be a JSON scalar. With a model, each value is also
+    converted to the type of its ordering field, so a crafted cursor fails
+    here instead of inside the query.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the ordering
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("Invalid cursor")
+    if model is not None:
+        try:
+            values = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(ordering, values)]
+        except ValidationError as e:
+            raise ValueError("Invalid cursor") from e
+    return values
+
+
+def keyset_filter(ordering: Sequence[str], values: Sequence) -> Q:
+    """
+    Filter for the rows that sort after the given key.
+
+    For ordering (a, -b, c) and key (x, y, z) this is
+    a > x OR (a = x AND b < y) OR (a = x AND b = y AND c > z).
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def _reverse_ordering(ordering: Sequence[str]) -> List[str]:
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+def _row_cursor(row, ordering: Sequence[str]) -> str:
+    return encode_cursor([getattr(row, field.lstrip('-')) for field in ordering])
+
+
+def keyset_page(queryset, ordering: Sequence[str] = REGISTER_ORDERING,
+                cursor: Optional[str] = None, page_size: int = 20,
+                before: Optional[str] = None) -> Tuple[list, Optional[str], Optional[str]]:
+    """
+    Fetch one page of a queryset.
+
+    Args:
+        queryset: Rows to paginate (any existing ordering is replaced)
+        ordering: Sort fields, '-' prefixed for descending; the last must be unique
+        cursor: next_cursor of the previous page, or None for the first page
+        page_size: Number of rows per page
+        before: previous_cursor of the following page, to page backwards;
+            takes precedence over cursor
+
+    Returns:
+        (rows, next_cursor, previous_cursor); a cursor is None when there is
+        no page in that direction
+
+    Raises:
+        ValueError: If a cursor is invalid
+    """
+    if before:
+        # Walk the reversed ordering from the cursor, then restore the order
+        reverse = _reverse_ordering(ordering)
+        rows = list(queryset.order_by(*reverse)
+                    .filter(keyset_filter(reverse, decode_cursor(before, ordering, queryset.model)))[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        if not rows:
+            return rows, None, None
+        return (rows, _row_cursor(rows[-1], ordering),
+                _row_cursor(rows[0], ordering) if has_previous else None)
+
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, ordering, queryset.model)))
+
+    # Fetch one extra row to learn whether another page follows
+    rows = list(queryset[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    if not rows:
+        return rows, None, None
+    return (rows, _row_cursor(rows[-1], ordering) if has_next else None,
+            _row_cursor(rows[0], ordering) if cursor else None)
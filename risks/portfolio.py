@@ -0,0 +1,232 @@
+"""
+Portfolio Monte Carlo simulation across all projects.
+
+The open risks of every project are loaded in one query and converted to
+per-project parameter arrays. Each block of iterations simulates every
+project's column of totals with the project engine; the portfolio total of
+an iteration is the sum of its row. Risk streams are keyed by risk id, so
+a project's column is exactly what a project run with the same seed
+produces, and its marginal statistics come from the portfolio run without
+simulating the project again: the mean, standard deviation and extremes
+exactly, the percentiles from a coarse per-project histogram.
+
+Each project's contribution to the portfolio p95 is its share of the
+expected portfolio cost in the tail beyond the p95 (the iterations with
+the highest PORTFOLIO_TAIL_PROBABILITY of totals), scaled to the p95. The
+contributions add up to the portfolio p95, and a project whose costs peak
+with the rest of the portfolio contributes more than one whose costs
+usually arrive in good years. The statistics are streamed block by block,
+so memory stays bounded by the block size, a PROJECT_HISTOGRAM_BINS-wide
+row of counts per project and the tail, which is kept row by row:
+PORTFOLIO_TAIL_PROBABILITY of the iterations times the number of projects.
+"""
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .models import Project, Risk
+from .monte_carlo import (_merge_in_block_order, _risk_parameter_arrays, _run_blocks, cost_bounds,
+                          load_active_risks, new_seed, simulate_block)
+from .streaming_stats import SimulationAccumulator, keep_top_rows
+
+# Share of iterations beyond the portfolio p95 used to allocate it between projects
+PORTFOLIO_TAIL_PROBABILITY = 0.05
+
+# Histogram bins per project; project percentiles are accurate to about one
+# bin, 1/PROJECT_HISTOGRAM_BINS of the project's possible cost range
+PROJECT_HISTOGRAM_BINS = 256
+
+
+class PortfolioAccumulator:
+    """
+    Streaming statistics of a portfolio run: the portfolio totals, each
+    project's marginal totals, and the per-project totals of the iterations
+    with the highest portfolio totals.
+
+    Only the portfolio total keeps a full SimulationAccumulator. The project
+    marginals are columnar: count, mean and M2 vectors updated with one
+    Welford step per block, exact minimum and maximum vectors, and a
+    (projects x PROJECT_HISTOGRAM_BINS) histogram over each project's cost
+    range that the project percentiles are interpolated from.
+    """
+
+    def __init__(self, project_bounds: List[tuple], tail_size: int):
+        num_projects = len(project_bounds)
+        self.portfolio = SimulationAccumulator(sum(lower for lower, _ in project_bounds),
+                                               sum(upper for _, upper in project_bounds))
+        self.lowers = np.array([lower for lower, _ in project_bounds], dtype=float)
+        self.uppers = np.array([upper for _, upper in project_bounds], dtype=float)
+        self.count = 0
+        self.means = np.zeros(num_projects)
+        self.m2 = np.zeros(num_projects)
+        self.min_values = np.full(num_projects, math.inf)
+        self.max_values = np.full(num_projects, -math.inf)
+        self.bin_counts = np.zeros((num_projects, PROJECT_HISTOGRAM_BINS), dtype=np.int64)
+        self.tail_size = tail_size
+        self.tail_totals = np.zeros(0, dtype=float)
+        self.tail_project_totals = np.zeros((0, num_projects), dtype=float)
+
+    @property
+    def num_projects(self) -> int:
+        return self.means.size
+
+    def update(self, project_totals: np.ndarray) -> None:
+        """Add a block of iterations, given as a (rows x projects) array of project totals"""
+        if not len(project_totals):
+            return
+        totals = project_totals.sum(axis=1)
+        self.portfolio.update(totals)
+
+        batch_means = project_totals.mean(axis=0)
+        batch_m2 = ((project_totals - batch_means) ** 2).sum(axis=0)
+        self._combine_moments(len(project_totals), batch_means, batch_m2)
+        self.min_values = np.minimum(self.min_values, project_totals.min(axis=0))
+        self.max_values = np.maximum(self.max_values, project_totals.max(axis=0))
+        self.bin_counts += self._bin_counts(project_totals)
+        self._keep_tail(totals, project_totals)
+
+    def merge(self, other: 'PortfolioAccumulator') -> None:
+        """Combine with the accumulator of a later run of blocks"""
+        self.portfolio.merge(other.portfolio)
+        if other.count:
+            self._combine_moments(other.count, other.means, other.m2)
+            self.min_values = np.minimum(self.min_values, other.min_values)
+            self.max_values = np.maximum(self.max_values, other.max_values)
+            self.bin_counts += other.bin_counts
+        self._keep_tail(other.tail_totals, other.tail_project_totals)
+
+    def _combine_moments(self, count: int, means: np.ndarray, m2: np.ndarray) -> None:
+        total = self.count + count
+        delta = means - self.means
+        self.means = self.means + delta * count / total
+        self.m2 = self.m2 + m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _widths(self) -> np.ndarray:
+        return self.uppers - self.lowers
+
+    def _bin_counts(self, project_totals: np.ndarray) -> np.ndarray:
+        widths = self._widths()
+        scale = np.divide(PROJECT_HISTOGRAM_BINS, widths, out=np.zeros_like(widths), where=widths > 0)
+        indexes = np.clip(((project_totals - self.lowers) * scale).astype(np.int64), 0, PROJECT_HISTOGRAM_BINS - 1)
+        # Offset each project's bins so one bincount fills the whole table
+        indexes += np.arange(self.num_projects) * PROJECT_HISTOGRAM_BINS
+        return np.bincount(indexes.ravel(), minlength=self.bin_counts.size).reshape(self.bin_counts.shape)
+
+    def _project_quantiles(self, q: float) -> np.ndarray:
+        """Each project's value at quantile q, interpolated within its histogram bin"""
+        target = q * self.count
+        cumulative = np.cumsum(self.bin_counts, axis=1)
+        bins = np.minimum(np.argmax(cumulative >= target, axis=1), PROJECT_HISTOGRAM_BINS - 1)
+        projects = np.arange(self.num_projects)
+        in_bin = self.bin_counts[projects, bins]
+        before = cumulative[projects, bins] - in_bin
+        fraction = np.divide(target - before, in_bin, out=np.zeros(self.num_projects), where=in_bin > 0)
+        values = self.lowers + (bins + fraction) * self._widths() / PROJECT_HISTOGRAM_BINS
+        return np.clip(values, self.min_values, self.max_values)
+
+    def project_statistics(self) -> List[Dict[str, float]]:
+        """Each project's summary statistics in the format reported by the simulation"""
+        if self.count == 0:
+            return [{key: 0 for key in ('mean', 'median', 'std_dev', 'min_cost', 'max_cost',
+                                        'p10', 'p25', 'p75', 'p90', 'p95')} for _ in range(self.num_projects)]
+        columns = {
+            'mean': self.means,
+            'median': self._project_quantiles(0.50),
+            'std_dev': np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros(self.num_projects),
+            'min_cost': self.min_values,
+            'max_cost': self.max_values,
+            'p10': self._project_quantiles(0.10),
+            'p25': self._project_quantiles(0.25),
+            'p75': self._project_quantiles(0.75),
+            'p90': self._project_quantiles(0.90),
+            'p95': self._project_quantiles(0.95),
+        }
+        return [{key: float(values[k]) for key, values in columns.items()} for k in range(self.num_projects)]
+
+    def _keep_tail(self, totals: np.ndarray, project_totals: np.ndarray) -> None:
+        self.tail_totals, self.tail_project_totals = keep_top_rows(
+            self.tail_totals, self.tail_project_totals, totals, project_totals, self.tail_size)
+
+    def p95_shares(self) -> np.ndarray:
+        """Each project's share of the expected portfolio cost in the tail"""
+        tail_means = self.tail_project_totals.mean(axis=0) if self.tail_totals.size else None
+        if tail_means is None or tail_means.sum() <= 0:
+            return np.zeros(self.num_projects)
+        return tail_means / tail_means.sum()
+
+
+def _accumulate_portfolio_block(params: Dict[str, Any], seed: int, block_index: int,
+                                rows: int) -> PortfolioAccumulator:
+    """Simulate one block of every project into its own portfolio accumulator."""
+    accumulator = PortfolioAccumulator([cost_bounds(project) for project in params['projects']],
+                                       params['tail_size'])
+    accumulator.update(np.column_stack([
+        simulate_block(project, seed, block_index, rows) for project in params['projects']
+    ]))
+    return accumulator
+
+
+def run_portfolio_simulation(num_simulations: int = 5000, seed: Optional[int] = None,
+                             workers: int = 1) -> Dict[str, Any]:
+    """
+    Simulate the open risks of every project together.
+
+    Args:
+        num_simulations: Number of simulation iterations
+        seed: Optional seed for a reproducible run
+        workers: Number of worker processes to split the iterations across
+
+    Returns:
+        Dictionary with the portfolio statistics and histogram in the format
+        of run_monte_carlo_simulation, and per project its marginal
+        statistics and contribution to the portfolio p95, largest first
+    """
+    if seed is None:
+        seed = new_seed()
+    num_simulations = max(num_simulations, 0)
+
+    by_project = {}
+    for risk in load_active_risks(Risk.objects.all()):
+        by_project.setdefault(risk['project'], []).append(risk)
+    names = dict(Project.objects.filter(id__in=by_project).values_list('id', 'name'))
+    project_ids = sorted(by_project)
+
+    params = {
+        'projects': [_risk_parameter_arrays(by_project[project_id]) for project_id in project_ids],
+        'tail_size': max(1, math.ceil(num_simulations * PORTFOLIO_TAIL_PROBABILITY)),
+    }
+    if project_ids and num_simulations:
+        accumulator = _merge_in_block_order(
+            _run_blocks(_accumulate_portfolio_block, params, num_simulations, seed, workers))
+    else:
+        accumulator = PortfolioAccumulator([cost_bounds(project) for project in params['projects']],
+                                           params['tail_size'])
+
+    statistics = accumulator.portfolio.statistics()
+    shares = accumulator.p95_shares()
+    project_statistics = accumulator.project_statistics()
+    projects = []
+    for k, project_id in enumerate(project_ids):
+        projects.append({
+            'project_id': project_id,
+            'project_name': names.get(project_id, ''),
+            'num_active_risks': len(by_project[project_id]),
+            'statistics': project_statistics[k],
+            'p95_share': float(shares[k]),
+            'p95_contribution': float(shares[k] * statistics['p95']),
+        })
+    projects.sort(key=lambda project: project['p95_contribution'], reverse=True)
+
+    return {
+        'num_simulations': num_simulations,
+        'num_projects': len(project_ids),
+        'num_active_risks': sum(len(risks) for risks in by_project.values()),
+        'seed': seed,
+        'statistics': statistics,
+        'histogram_data': accumulator.portfolio.histogram(num_bins=20),
+        'projects': projects,
+        # What holding the projects together saves over each one's p95 on its own
+        'diversification_benefit': sum(project['statistics']['p95'] for project in projects) - statistics['p95'],
+    }
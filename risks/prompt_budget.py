@@ -0,0 +1,135 @@
+"""
+Fitting project-wide risk lists into a bounded prompt.
+
+Project analyses list every risk in their prompt, which grows without limit
+with the project and takes longer to answer the longer it gets. Here the
+risk list is fitted into AI_PROMPT_TOKEN_BUDGET estimated tokens: risks are
+ranked by score and expected cost, descriptions are cut down (to no less
+than AI_PROMPT_MIN_DESCRIPTION_TOKENS), and if the list still does not fit
+it is split into chunks that are analyzed separately and then merged. At
+most AI_PROMPT_MAX_CHUNKS chunks are made; the lowest ranked risks beyond
+them are left out, so the cost of an analysis stays bounded however many
+risks a project has.
+"""
+import json
+import math
+from typing import Any, List, Sequence, Tuple
+
+from django.conf import settings
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+# Gemini's tokenizer averages about four characters of English per token;
+# estimating locally avoids a count_tokens round trip per prompt
+CHARS_PER_TOKEN = 4
+
+# Marks a description that was cut short
+ELLIPSIS = '...'
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens in a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Cut a text down to about max_tokens, at a word boundary"""
+    text = (text or '').strip()
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:max(limit - len(ELLIPSIS), 0)]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' ,;:.') + ELLIPSIS
+
+
+def by_importance(risks):
+    """Order a risk queryset most important first: by score, then by expected cost"""
+    return risks.annotate(
+        expected_cost=ExpressionWrapper(
+            F('likelihood_percentage') * F('most_likely_cost_impact'),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        )
+    ).order_by('-score', '-expected_cost', 'id')
+
+
+def _render(entries: Sequence[Tuple[str, str]], description_tokens: int) -> List[str]:
+    return [
+        header.replace('{description}', truncate(description, description_tokens))
+        for header, description in entries
+    ]
+
+
+def pack(entries: Sequence[Tuple[str, str]], budget: int = None) -> Tuple[List[List[str]], int]:
+    """
+    Fit risk entries into the token budget.
+
+    Args:
+        entries: (template, description) pairs, most important first; the
+            template is the rendered entry with a "{description}" placeholder
+        budget: Tokens available for the whole list (AI_PROMPT_TOKEN_BUDGET)
+
+    Returns:
+        (chunks, omitted): the rendered entries split into chunks that each
+        fit the budget (a single chunk whenever possible), and the number of
+        lowest ranked entries that were left out
+    """
+    budget = budget or settings.AI_PROMPT_TOKEN_BUDGET
+    if not entries:
+        return [[]], 0
+
+    rendered = _render(entries, settings.AI_PROMPT_DESCRIPTION_TOKENS)
+    if sum(map(estimate_tokens, rendered)) <= budget:
+        return [rendered], 0
+
+    # Share what the templates leave of the budget between the descriptions
+    fixed = sum(estimate_tokens(header.replace('{description}', '')) for header, _ in entries)
+    share = (budget - fixed) // len(entries)
+    if share >= settings.AI_PROMPT_MIN_DESCRIPTION_TOKENS:
+        rendered = _render(entries, share)
+        if sum(map(estimate_tokens, rendered)) <= budget:
+            return [rendered], 0
+
+    # Too many risks for one prompt: split them into chunks, in rank order
+    chunks, size = [[]], 0
+    for entry in _render(entries, settings.AI_PROMPT_MIN_DESCRIPTION_TOKENS):
+        tokens = estimate_tokens(entry)
+        if chunks[-1] and size + tokens > budget:
+            if len(chunks) == settings.AI_PROMPT_MAX_CHUNKS:
+                break
+            chunks.append([])
+            size = 0
+        chunks[-1].append(entry)
+        size += tokens
+    return chunks, len(entries) - sum(map(len, chunks))
+
+
+def fit_json(data: Any, budget: int = None) -> str:
+    """
+    Serialize data compactly within the token budget, dropping items from
+    the end of its longest lists until it fits.
+    """
+    budget = budget or settings.AI_PROMPT_TOKEN_BUDGET
+    text = json.dumps(data, separators=(',', ':'))
+    while estimate_tokens(text) > budget:
+        longest = max(_lists(data), key=len, default=None)
+        if not longest:
+            break
+        longest.pop()
+        text = json.dumps(data, separators=(',', ':'))
+    return text
+
+
+def _lists(data: Any) -> List[list]:
+    """Every list nested in data, including data itself"""
+    found = []
+    if isinstance(data, list):
+        found.append(data)
+        children = data
+    elif isinstance(data, dict):
+        children = data.values()
+    else:
+        return found
+    for child in children:
+        found.extend(_lists(child))
+    return found
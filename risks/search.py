@@ -0,0 +1,246 @@
+"""
+Full-text search over risk titles, descriptions and history comments.
+
+On SQLite the text lives in an FTS5 table (risks_risk_fts, rowid = risk id)
+ranked with bm25; on PostgreSQL in a weighted tsvector column with a GIN index
+(risks_risk_search) ranked with ts_rank. Both are created by migration 0016
+and kept current by the Risk and RiskHistory signal handlers in models.py.
+Other databases fall back to unindexed substring matching.
+"""
+import math
+import re
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_date
+
+from .models import Risk, RiskHistory
+
+SQLITE_TABLE = 'risks_risk_fts'
+POSTGRES_TABLE = 'risks_risk_search'
+
+# Relative weight of title, description and history comment matches in bm25
+SQLITE_COLUMN_WEIGHTS = (10.0, 4.0, 1.0)
+
+# Most results a search returns
+MAX_SEARCH_RESULTS = 100
+
+
+def backend() -> Optional[str]:
+    """'sqlite' or 'postgresql' when a search index exists, otherwise None"""
+    return connection.vendor if connection.vendor in ('sqlite', 'postgresql') else None
+
+
+def _phrases(terms: Iterable[str]) -> List[List[str]]:
+    """Split search terms into phrases of plain words, dropping query syntax"""
+    phrases = [re.findall(r'\w+', str(term).lower()) for term in terms]
+    return [words for words in phrases if words]
+
+
+def build_match_query(terms: Iterable[str], match_all: bool = True, prefix: bool = False) -> str:
+    """
+    Build an index query for the current backend.
+
+    Each term is matched as a phrase; match_all requires every phrase, otherwise
+    any one of them. With prefix the last word of each phrase matches as a
+    prefix, for search-as-you-type. Returns '' when there is nothing to match.
+    """
+    phrases = _phrases(terms)
+    if backend() == 'postgresql':
+        parts = [' <-> '.join(words) + (':*' if prefix else '') for words in phrases]
+        return (' & ' if match_all else ' | ').join(parts)
+    parts = ['"' + ' '.join(words) + '"' + ('*' if prefix else '') for words in phrases]
+    return (' ' if match_all else ' OR ').join(parts)
+
+
+def _document(risk_id: int) -> Optional[Tuple[str, str, str]]:
+    risk = Risk.objects.only('title', 'description').filter(id=risk_id).first()
+    if risk is None:
+        return None
+    comments = RiskHistory.objects.filter(risk_id=risk_id).exclude(change_comment='')
+    comment_text = '\n'.join(comments.values_list('change_comment', flat=True))
+    return risk.title, risk.description, comment_text
+
+
+def index_risk(risk_id: int) -> None:
+    """Add or refresh a risk's entry in the search index"""
+    if backend() is None:
+        return
+    document = _document(risk_id)
+    if document is None:
+        remove_risk(risk_id)
+        return
+    title, description, comments = document
+    with connection.cursor() as cursor:
+        if backend() == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {POSTGRES_TABLE} (risk_id, document) VALUES (%s, "
+                "setweight(to_tsvector('english', %s), 'A') || "
+                "setweight(to_tsvector('english', %s), 'B') || "
+                "setweight(to_tsvector('english', %s), 'C')) "
+                "ON CONFLICT (risk_id) DO UPDATE SET document = EXCLUDED.document",
+                [risk_id, title, description, comments],
+            )
+        else:
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s", [risk_id])
+            cursor.execute(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, title, description, comments) VALUES (%s, %s, %s, %s)",
+                [risk_id, title, description, comments],
+            )
+
+
+def remove_risk(risk_id: int) -> None:
+    """Drop a deleted risk from the search index"""
+    if backend() is None:
+        return
+    table = POSTGRES_TABLE if backend() == 'postgresql' else SQLITE_TABLE
+    column = 'risk_id' if backend() == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = %s", [risk_id])
+
+
+def rebuild_index() -> int:
+    """Re-index every risk; returns the number indexed"""
+    if backend() is None:
+        return 0
+    table = POSTGRES_TABLE if backend() == 'postgresql' else SQLITE_TABLE
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+    risk_ids = list(Risk.objects.values_list('id', flat=True))
+    for risk_id in risk_ids:
+        index_risk(risk_id)
+    return len(risk_ids)
+
+
+def matching_filter(terms: Iterable[str], match_all: bool = True, prefix: bool = False) -> Q:
+    """
+    Filter for risks whose indexed text matches the terms.
+
+    Combines with other queryset filters; without a search index it falls
+    back to substring matching on title and description.
+    """
+    terms = list(terms)
+    match = build_match_query(terms, match_all, prefix)
+    if not match:
+        return Q()
+    if backend() == 'postgresql':
+        return Q(id__in=RawSQL(
+            f"SELECT risk_id FROM {POSTGRES_TABLE} WHERE document @@ to_tsquery('english', %s)", [match]
+        ))
+    if backend() == 'sqlite':
+        return Q(id__in=RawSQL(f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s", [match]))
+
+    condition = Q() if match_all else Q(pk__in=[])
+    for words in _phrases(terms):
+        phrase = ' '.join(words)
+        term_filter = Q(title__icontains=phrase) | Q(description__icontains=phrase)
+        condition = condition & term_filter if match_all else condition | term_filter
+    return condition
+
+
+def ranked_search(terms: Iterable[str], risks=None, match_all: bool = True,
+                  limit: int = MAX_SEARCH_RESULTS) -> List[Tuple[Risk, float]]:
+    """
+    Search risks by relevance.
+
+    Args:
+        terms: Keywords or phrases to look for
+        risks: Queryset restricting the candidates (filters applied in SQL)
+        match_all: Require all terms instead of any
+        limit: Maximum number of results
+
+    Returns:
+        (risk, rank) pairs, most relevant first; higher rank is better
+    """
+    terms = list(terms)
+    if risks is None:
+        risks = Risk.objects.all()
+    match = build_match_query(terms, match_all)
+    if not match:
+        return []
+
+    if backend() is None:
+        rows = risks.filter(matching_filter(terms, match_all)).order_by('-likelihood', '-impact', 'title', 'id')
+        return [(risk, 0.0) for risk in rows.select_related('project', 'category')[:limit]]
+
+    candidate_sql, candidate_params = risks.order_by().values('id').query.sql_with_params()
+    if backend() == 'postgresql':
+        sql = (f"SELECT risk_id, ts_rank(document, query) AS rank "
+               f"FROM {POSTGRES_TABLE}, to_tsquery('english', %s) query "
+               f"WHERE document @@ query AND risk_id IN ({candidate_sql}) "
+               f"ORDER BY rank DESC, risk_id LIMIT %s")
+    else:
+        weights = ', '.join(str(weight) for weight in SQLITE_COLUMN_WEIGHTS)
+        # bm25 is lower for better matches, so negate it into a rank
+        sql = (f"SELECT rowid, -bm25({SQLITE_TABLE}, {weights}) AS rank "
+               f"FROM {SQLITE_TABLE} "
+               f"WHERE {SQLITE_TABLE} MATCH %s AND rowid IN ({candidate_sql}) "
+               f"ORDER BY rank DESC, rowid LIMIT %s")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *candidate_params, limit])
+        ranked = cursor.fetchall()
+
+    by_id = Risk.objects.select_related('project', 'category').in_bulk([risk_id for risk_id, _ in ranked])
+    return [(by_id[risk_id], float(rank)) for risk_id, rank in ranked if risk_id in by_id]
+
+
+def _as_list(value: Any) -> List[Any]:
+    """A list parameter, with a single value taken as a one-element list"""
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _parse_date(value: Any, name: str) -> date:
+    """A date_range bound in YYYY-MM-DD format; raises ValueError otherwise"""
+    parsed = parse_date(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f"date_range.{name} must be a date in YYYY-MM-DD format")
+    return parsed
+
+
+def _parse_score(value: Any) -> float:
+    """A minimum_risk_score that is a number; raises ValueError otherwise"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError('minimum_risk_score must be a number')
+    return value
+
+
+def apply_search_parameters(search_parameters: Dict[str, Any], risks=None,
+                            limit: int = MAX_SEARCH_RESULTS) -> List[Tuple[Risk, float]]:
+    """
+    Run the structured parameters produced by ai_features.smart_risk_search.
+
+    Keywords are ranked with the search index (any keyword may match);
+    categories, status, minimum_risk_score and date_range become SQL filters.
+    Without keywords the filtered risks are returned in register order.
+    Raises ValueError for parameters that cannot be applied, such as a
+    date_range bound that is not a date or a minimum_risk_score that is not
+    a number.
+    """
+    if risks is None:
+        risks = Risk.objects.all()
+    params = search_parameters or {}
+    if not isinstance(params, dict):
+        raise ValueError('search_parameters must be an object')
+
+    if params.get('categories'):
+        risks = risks.filter(category__name__in=_as_list(params['categories']))
+    if params.get('status'):
+        risks = risks.filter(status__in=_as_list(params['status']))
+    if params.get('minimum_risk_score') is not None:
+        risks = risks.filter(score__gte=_parse_score(params['minimum_risk_score']))
+    date_range = params.get('date_range') or {}
+    if not isinstance(date_range, dict):
+        raise ValueError('date_range must be an object with from and to dates')
+    if date_range.get('from'):
+        risks = risks.filter(created_at__date__gte=_parse_date(date_range['from'], 'from'))
+    if date_range.get('to'):
+        risks = risks.filter(created_at__date__lte=_parse_date(date_range['to'], 'to'))
+
+    keywords = _as_list(params.get('keywords') or [])
+    if _phrases(keywords):
+        return ranked_search(keywords, risks, match_all=False, limit=limit)
+    rows = risks.select_related('project', 'category').order_by('-likelihood', '-impact', 'title', 'id')
+    return [(risk, 0.0) for risk in rows[:limit]]
@@ -0,0 +1,212 @@
+"""
+Sensitivity (tornado) analysis of a project simulation in one pass.
+
+Every block of iterations is simulated with one column of costs per risk,
+and each risk's part in the total is measured from those columns instead
+of rerunning the project without it:
+
+- variance_share: Cov(risk, total) / Var(total), the risk's share of the
+  variance of the total cost; the shares add up to 1, and a risk can have
+  a share above its own variance when it is correlated with others
+- rank_correlation: Spearman correlation between the risk's cost and the
+  total, computed within each block of STREAM_BLOCK_SIZE iterations and
+  averaged over the blocks
+- tail_mean_p90 / tail_mean_p95: the risk's expected cost in the
+  iterations where the total is at or beyond its p90 / p95, next to its
+  overall mean
+
+The moments are merged block by block with the pairwise update formulas,
+so memory stays bounded by the block size and the p90 tail, which is
+kept row by row: SENSITIVITY_TAIL_PROBABILITY of the iterations times the
+number of risks.
+"""
+import math
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .monte_carlo import (_merge_in_block_order, _risk_parameter_arrays, _run_blocks, load_active_risks, new_seed,
+                          simulate_block)
+from .streaming_stats import keep_top_rows
+
+# Share of iterations kept for the conditional tail expectations; covers
+# both the p90 and the p95 tail
+SENSITIVITY_TAIL_PROBABILITY = 0.10
+
+
+def _midranks(values: np.ndarray) -> np.ndarray:
+    """Ranks starting at 1, with tied values sharing the mean of their ranks"""
+    order = np.argsort(values)
+    ordered = values[order]
+    # Runs of equal values in sorted order take ranks start + 1 .. end
+    starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+    ends = np.append(starts[1:], values.size)
+    ranks = np.empty(values.size)
+    ranks[order] = np.repeat((starts + ends + 1) / 2.0, ends - starts)
+    return ranks
+
+
+def _column_ranks(column: np.ndarray) -> np.ndarray:
+    """
+    Midranks of a risk's costs. Most entries are the zeros of iterations
+    where the risk did not occur, so only the others are sorted.
+    """
+    nonzero = np.flatnonzero(column)
+    negatives = np.count_nonzero(column < 0)
+    zeros = column.size - nonzero.size
+    ranks = np.full(column.size, negatives + (zeros + 1) / 2.0)
+    if nonzero.size:
+        values = column[nonzero]
+        ranks[nonzero] = _midranks(values) + np.where(values > 0, zeros, 0)
+    return ranks
+
+
+def _rank_correlations(columns: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    """Spearman correlation of each column with the totals; 0 for constant columns"""
+    total_ranks = _midranks(totals)
+    total_ranks -= total_ranks.mean()
+    ranks = np.empty_like(columns)
+    for j in range(columns.shape[1]):
+        ranks[:, j] = _column_ranks(columns[:, j])
+    ranks -= ranks.mean(axis=0)
+    norms = np.sqrt((ranks * ranks).sum(axis=0) * (total_ranks @ total_ranks))
+    return np.divide(ranks.T @ total_ranks, norms, out=np.zeros(columns.shape[1]), where=norms > 0)
+
+
+class SensitivityAccumulator:
+    """
+    Streaming moments of the risk columns and the total, block-wise rank
+    correlations and the rows with the highest totals.
+    """
+
+    def __init__(self, num_risks: int, tail_size: int):
+        self.count = 0
+        self.means = np.zeros(num_risks)
+        self.m2 = np.zeros(num_risks)
+        self.total_mean = 0.0
+        self.total_m2 = 0.0
+        self.comoments = np.zeros(num_risks)
+        self.weighted_rank_correlations = np.zeros(num_risks)
+        self.tail_size = tail_size
+        self.tail_totals = np.zeros(0)
+        self.tail_columns = np.zeros((0, num_risks))
+
+    def update(self, columns: np.ndarray) -> None:
+        """Add a block of iterations, given as a (rows x risks) array of risk costs"""
+        rows = columns.shape[0]
+        if rows == 0:
+            return
+        totals = columns.sum(axis=1)
+        means = columns.mean(axis=0)
+        total_mean = float(totals.mean())
+        centred = columns - means
+        centred_totals = totals - total_mean
+        self._combine(rows, means, (centred * centred).sum(axis=0), total_mean,
+                      float(centred_totals @ centred_totals), centred.T @ centred_totals)
+        self.weighted_rank_correlations += rows * _rank_correlations(columns, totals)
+        self._keep_tail(totals, columns)
+
+    def merge(self, other: 'SensitivityAccumulator') -> None:
+        """Combine with the accumulator of a later run of blocks"""
+        if other.count == 0:
+            return
+        self._combine(other.count, other.means, other.m2, other.total_mean, other.total_m2, other.comoments)
+        self.weighted_rank_correlations += other.weighted_rank_correlations
+        self._keep_tail(other.tail_totals, other.tail_columns)
+
+    def _combine(self, count, means, m2, total_mean, total_m2, comoments) -> None:
+        combined = self.count + count
+        weight = self.count * count / combined
+        delta = means - self.means
+        total_delta = total_mean - self.total_mean
+        self.m2 = self.m2 + m2 + delta * delta * weight
+        self.total_m2 += total_m2 + total_delta * total_delta * weight
+        self.comoments = self.comoments + comoments + delta * total_delta * weight
+        self.means = self.means + delta * count / combined
+        self.total_mean += total_delta * count / combined
+        self.count = combined
+
+    def _keep_tail(self, totals: np.ndarray, columns: np.ndarray) -> None:
+        self.tail_totals, self.tail_columns = keep_top_rows(
+            self.tail_totals, self.tail_columns, totals, columns, self.tail_size)
+
+    def tail_means(self, probability: float) -> np.ndarray:
+        """Each risk's mean cost over the highest `probability` share of totals"""
+        rows = max(1, math.ceil(self.count * probability))
+        worst = np.argsort(self.tail_totals)[::-1][:rows]
+        if worst.size == 0:
+            return np.zeros(self.tail_columns.shape[1])
+        return self.tail_columns[worst].mean(axis=0)
+
+
+def _accumulate_sensitivity_block(params: Dict[str, Any], seed: int, block_index: int,
+                                  rows: int) -> SensitivityAccumulator:
+    """Simulate one block by risk into its own sensitivity accumulator."""
+    accumulator = SensitivityAccumulator(len(params['risks']['ids']), params['tail_size'])
+    accumulator.update(simulate_block(params['risks'], seed, block_index, rows, columns=True))
+    return accumulator
+
+
+def run_sensitivity_analysis(risks, num_simulations: int = 5000, seed: Optional[int] = None,
+                             workers: int = 1) -> Dict[str, Any]:
+    """
+    Rank the open risks of a queryset by how much they drive the total cost.
+
+    Uses the same random streams as run_monte_carlo_simulation, so with the
+    same seed it explains the run the Monte Carlo page shows.
+
+    Args:
+        risks: QuerySet of Risk objects
+        num_simulations: Number of simulation iterations
+        seed: Optional seed for a reproducible run
+        workers: Number of worker processes to split the iterations across
+
+    Returns:
+        Dictionary with the run's size and seed, the total's variance and
+        tail means, and per risk its sensitivity measures, largest
+        variance share first
+    """
+    if seed is None:
+        seed = new_seed()
+    num_simulations = max(num_simulations, 0)
+    active_risks = load_active_risks(risks)
+    params = {
+        'risks': _risk_parameter_arrays(active_risks),
+        'tail_size': max(1, math.ceil(num_simulations * SENSITIVITY_TAIL_PROBABILITY)),
+    }
+
+    if active_risks and num_simulations:
+        accumulator = _merge_in_block_order(
+            _run_blocks(_accumulate_sensitivity_block, params, num_simulations, seed, workers))
+    else:
+        accumulator = SensitivityAccumulator(len(active_risks), params['tail_size'])
+
+    # Sample variances, as in the simulation statistics
+    count = accumulator.count
+    variance = accumulator.total_m2 / (count - 1) if count > 1 else 0.0
+    tail_p90 = accumulator.tail_means(0.10)
+    tail_p95 = accumulator.tail_means(0.05)
+    report = []
+    for j, risk in enumerate(active_risks):
+        report.append({
+            'risk_id': risk['id'],
+            'title': risk['title'],
+            'mean': float(accumulator.means[j]),
+            'std_dev': float(math.sqrt(accumulator.m2[j] / (count - 1))) if count > 1 else 0.0,
+            'variance_share': float(accumulator.comoments[j] / accumulator.total_m2) if variance > 0 else 0.0,
+            'rank_correlation': float(accumulator.weighted_rank_correlations[j] / count) if count else 0.0,
+            'tail_mean_p90': float(tail_p90[j]),
+            'tail_mean_p95': float(tail_p95[j]),
+        })
+    report.sort(key=lambda entry: entry['variance_share'], reverse=True)
+
+    return {
+        'num_simulations': num_simulations,
+        'num_active_risks': len(active_risks),
+        'seed': seed,
+        'mean': accumulator.total_mean,
+        'std_dev': math.sqrt(variance),
+        'tail_mean_p90': float(tail_p90.sum()),
+        'tail_mean_p95': float(tail_p95.sum()),
+        'risks': report,
+    }
@@ -0,0 +1,354 @@
+"""
+Nearest-neighbour search over risk text.
+
+Each risk's title and description are turned into a fixed-width hashed
+n-gram vector (words, word pairs and character trigrams, signed feature
+hashing, L2-normalised), so cosine similarity is a plain dot product and
+new risks never change the vectors of existing ones. The vectors live in a
+single file of fixed-size records under RISK_SIMILARITY_INDEX_DIR, which is
+memory-mapped for queries and patched in place when a risk is saved or
+deleted. Deleted risks leave a zeroed slot behind until the next rebuild.
+Each process keeps a float32 copy of the matrix for querying and reloads it
+when the file changes.
+
+The file is built by the rebuild_similarity_index command or a background
+job. Until then queries find nothing and queue one rebuild job, and saves
+only update an index that already exists.
+Rebuilds, upserts and removals hold an exclusive lock on a sidecar file, so
+a patch never lands in a file swapped in by a rebuild and saves made during
+a rebuild wait for it instead of being lost.
+"""
+import logging
+import math
+import os
+import re
+import tempfile
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .jobs import check_param_names, enqueue_job
+from .models import BackgroundJob, Risk
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'risk_vectors.bin'
+LOCK_FILENAME = 'risk_vectors.lock'
+
+# Width of the hashed feature space
+DIMENSIONS = 512
+
+# One record per risk; risk_id 0 marks a deleted slot
+RECORD_DTYPE = np.dtype([
+    ('risk_id', '<i8'),
+    ('project_id', '<i8'),
+    ('vector', '<f2', (DIMENSIONS,)),
+])
+
+# Feature weights: whole words count more than the trigrams that spell them
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+# The title is a denser summary of the risk than its description
+TITLE_WEIGHT = 2.0
+
+# Lowest similarity worth handing to the AI as context
+MIN_SIMILARITY = 0.1
+
+# Similarity at which the add-risk form warns about a likely duplicate
+DUPLICATE_THRESHOLD = 0.6
+
+# Rows scored per batch, bounding the temporaries of a filtered query
+QUERY_BLOCK_ROWS = 8192
+
+# Extra candidates fetched when results are further filtered in SQL
+CANDIDATE_OVERSAMPLE = 4
+
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can could for from has have if in into is it
+its may might not of on or our should so such than that the their then there
+these this to was we were will with would
+""".split())
+
+
+def _features(text: str) -> Counter:
+    words = [word for word in re.findall(r'\w+', (text or '').lower()) if word not in STOP_WORDS]
+    features = Counter()
+    for word in words:
+        features['w:' + word] += WORD_WEIGHT
+        padded = f'#{word}#'
+        for i in range(len(padded) - 2):
+            features['c:' + padded[i:i + 3]] += TRIGRAM_WEIGHT
+    for first, second in zip(words, words[1:]):
+        features[f'b:{first} {second}'] += BIGRAM_WEIGHT
+    return features
+
+
+def _hashed(text: str) -> np.ndarray:
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for feature, count in _features(text).items():
+        # crc32 rather than hash(): the index outlives the process, and str
+        # hashes are salted per interpreter
+        digest = zlib.crc32(feature.encode())
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        # Sublinear term frequency so repeated words do not dominate
+        vector[digest % DIMENSIONS] += sign * math.log1p(count)
+    return vector
+
+
+def vectorize(title: str, description: str = '') -> np.ndarray:
+    """Unit-length float32 vector for a risk's text (all zeros for empty text)"""
+    vector = TITLE_WEIGHT * _hashed(title) + _hashed(description)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SimilarityIndex:
+    """Risk vectors in a memory-mapped record file"""
+
+    def __init__(self, directory):
+        self.path = Path(directory) / INDEX_FILENAME
+        self.lock_path = Path(directory) / LOCK_FILENAME
+        self._file_key = None
+        self._ids = self._project_ids = self._matrix = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @contextmanager
+    def locked(self):
+        """Hold the index's write lock, shared by every process using the directory"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def records(self) -> np.ndarray:
+        """The records currently on disk, memory-mapped"""
+        try:
+            rows = os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            rows = 0
+        if not rows:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', shape=(rows,))
+
+    def _refresh(self) -> None:
+        try:
+            stat = os.stat(self.path)
+            file_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            file_key = None
+        if file_key == self._file_key and self._ids is not None:
+            return
+        records = self.records()
+        # Queries run against contiguous float32 copies, which BLAS multiplies
+        # far faster than the interleaved float16 records
+        self._ids = np.array(records['risk_id'])
+        self._project_ids = np.array(records['project_id'])
+        self._matrix = np.ascontiguousarray(records['vector'], dtype=np.float32)
+        self._file_key = file_key
+
+    def _rows_for(self, risk_id: int) -> np.ndarray:
+        return np.flatnonzero(self.records()['risk_id'] == risk_id)
+
+    def upsert(self, risk_id: int, project_id: int, vector: np.ndarray) -> None:
+        """
+        Overwrite the risk's record in place, or append one for a new risk.
+
+        The caller must hold the lock, so the rows found are rows of the file
+        being written.
+        """
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['risk_id'], record['project_id'], record['vector'] = risk_id, project_id, vector
+        rows = self._rows_for(risk_id)
+        if len(rows):
+            with open(self.path, 'r+b') as f:
+                f.seek(int(rows[0]) * RECORD_DTYPE.itemsize)
+                f.write(record.tobytes())
+            self._clear_rows(rows[1:])
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(record.tobytes())
+
+    def remove(self, risk_id: int) -> None:
+        """Free the risk's slot; the caller must hold the lock"""
+        self._clear_rows(self._rows_for(risk_id))
+
+    def _clear_rows(self, rows: Iterable[int]) -> None:
+        rows = list(rows)
+        if not rows:
+            return
+        with open(self.path, 'r+b') as f:
+            for row in rows:
+                f.seek(int(row) * RECORD_DTYPE.itemsize)
+                f.write(np.int64(0).tobytes())
+
+    def write(self, records: np.ndarray) -> None:
+        """Replace the whole file atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A unique name per writer, so concurrent rebuilds never share a half-written file
+        with tempfile.NamedTemporaryFile(dir=self.path.parent, suffix='.tmp', delete=False) as handle:
+            records.tofile(handle)
+        os.replace(handle.name, self.path)
+
+    def nearest(self, vector: np.ndarray, k: int, project_id: Optional[int] = None,
+                exclude_ids: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """
+        Top-k risks by cosine similarity.
+
+        Returns:
+            (risk_id, similarity) pairs, most similar first
+        """
+        self._refresh()
+        if k <= 0 or not len(self._ids) or not vector.any():
+            return []
+        exclude = np.array(list(exclude_ids), dtype=np.int64)
+        query = vector.astype(np.float32)
+
+        ids, scores = [], []
+        for start in range(0, len(self._ids), QUERY_BLOCK_ROWS):
+            block_ids = self._ids[start:start + QUERY_BLOCK_ROWS]
+            live = block_ids != 0
+            if project_id is not None:
+                live &= self._project_ids[start:start + QUERY_BLOCK_ROWS] == project_id
+            if len(exclude):
+                live &= ~np.isin(block_ids, exclude)
+            rows = np.flatnonzero(live)
+            if not len(rows):
+                continue
+            matrix = self._matrix[start:start + QUERY_BLOCK_ROWS]
+            block_scores = (matrix if live.all() else matrix[rows]) @ query
+            if len(block_scores) > k:
+                top = np.argpartition(-block_scores, k - 1)[:k]
+                rows, block_scores = rows[top], block_scores[top]
+            ids.append(block_ids[rows])
+            scores.append(block_scores)
+        if not ids:
+            return []
+
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        results, seen = [], set()
+        for i in np.lexsort((ids, -scores)):
+            risk_id = int(ids[i])
+            if risk_id not in seen:
+                seen.add(risk_id)
+                results.append((risk_id, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+
+_indexes = {}
+
+
+def get_index() -> SimilarityIndex:
+    """The index for the configured directory, shared within the process"""
+    directory = str(settings.RISK_SIMILARITY_INDEX_DIR)
+    if directory not in _indexes:
+        _indexes[directory] = SimilarityIndex(directory)
+    return _indexes[directory]
+
+
+def index_risk(risk: Risk) -> None:
+    """Add or refresh a saved risk's vector, if the index has been built"""
+    index = get_index()
+    if index.exists():
+        vector = vectorize(risk.title, risk.description)
+        with index.locked():
+            if index.exists():
+                index.upsert(risk.id, risk.project_id, vector)
+
+
+def remove_risk(risk_id: int) -> None:
+    """Drop a deleted risk from the index, if the index has been built"""
+    index = get_index()
+    if index.exists():
+        with index.locked():
+            index.remove(risk_id)
+
+
+def rebuild_index() -> int:
+    """Vectorise every risk into a fresh, compact index file; returns the number indexed"""
+    index = get_index()
+    # Locked from the read onwards: a save that lands during the rebuild
+    # waits and patches the new file rather than the one being replaced
+    with index.locked():
+        rows = Risk.objects.values_list('id', 'project_id', 'title', 'description').order_by('id')
+        records = np.array([
+            (risk_id, project_id, vectorize(title, description))
+            for risk_id, project_id, title, description in rows.iterator(chunk_size=2000)
+        ], dtype=RECORD_DTYPE)
+        index.write(records)
+    return len(records)
+
+
+def rebuild_index_payload():
+    """Rebuild the index as a background job"""
+    return {'indexed': rebuild_index()}
+
+
+def rebuild_index_job_params(params: dict) -> dict:
+    """Params of a rebuild job, which takes none"""
+    check_param_names(params, ())
+    return {}
+
+
+def _queue_rebuild() -> None:
+    """Queue a rebuild of the missing index, unless one is already pending"""
+    pending = BackgroundJob.objects.filter(kind='rebuild_similarity_index', status__in=('queued', 'running'))
+    if not pending.exists():
+        enqueue_job('rebuild_similarity_index', {})
+        logger.warning('Risk similarity index %s is missing; queued a rebuild', get_index().path)
+
+
+def similar_risks(title: str, description: str = '', k: int = 5, project_id: Optional[int] = None,
+                  exclude_ids: Iterable[int] = (), risks=None,
+                  min_score: float = MIN_SIMILARITY) -> List[Tuple[Risk, float]]:
+    """
+    Find the risks whose text is closest to the given title and description.
+
+    Args:
+        title: Title (or free text) to compare against
+        description: Optional description, weighted below the title
+        k: Maximum number of results
+        project_id: Only consider risks of this project
+        exclude_ids: Risk ids to leave out, such as the risk being edited
+        risks: Queryset the results must also belong to (filtered in SQL)
+        min_score: Drop results less similar than this
+
+    Returns:
+        (risk, similarity) pairs, most similar first; similarity is at most 1;
+        empty while the index is missing
+    """
+    index = get_index()
+    if not index.exists():
+        _queue_rebuild()
+        return []
+    candidates = index.nearest(vectorize(title, description),
+                               k * CANDIDATE_OVERSAMPLE if risks is not None else k,
+                               project_id, exclude_ids)
+    candidates = [(risk_id, score) for risk_id, score in candidates if score >= min_score]
+
+    if risks is None:
+        risks = Risk.objects.all()
+    by_id = risks.select_related('project', 'category').in_bulk([risk_id for risk_id, _ in candidates])
+    return [(by_id[risk_id], score) for risk_id, score in candidates if risk_id in by_id][:k]
+
+
+def find_duplicates(title: str, description: str = '', project_id: Optional[int] = None,
+                    exclude_ids: Iterable[int] = (), k: int = 5) -> List[Tuple[Risk, float]]:
+    """Existing risks similar enough to be the same risk entered twice"""
+    return similar_risks(title, description, k, project_id, exclude_ids, min_score=DUPLICATE_THRESHOLD)
@@ -0,0 +1,84 @@
+"""
+Content-addressed cache of Monte Carlo simulation results.
+
+A run is identified by a hash of the open risks' simulation inputs, the
+iteration count and the seed. Stored runs are only reused while the latest
+updated_at of the project's open risks is unchanged, so any edit to a risk
+invalidates them.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import SimulationRun
+from .monte_carlo import load_active_risks, simulate_active_risks
+
+# Number of points in the CDF stored with every cached run
+CACHED_CDF_POINTS = 101
+
+
+def simulation_inputs_hash(active_risks, num_simulations: int, seed: Optional[int]) -> str:
+    """
+    Hash everything that determines a simulation result.
+    
+    Runs without an explicit seed share the 'auto' key, so a repeated request
+    without a seed is answered with the same stored run.
+    """
+    payload = {
+        'risks': [
+            {key: value for key, value in risk.items() if key != 'title'}
+            for risk in active_risks
+        ],
+        'num_simulations': num_simulations,
+        'seed': 'auto' if seed is None else seed,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def run_cached_simulation(project, num_simulations: int, seed: Optional[int] = None,
+                          workers: int = 1) -> Tuple[Dict[str, Any], bool]:
+    """
+    Return the simulation result for a project, from the cache when possible.
+    
+    Args:
+        project: Project whose open risks are simulated
+        num_simulations: Number of simulation iterations
+        seed: Optional seed for a reproducible run
+        workers: Number of worker processes for a fresh run
+        
+    Returns:
+        Tuple of (result dictionary including a CDF, whether it came from the cache)
+    """
+    active_risks = load_active_risks(project.risks)
+    risks_updated_at = project.risks.filter(status='Open').aggregate(latest=Max('updated_at'))['latest']
+    inputs_hash = simulation_inputs_hash(active_risks, num_simulations, seed)
+    
+    cached = SimulationRun.objects.filter(
+        project=project,
+        inputs_hash=inputs_hash,
+        risks_updated_at=risks_updated_at,
+    ).only('result').first()
+    if cached is not None:
+        return cached.result, True
+    
+    result = simulate_active_risks(active_risks, num_simulations, seed, workers,
+                                   cdf_points=CACHED_CDF_POINTS)
+    SimulationRun.objects.create(
+        project=project,
+        inputs_hash=inputs_hash,
+        num_simulations=num_simulations,
+        seed=result['seed'],
+        risks_updated_at=risks_updated_at,
+        result=result,
+    )
+    
+    # Drop stale runs beyond the per-project limit
+    stale_ids = SimulationRun.objects.filter(project=project).values_list('id', flat=True)[
+        settings.MONTE_CARLO_CACHED_RUNS_PER_PROJECT:]
+    SimulationRun.objects.filter(id__in=list(stale_ids)).delete()
+    
+    return result, False
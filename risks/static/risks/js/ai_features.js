@@ -2,6 +2,37 @@
  * JavaScript functions for interacting with AI features
  */
 
+/**
+ * Waits for a queued background job to finish
+ * @param {object} data - Response data; returned unchanged unless it describes a queued job
+ * @param {number} interval - Polling interval in milliseconds
+ * @returns {Promise<object>} The job's result payload
+ */
+function resolveBackgroundJob(data, interval = 2000) {
+    if (!data || !data.job_id) {
+        return Promise.resolve(data);
+    }
+    
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(data.result_url, {
+                headers: {
+                    'X-CSRFToken': getCsrfToken()
+                }
+            })
+            .then(response => {
+                if (response.status === 202) {
+                    setTimeout(poll, interval);
+                    return;
+                }
+                return response.json().then(resolve);
+            })
+            .catch(reject);
+        };
+        poll();
+    });
+}
+
 /**
  * Enhances a risk description using Gemini AI
  * @param {string} description - The original risk description
@@ -52,6 +83,7 @@ function analyzeRiskTrends(projectId, callback) {
         }
     })
     .then(response => response.json())
+    .then(resolveBackgroundJob)
     .then(data => {
         if (data.success) {
             callback(null, data);
@@ -241,6 +273,7 @@ function analyzeRiskDependencies(projectId, callback) {
         }
     })
     .then(response => response.json())
+    .then(resolveBackgroundJob)
     .then(data => {
         if (data.success) {
             callback(null, data);
@@ -267,6 +300,7 @@ function generateExecutiveSummary(projectId, callback) {
         }
     })
     .then(response => response.json())
+    .then(resolveBackgroundJob)
     .then(data => {
         if (data.success) {
             callback(null, data);
@@ -300,6 +334,7 @@ function generateMitigationTimeline(projectId, constraints, callback) {
         body: JSON.stringify(requestData)
     })
     .then(response => response.json())
+    .then(resolveBackgroundJob)
     .then(data => {
         if (data.success) {
             callback(null, data);
@@ -312,6 +347,33 @@ function generateMitigationTimeline(projectId, constraints, callback) {
     });
 }
 
+/**
+ * Run the trend, dependency, executive summary and mitigation timeline
+ * analyses of a project in one request; the server runs them concurrently
+ * @param {number} projectId - Project ID
+ * @param {function} callback - Callback function receiving one result per analysis
+ */
+function runProjectAnalysis(projectId, callback) {
+    fetch(`/ai/project-analysis/${projectId}/`, {
+        method: 'GET',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCsrfToken()
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            callback(null, data);
+        } else {
+            callback(new Error(data.error || 'Failed to analyze project'), null);
+        }
+    })
+    .catch(error => {
+        callback(error, null);
+    });
+}
+
 /**
  * Helper function to get CSRF token from cookies
  * @returns {string} CSRF token
@@ -0,0 +1,262 @@
+"""
+One-pass statistics for Monte Carlo simulation results.
+
+The accumulator in this module consumes simulation totals block by block and
+never stores them, so its memory use does not grow with the iteration count.
+Accumulators built from separate chunks of a run (for example in different
+worker processes) combine with merge().
+"""
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Number of fixed-width bins the accumulator counts into. The 20-bin chart
+# histogram is rebinned from these, so this sets its resolution.
+FINE_HISTOGRAM_BINS = 16384
+
+# t-digest compression: roughly the maximum number of centroids kept.
+DEFAULT_COMPRESSION = 200
+
+
+class TDigest:
+    """
+    Mergeable quantile sketch (merging t-digest).
+
+    Values are summarised as weighted centroids. The arcsine scale function
+    keeps centroids small near the tails, so high percentiles such as p95 stay
+    accurate while the sketch size is bounded by the compression parameter.
+    """
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.zeros(0, dtype=float)
+        self.weights = np.zeros(0, dtype=float)
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self, values) -> None:
+        """Add a batch of values to the sketch."""
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+        self._compress(
+            np.concatenate([self.means, values]),
+            np.concatenate([self.weights, np.ones(values.size)]),
+        )
+
+    def merge(self, other: 'TDigest') -> 'TDigest':
+        """Fold another sketch into this one and return self."""
+        if other.weights.size:
+            self._compress(
+                np.concatenate([self.means, other.means]),
+                np.concatenate([self.weights, other.weights]),
+            )
+        return self
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind='stable')
+        means = means[order]
+        weights = weights[order]
+
+        # Give each point the integer k-scale bucket of its mid quantile and
+        # merge the points that share a bucket into one centroid
+        total = weights.sum()
+        mid_quantiles = (np.cumsum(weights) - weights / 2) / total
+        scale = self.compression / (2 * math.pi)
+        buckets = np.floor(scale * np.arcsin(2 * mid_quantiles - 1)).astype(np.int64)
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(weights * means, starts) / self.weights
+
+    def quantile(self, q: float, min_value: Optional[float] = None,
+                 max_value: Optional[float] = None) -> float:
+        """
+        Estimate the value at quantile q (0-1).
+
+        Centroid means are interpolated at their cumulative midpoints; the
+        exact minimum and maximum, when given, anchor the two ends.
+        """
+        if self.weights.size == 0:
+            return 0.0
+
+        total = self.weights.sum()
+        positions = np.cumsum(self.weights) - self.weights / 2
+        means = self.means
+        if min_value is not None:
+            positions = np.concatenate([[0.0], positions])
+            means = np.concatenate([[min_value], means])
+        if max_value is not None:
+            positions = np.concatenate([positions, [total]])
+            means = np.concatenate([means, [max_value]])
+        return float(np.interp(q * total, positions, means))
+
+
+class SimulationAccumulator:
+    """
+    Streaming summary of simulation totals.
+
+    Tracks count, mean and variance (Welford's method, batched with Chan's
+    parallel update), the exact minimum and maximum, fixed-bin histogram
+    counts over the run's possible cost range and a t-digest for percentiles.
+
+    Args:
+        lower: Lowest possible total cost of the run
+        upper: Highest possible total cost of the run
+        num_bins: Number of fixed histogram bins between lower and upper
+        compression: t-digest compression
+    """
+
+    def __init__(self, lower: float, upper: float, num_bins: int = FINE_HISTOGRAM_BINS,
+                 compression: int = DEFAULT_COMPRESSION):
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min_value = math.inf
+        self.max_value = -math.inf
+        self.bin_counts = np.zeros(num_bins, dtype=np.int64)
+        self.digest = TDigest(compression)
+
+    def update(self, values) -> None:
+        """Add a batch of simulation totals."""
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        self._combine_moments(values.size, batch_mean, batch_m2)
+        self.min_value = min(self.min_value, float(values.min()))
+        self.max_value = max(self.max_value, float(values.max()))
+
+        self.bin_counts += np.bincount(self._bin_indexes(values), minlength=self.bin_counts.size)
+        self.digest.update(values)
+
+    def merge(self, other: 'SimulationAccumulator') -> 'SimulationAccumulator':
+        """Fold an accumulator for another chunk of the same run into this one."""
+        if other.count == 0:
+            return self
+        self._combine_moments(other.count, other.mean, other.m2)
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        self.bin_counts += other.bin_counts
+        self.digest.merge(other.digest)
+        return self
+
+    def _combine_moments(self, count: int, mean: float, m2: float) -> None:
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _bin_indexes(self, values: np.ndarray) -> np.ndarray:
+        num_bins = self.bin_counts.size
+        width = self.upper - self.lower
+        if width <= 0:
+            return np.zeros(values.size, dtype=np.int64)
+        indexes = ((values - self.lower) / width * num_bins).astype(np.int64)
+        return np.clip(indexes, 0, num_bins - 1)
+
+    @property
+    def std_dev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0
+
+    def quantile(self, q: float) -> float:
+        return self.digest.quantile(q, self.min_value, self.max_value)
+
+    def statistics(self) -> Dict[str, float]:
+        """Summary statistics in the format reported by the simulation."""
+        if self.count == 0:
+            return {key: 0 for key in ('mean', 'median', 'std_dev', 'min_cost', 'max_cost',
+                                        'p10', 'p25', 'p75', 'p90', 'p95')}
+        return {
+            'mean': self.mean,
+            'median': self.quantile(0.50),
+            'std_dev': self.std_dev,
+            'min_cost': self.min_value,
+            'max_cost': self.max_value,
+            'p10': self.quantile(0.10),
+            'p25': self.quantile(0.25),
+            'p75': self.quantile(0.75),
+            'p90': self.quantile(0.90),
+            'p95': self.quantile(0.95),
+        }
+
+    def cdf(self, num_points: int = 101) -> Dict[str, List]:
+        """
+        Down-sampled cumulative distribution: the estimated cost at num_points
+        evenly spaced cumulative probabilities from 0 to 1.
+        """
+        if self.count == 0:
+            return {'values': [], 'probabilities': []}
+        probabilities = np.linspace(0, 1, num_points)
+        return {
+            'values': [self.quantile(q) for q in probabilities],
+            'probabilities': [round(float(q), 6) for q in probabilities],
+        }
+
+    def histogram(self, num_bins: int = 20) -> Dict[str, List]:
+        """
+        Chart histogram between the observed minimum and maximum.
+
+        Has the same format as create_histogram_data. Each fixed bin's count is
+        assigned to the chart bin containing the fixed bin's centre, clamped to
+        the observed range.
+        """
+        if self.count == 0:
+            return {'bins': [], 'frequencies': []}
+        if self.min_value == self.max_value:
+            return {'bins': [self.min_value], 'frequencies': [int(self.count)]}
+
+        fine_width = (self.upper - self.lower) / self.bin_counts.size
+        centres = self.lower + (np.arange(self.bin_counts.size) + 0.5) * fine_width
+        centres = np.clip(centres, self.min_value, self.max_value)
+
+        bin_width = (self.max_value - self.min_value) / num_bins
+        indexes = np.minimum(((centres - self.min_value) / bin_width).astype(np.int64), num_bins - 1)
+        frequencies = np.bincount(indexes, weights=self.bin_counts, minlength=num_bins)
+
+        bin_labels = [
+            round(self.min_value + (i + 0.5) * bin_width, 2)
+            for i in range(num_bins)
+        ]
+        return {
+            'bins': bin_labels,
+            'frequencies': [int(f) for f in frequencies],
+        }
+
+
+def keep_top_rows(top_totals: np.ndarray, top_rows: np.ndarray, totals: np.ndarray, rows: np.ndarray,
+                  size: int) -> tuple:
+    """
+    Keep the rows with the highest totals seen so far.
+
+    Args:
+        top_totals: Totals of the rows kept so far
+        top_rows: Rows kept so far, one per total
+        totals: Totals of a new batch of rows
+        rows: The new rows, one per total
+        size: Maximum number of rows to keep
+
+    Returns:
+        (top_totals, top_rows) for the at most `size` highest totals of both,
+        in no particular order
+    """
+    if top_totals.size >= size:
+        # Once full, only rows above the lowest kept total can enter
+        entering = totals > top_totals.min()
+        if not entering.any():
+            return top_totals, top_rows
+        totals, rows = totals[entering], rows[entering]
+    totals = np.concatenate([top_totals, totals])
+    rows = np.concatenate([top_rows, rows])
+    if totals.size > size:
+        keep = np.argpartition(totals, totals.size - size)[-size:]
+        totals, rows = totals[keep], rows[keep]
+    return totals, rows
@@ -1,11 +1,43 @@
+import asyncio
+import io
+import json
+import math
+import os
+import tempfile
 import unittest
-from django.test import TestCase, Client
+from datetime import timedelta
+from decimal import Decimal
+from statistics import NormalDist
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from google.api_core import exceptions as google_exceptions
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from risks.models import Project, Risk, Category
-from risks.forms import ProjectForm, RiskForm, CategoryForm
+from risks.models import (Project, Risk, Category, SimulationRun, BackgroundJob,
+                          ProjectRiskSummary, RiskHistory, AIResponse, AIBackfillRun, CorrelationGroup)
+from risks.forms import ProjectForm, RiskForm, RiskEditForm, CategoryForm
+from risks.jobs import claim_next_job, enqueue_job, requeue_stale_jobs, run_job
+from risks.distributions import triangular_inverse_cdf
+from risks.monte_carlo import (create_histogram_data, run_monte_carlo_simulation,
+                               run_reference_simulation, simulate_project_totals, normal_cdf)
+from risks import (ai_batch, ai_cache, ai_client, ai_features, distributions, prompt_budget, search, similarity,
+                   what_if)
+from risks.pagination import encode_cursor
+from risks.portfolio import PortfolioAccumulator, run_portfolio_simulation
+from risks.sensitivity import run_sensitivity_analysis
+from risks.simulation_cache import run_cached_simulation
+from risks.streaming_stats import SimulationAccumulator, TDigest, keep_top_rows
 
 
 class ModelTests(TestCase):
@@ -170,7 +202,43 @@ class FormTests(TestCase):
         form = RiskForm(data=form_data)
         self.assertFalse(form.is_valid())
         self.assertIn('likelihood', form.errors)
-
+    
+    def test_risk_form_sets_distribution_and_correlation_group(self):
+        """Only the correlation groups of the risk's project can be chosen"""
+        group = CorrelationGroup.objects.create(project=self.project, name="Supplier")
+        other_project = Project.objects.create(name="Other Project")
+        other_group = CorrelationGroup.objects.create(project=other_project, name="Supplier")
+        form_data = {
+            'title': 'New Risk',
+            'category': self.category.id,
+            'likelihood': 2,
+            'impact': 2,
+            'status': 'Open',
+            'likelihood_percentage': 30,
+            'optimistic_cost_impact': 100,
+            'most_likely_cost_impact': 200,
+            'pessimistic_cost_impact': 500,
+            'cost_distribution': 'pert',
+            'correlation_group': group.id,
+        }
+        form = RiskForm(data=form_data, project=self.project)
+        self.assertEqual(list(form.fields['correlation_group'].queryset), [group])
+        self.assertTrue(form.is_valid(), form.errors)
+        risk = form.save()
+        self.assertEqual((risk.project, risk.cost_distribution, risk.correlation_group), (self.project, 'pert', group))
+        
+        form = RiskEditForm(data={**form_data, 'correlation_group': other_group.id}, instance=risk)
+        self.assertFalse(form.is_valid())
+        self.assertIn('correlation_group', form.errors)
+        
+        User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        for url in (reverse('add_risk', args=[self.project.id]), reverse('edit_risk', args=[risk.id])):
+            content = self.client.get(url).content.decode()
+            self.assertIn('name="cost_distribution"', content)
+            self.assertIn(str(group), content)
+            self.assertNotIn(str(other_group), content)
+        
 
 class ViewTests(TestCase):
     """Tests for the views"""
@@ -722,13 +790,24 @@ class CSVExportTests(TestCase):
         self.assertEqual(response['Content-Type'], 'text/csv')
         
         # Convert the response content to string
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         
         # Check that the headers are present
         self.assertIn('Project,Risk Title,Description,Category,Likelihood,Impact,Risk Score,Risk Level,Owner,Status', content)
         
         # Check that the risk data is present
         self.assertIn('Test Project,Test Risk,A risk created for testing,Test Category,Medium,High,6,High,Test Owner,Open', content)
+    
+    def test_csv_export_streams_with_constant_queries(self):
+        """The export is streamed and does not query once per row for related objects"""
+        for i in range(5):
+            Risk.objects.create(project=self.project, title=f"Streamed Risk {i}", category=self.category)
+        response = self.client.get(reverse('export_risks_csv'))
+        self.assertTrue(response.streaming)
+        
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(content.strip().splitlines()), 7)
 
 
 class PermissionAndSecurityTests(TestCase):
@@ -1280,7 +1359,7 @@ class IntegrationTests(TestCase):
         self.assertEqual(response['Content-Type'], 'text/csv')
         
         # Convert the response content to string
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         
         # Check that all risks are included
         for i in range(1, 4):
@@ -1293,5 +1372,2086 @@ class IntegrationTests(TestCase):
         self.assertIn("Mitigated", content)
 
 
+class MonteCarloEngineTests(TestCase):
+    """Tests for the vectorized Monte Carlo engine against the reference loop"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(
+            name="Simulation Project",
+            description="A project for Monte Carlo testing"
+        )
+    
+    def add_risk(self, title, likelihood_percentage, optimistic, most_likely, pessimistic, status='Open'):
+        return Risk.objects.create(
+            project=self.project,
+            title=title,
+            likelihood_percentage=likelihood_percentage,
+            optimistic_cost_impact=optimistic,
+            most_likely_cost_impact=most_likely,
+            pessimistic_cost_impact=pessimistic,
+            status=status
+        )
+    
+    def test_deterministic_risks_match_reference_exactly(self):
+        """Certain risks with fixed costs give identical results in both engines"""
+        self.add_risk("Certain A", 100, 1000, 1000, 1000)
+        self.add_risk("Certain B", 100, 250, 250, 250)
+        self.add_risk("Closed", 100, 9000, 9000, 9000, status='Closed')
+        
+        vectorized = run_monte_carlo_simulation(self.project.risks, 500, keep_samples=True)
+        reference = run_reference_simulation(self.project.risks, 500)
+        
+        self.assertEqual(vectorized['num_active_risks'], 2)
+        self.assertEqual(vectorized['statistics'], reference['statistics'])
+        self.assertEqual(vectorized['histogram_data'], reference['histogram_data'])
+        self.assertEqual(vectorized['results'], reference['results'])
+    
+    def test_statistics_agree_with_reference(self):
+        """Random risks give statistically equivalent results in both engines"""
+        self.add_risk("Server failure", 40, 1000, 5000, 20000)
+        self.add_risk("Vendor delay", 70, 500, 800, 3000)
+        self.add_risk("Data breach", 10, 10000, 50000, 100000)
+        
+        vectorized = run_monte_carlo_simulation(self.project.risks, 20000)['statistics']
+        reference = run_reference_simulation(self.project.risks, 20000)['statistics']
+        
+        # Expected mean: 0.4*8666.67 + 0.7*1433.33 + 0.1*53333.33
+        expected_mean = 0.4 * 26000 / 3 + 0.7 * 4300 / 3 + 0.1 * 160000 / 3
+        self.assertAlmostEqual(vectorized['mean'], expected_mean, delta=expected_mean * 0.05)
+        self.assertAlmostEqual(vectorized['mean'], reference['mean'], delta=expected_mean * 0.05)
+        self.assertAlmostEqual(vectorized['p95'], reference['p95'], delta=reference['p95'] * 0.1)
+    
+    def test_triangular_inverse_cdf_bounds(self):
+        """Vectorized triangular samples stay inside each risk's cost range"""
+        u = np.linspace(0, 0.999999, 1001)[:, None]
+        optimistic = np.array([0.0, 100.0, 50.0])
+        most_likely = np.array([10.0, 100.0, 50.0])
+        pessimistic = np.array([20.0, 300.0, 50.0])
+        
+        samples = triangular_inverse_cdf(u, optimistic, most_likely, pessimistic)
+        
+        self.assertEqual(samples.shape, (1001, 3))
+        self.assertTrue(np.all(samples >= optimistic))
+        self.assertTrue(np.all(samples <= pessimistic))
+        self.assertTrue(np.all(samples[:, 2] == 50.0))
+    
+    def test_unordered_costs_fall_back_to_most_likely(self):
+        """A risk with an invalid cost triple contributes its most likely cost"""
+        self.add_risk("Bad estimate", 100, 5000, 1000, 2000)
+        
+        results = run_monte_carlo_simulation(self.project.risks, 200)
+        
+        self.assertEqual(results['statistics']['min_cost'], 1000)
+        self.assertEqual(results['statistics']['max_cost'], 1000)
+    
+    def test_chunked_sampling(self):
+        """Sampling in small blocks still fills every iteration"""
+        self.add_risk("Certain", 100, 10, 10, 10)
+        self.add_risk("Never", 0, 10, 20, 30)
+        
+        with patch('risks.monte_carlo.STREAM_BLOCK_SIZE', 3):
+            results = run_monte_carlo_simulation(self.project.risks, 1001, keep_samples=True)
+        
+        self.assertEqual(len(results['results']), 1001)
+        self.assertTrue(all(total == 10 for total in results['results']))
+    
+    def test_histogram_matches_python_binning(self):
+        """Histogram frequencies follow the original binning rule"""
+        histogram = create_histogram_data([0, 1, 2, 3, 4, 5, 6, 7, 8, 10], num_bins=5)
+        
+        self.assertEqual(histogram['bins'], [1.0, 3.0, 5.0, 7.0, 9.0])
+        self.assertEqual(histogram['frequencies'], [2, 2, 2, 2, 2])
+
+
+class SeededSimulationTests(TestCase):
+    """Tests for reproducible and parallel Monte Carlo runs"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(
+            name="Seeded Project",
+            description="A project for seeded simulation testing"
+        )
+        for i, (likelihood, costs) in enumerate([(30, (100, 400, 900)), (60, (50, 60, 300)), (5, (1000, 5000, 9000))]):
+            Risk.objects.create(
+                project=self.project,
+                title=f"Seeded Risk {i}",
+                likelihood_percentage=likelihood,
+                optimistic_cost_impact=costs[0],
+                most_likely_cost_impact=costs[1],
+                pessimistic_cost_impact=costs[2],
+                status='Open'
+            )
+        self.user = User.objects.create_user(username='seeduser', password='seedpassword')
+    
+    def test_same_seed_reproduces_results(self):
+        """Two runs with the same seed are identical"""
+        first = run_monte_carlo_simulation(self.project.risks, 3000, seed=42, keep_samples=True)
+        second = run_monte_carlo_simulation(self.project.risks, 3000, seed=42)
+        other = run_monte_carlo_simulation(self.project.risks, 3000, seed=43, keep_samples=True)
+        
+        self.assertEqual(first['seed'], 42)
+        self.assertEqual(first['statistics'], second['statistics'])
+        self.assertNotEqual(first['results'], other['results'])
+    
+    def test_parallel_run_matches_serial_run(self):
+        """Splitting the blocks across a process pool changes neither the totals nor the statistics"""
+        with patch('risks.monte_carlo.STREAM_BLOCK_SIZE', 500):
+            serial = run_monte_carlo_simulation(self.project.risks, 2600, seed=7, keep_samples=True)
+            parallel = run_monte_carlo_simulation(self.project.risks, 2600, seed=7, workers=2, keep_samples=True)
+            merged = [run_monte_carlo_simulation(self.project.risks, 2600, seed=7, workers=workers)
+                      for workers in (1, 2, 3)]
+        
+        self.assertEqual(serial['results'], parallel['results'])
+        self.assertEqual(serial['statistics'], parallel['statistics'])
+        for run in merged:
+            # Percentiles included: every block has its own digest, merged in block order
+            self.assertEqual(run['statistics'], serial['statistics'])
+            self.assertEqual(run['histogram_data'], serial['histogram_data'])
+    
+    def test_view_accepts_seed(self):
+        """The simulation view passes the seed through and rejects invalid ones"""
+        self.client.login(username='seeduser', password='seedpassword')
+        url = reverse('monte_carlo_simulation', args=[self.project.id])
+        
+        first = self.client.post(url, {'num_simulations': 1000, 'seed': 99}).json()
+        second = self.client.post(url, {'num_simulations': 1000, 'seed': 99}).json()
+        self.assertEqual(first['results']['seed'], 99)
+        self.assertEqual(first['results']['statistics'], second['results']['statistics'])
+        
+        response = self.client.post(url, {'num_simulations': 1000, 'seed': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamingStatisticsTests(TestCase):
+    """Tests for the one-pass simulation accumulator and quantile sketch"""
+    
+    def setUp(self):
+        self.values = np.random.default_rng(1).lognormal(mean=8, sigma=1, size=50000)
+    
+    def test_moments_match_numpy(self):
+        """Batched Welford updates give the exact mean and standard deviation"""
+        accumulator = SimulationAccumulator(0, self.values.max())
+        for batch in np.array_split(self.values, 13):
+            accumulator.update(batch)
+        
+        stats = accumulator.statistics()
+        self.assertAlmostEqual(stats['mean'], self.values.mean(), places=6)
+        self.assertAlmostEqual(stats['std_dev'], self.values.std(ddof=1), places=4)
+        self.assertEqual(stats['min_cost'], self.values.min())
+        self.assertEqual(stats['max_cost'], self.values.max())
+        self.assertEqual(sum(accumulator.histogram()['frequencies']), len(self.values))
+    
+    def test_quantile_sketch_accuracy(self):
+        """t-digest percentiles stay close to the exact percentiles"""
+        digest = TDigest()
+        for batch in np.array_split(self.values, 7):
+            digest.update(batch)
+        
+        self.assertLessEqual(len(digest.means), 2 * digest.compression)
+        for q in (0.10, 0.25, 0.50, 0.75, 0.90, 0.95):
+            exact = np.quantile(self.values, q)
+            self.assertAlmostEqual(digest.quantile(q), exact, delta=exact * 0.01)
+    
+    def test_merged_accumulators_match_single_accumulator(self):
+        """Accumulators from separate chunks combine into the same statistics"""
+        single = SimulationAccumulator(0, self.values.max())
+        single.update(self.values)
+        
+        left = SimulationAccumulator(0, self.values.max())
+        right = SimulationAccumulator(0, self.values.max())
+        left.update(self.values[:20000])
+        right.update(self.values[20000:])
+        merged = left.merge(right)
+        
+        self.assertEqual(merged.count, single.count)
+        self.assertAlmostEqual(merged.mean, single.mean, places=6)
+        self.assertAlmostEqual(merged.std_dev, single.std_dev, places=4)
+        self.assertEqual(merged.histogram(), single.histogram())
+        self.assertAlmostEqual(merged.quantile(0.95), single.quantile(0.95), delta=single.quantile(0.95) * 0.01)
+    
+    def test_keep_top_rows(self):
+        """Rows kept batch by batch are the rows of the highest totals overall"""
+        rows = np.column_stack([self.values, -self.values])
+        top_totals, top_rows = np.zeros(0), np.zeros((0, 2))
+        for batch in np.array_split(np.arange(len(self.values)), 9):
+            top_totals, top_rows = keep_top_rows(top_totals, top_rows, self.values[batch], rows[batch], 100)
+        
+        self.assertEqual(sorted(top_totals), sorted(np.sort(self.values)[-100:]))
+        np.testing.assert_array_equal(top_rows, np.column_stack([top_totals, -top_totals]))
+        
+        # A batch below the lowest kept total leaves the rows as they are
+        kept = keep_top_rows(top_totals, top_rows, np.zeros(3), np.zeros((3, 2)), 100)
+        self.assertIs(kept[0], top_totals)
+        self.assertIs(kept[1], top_rows)
+
+
+class SimulationResponseTests(TestCase):
+    """Tests for the compact simulation response and the sample download"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Response Project")
+        Risk.objects.create(
+            project=self.project,
+            title="Response Risk",
+            likelihood_percentage=50,
+            optimistic_cost_impact=100,
+            most_likely_cost_impact=200,
+            pessimistic_cost_impact=400,
+            status='Open'
+        )
+        User.objects.create_user(username='mcuser', password='mcpassword')
+        self.client.login(username='mcuser', password='mcpassword')
+        self.url = reverse('monte_carlo_simulation', args=[self.project.id])
+    
+    def test_response_has_no_raw_results(self):
+        """Only statistics and histogram are returned unless a CDF is requested"""
+        data = self.client.post(self.url, {'num_simulations': 5000, 'seed': 3}).json()
+        
+        self.assertNotIn('results', data['results'])
+        self.assertNotIn('cdf', data['results'])
+        self.assertIn('statistics', data['results'])
+        self.assertIn('histogram_data', data['results'])
+        
+        data = self.client.post(self.url, {'num_simulations': 5000, 'seed': 3, 'include_cdf': '1'}).json()
+        cdf = data['results']['cdf']
+        self.assertEqual(len(cdf['values']), 101)
+        self.assertEqual(cdf['values'], sorted(cdf['values']))
+    
+    def test_sample_download_reproduces_run(self):
+        """The .npy download contains the seeded run's iteration totals"""
+        data = self.client.post(self.url, {'num_simulations': 2000, 'seed': 11}).json()
+        
+        response = self.client.get(data['samples_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        
+        samples = np.load(io.BytesIO(response.content))
+        self.assertEqual(samples.dtype, np.float32)
+        self.assertEqual(len(samples), 2000)
+        self.assertAlmostEqual(float(samples.mean()), data['results']['statistics']['mean'], delta=0.01)
+        self.assertEqual(float(samples.max()), np.float32(data['results']['statistics']['max_cost']))
+    
+    def test_rejects_seeds_too_large_to_store(self):
+        """Seeds beyond the 64-bit seed column are a 400, not a failed save"""
+        response = self.client.post(self.url, {'num_simulations': 1000, 'seed': 2 ** 63})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        response = self.client.post(self.url, {'num_simulations': 1000, 'seed': 99999999999999999999999})
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.client.post(self.url, {'num_simulations': 1000, 'seed': 2 ** 63 - 1})
+        self.assertEqual(response.json()['results']['seed'], 2 ** 63 - 1)
+        self.assertTrue(SimulationRun.objects.filter(seed=2 ** 63 - 1).exists())
+    
+    def test_sample_download_requires_seed(self):
+        """Samples can only be downloaded for a seeded, reproducible run"""
+        response = self.client.get(reverse('monte_carlo_samples', args=[self.project.id]))
+        self.assertEqual(response.status_code, 400)
+    
+    def test_large_runs_are_queued(self):
+        """Runs above the background threshold go to the job queue, samples included"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(MONTE_CARLO_BACKGROUND_THRESHOLD=2000, MONTE_CARLO_WHAT_IF_DIR=directory.name):
+            inline = self.client.post(self.url, {'num_simulations': 1000, 'seed': 11}).json()
+            self.assertTrue(inline['success'])
+            
+            response = self.client.post(self.url, {'num_simulations': 2000, 'seed': 11})
+            self.assertEqual(response.status_code, 202)
+            job = run_job(claim_next_job())
+            self.assertEqual(job.result['results']['num_simulations'], 2000)
+            
+            samples_url = job.result['samples_url']
+            response = self.client.get(samples_url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(BackgroundJob.objects.get(id=response.json()['job_id']).kind, 'monte_carlo_samples')
+            job = run_job(claim_next_job())
+            self.assertEqual(job.result['samples_url'], samples_url)
+            
+            # The worker stored the totals, so the download is served inside the request
+            response = self.client.get(samples_url)
+            self.assertEqual(response.status_code, 200)
+            samples = np.load(io.BytesIO(response.content))
+            expected = simulate_project_totals(self.project.risks, 2000, 11).astype(np.float32)
+            np.testing.assert_array_equal(samples, expected)
+            self.assertIsNone(claim_next_job())
+
+
+class SimulationCacheTests(TestCase):
+    """Tests for stored simulation runs and their invalidation"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Cached Project")
+        self.risk = Risk.objects.create(
+            project=self.project,
+            title="Cached Risk",
+            likelihood_percentage=40,
+            optimistic_cost_impact=100,
+            most_likely_cost_impact=300,
+            pessimistic_cost_impact=900,
+            status='Open'
+        )
+    
+    def test_repeat_request_is_served_from_cache(self):
+        """Identical inputs reuse the stored run, with or without a seed"""
+        first, cached = run_cached_simulation(self.project, 1000, seed=5)
+        self.assertFalse(cached)
+        second, cached = run_cached_simulation(self.project, 1000, seed=5)
+        self.assertTrue(cached)
+        self.assertEqual(first, second)
+        
+        unseeded, cached = run_cached_simulation(self.project, 1000)
+        self.assertFalse(cached)
+        repeat, cached = run_cached_simulation(self.project, 1000)
+        self.assertTrue(cached)
+        self.assertEqual(unseeded['seed'], repeat['seed'])
+        
+        _, cached = run_cached_simulation(self.project, 2000, seed=5)
+        self.assertFalse(cached)
+    
+    def test_risk_update_invalidates_cache(self):
+        """Saving a risk moves updated_at and forces a fresh run"""
+        run_cached_simulation(self.project, 1000, seed=5)
+        
+        self.risk.owner = "New Owner"
+        self.risk.save()
+        _, cached = run_cached_simulation(self.project, 1000, seed=5)
+        self.assertFalse(cached)
+        
+        self.risk.most_likely_cost_impact = 500
+        self.risk.save()
+        result, cached = run_cached_simulation(self.project, 1000, seed=5)
+        self.assertFalse(cached)
+        self.assertEqual(SimulationRun.objects.filter(project=self.project).count(), 3)
+    
+    def test_old_runs_are_pruned(self):
+        """Only the configured number of runs is kept per project"""
+        with self.settings(MONTE_CARLO_CACHED_RUNS_PER_PROJECT=2):
+            for seed in range(4):
+                run_cached_simulation(self.project, 500, seed=seed)
+        
+        self.assertEqual(SimulationRun.objects.filter(project=self.project).count(), 2)
+
+
+class BackgroundJobTests(TestCase):
+    """Tests for the background job queue and its polling endpoints"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Queued Project")
+        Risk.objects.create(
+            project=self.project,
+            title="Queued Risk",
+            likelihood_percentage=50,
+            optimistic_cost_impact=100,
+            most_likely_cost_impact=200,
+            pessimistic_cost_impact=400,
+            status='Open'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+    
+    def test_simulation_is_queued_and_run_by_worker(self):
+        """A background request returns 202 and the worker stores the same payload"""
+        url = reverse('monte_carlo_simulation', args=[self.project.id]) + '?background=1'
+        response = self.client.post(url, {'num_simulations': 1000, 'seed': 3})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        
+        result = self.client.get(data['result_url'])
+        self.assertEqual(result.status_code, 202)
+        
+        call_command('run_background_jobs', '--once', stdout=io.StringIO())
+        
+        job = BackgroundJob.objects.get(id=data['job_id'])
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.attempts, 1)
+        status = self.client.get(data['status_url']).json()
+        self.assertEqual(status['status'], 'succeeded')
+        
+        result = self.client.get(data['result_url'])
+        self.assertEqual(result.status_code, 200)
+        inline = self.client.post(reverse('monte_carlo_simulation', args=[self.project.id]),
+                                  {'num_simulations': 1000, 'seed': 3}).json()
+        self.assertEqual(result.json()['results']['statistics'], inline['results']['statistics'])
+    
+    def test_failed_job_records_error(self):
+        """Exceptions in a handler mark the job failed instead of stopping the worker"""
+        job = enqueue_job('monte_carlo', {'project_id': 999999, 'num_simulations': 100}, self.user)
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('DoesNotExist', job.error)
+        
+        response = self.client.get(reverse('job_result', args=[job.id]))
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(claim_next_job())
+    
+    def test_outcome_of_a_requeued_job_is_discarded(self):
+        """A worker finishing a job that was taken back does not overwrite the newer state"""
+        enqueue_job('monte_carlo', {'project_id': self.project.id, 'num_simulations': 100}, self.user)
+        stalled = claim_next_job()
+        BackgroundJob.objects.filter(id=stalled.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(300, 3), (1, 0))
+        reclaimed = claim_next_job()
+        
+        with self.assertLogs('risks.jobs', 'WARNING'):
+            stalled = run_job(stalled)
+        self.assertEqual(stalled.status, 'running')
+        self.assertEqual(stalled.attempts, 2)
+        self.assertIsNone(stalled.result)
+        self.assertEqual(run_job(reclaimed).status, 'succeeded')
+    
+    def test_abandoned_jobs_are_requeued_until_out_of_attempts(self):
+        """Only jobs whose heartbeat stopped are taken back, and only max_attempts times"""
+        live = enqueue_job('monte_carlo', {'project_id': self.project.id, 'num_simulations': 100}, self.user)
+        dead = enqueue_job('monte_carlo', {'project_id': self.project.id, 'num_simulations': 100}, self.user)
+        claim_next_job()
+        claim_next_job()
+        long_ago = timezone.now() - timedelta(hours=2)
+        # Both started long ago, but only the live one is still beating
+        BackgroundJob.objects.update(started_at=long_ago)
+        BackgroundJob.objects.filter(id=dead.id).update(heartbeat_at=long_ago)
+        
+        self.assertEqual(requeue_stale_jobs(300, 2), (1, 0))
+        live.refresh_from_db()
+        dead.refresh_from_db()
+        self.assertEqual(live.status, 'running')
+        self.assertEqual(dead.status, 'queued')
+        
+        self.assertEqual(claim_next_job().id, dead.id)
+        BackgroundJob.objects.filter(id=dead.id).update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(300, 2), (0, 1))
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, 'failed')
+        self.assertEqual(dead.attempts, 2)
+        self.assertIn('Abandoned', dead.error)
+        self.assertIsNone(claim_next_job())
+    
+    @patch('risks.ai_views.analyze_risk_trend', return_value={'trends': []})
+    def test_ai_analysis_can_run_in_background(self, mock_analysis):
+        """AI project analyses are queued and not called inside the request"""
+        url = reverse('analyze_risk_trends', args=[self.project.id]) + '?background=1'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        mock_analysis.assert_not_called()
+        
+        run_job(claim_next_job())
+        result = self.client.get(response.json()['result_url']).json()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['analysis'], {'trends': []})
+    
+    def test_jobs_are_private_to_their_creator(self):
+        """Other users cannot poll someone else's job"""
+        job = enqueue_job('monte_carlo', {'project_id': self.project.id, 'num_simulations': 100}, self.user)
+        User.objects.create_user(username='other', password='otherpassword')
+        self.client.login(username='other', password='otherpassword')
+        response = self.client.get(reverse('job_status', args=[job.id]))
+        self.assertEqual(response.status_code, 403)
+    
+    def test_submit_rejects_unknown_kind(self):
+        response = self.client.post(reverse('submit_job'), '{"kind": "nope"}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_submit_applies_simulation_limits(self):
+        """Submitted params go through the same parsing and limits as the views"""
+        def submit(kind, params):
+            return self.client.post(reverse('submit_job'), json.dumps({'kind': kind, 'params': params}),
+                                    content_type='application/json')
+        
+        response = submit('monte_carlo', {'project_id': self.project.id, 'num_simulations': 10 ** 9, 'seed': 3})
+        self.assertEqual(response.status_code, 202)
+        job = BackgroundJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual(job.params['num_simulations'], settings.MONTE_CARLO_MAX_SIMULATIONS)
+        self.assertEqual(job.params['workers'], settings.MONTE_CARLO_WORKERS)
+        
+        for kind, params in (
+            ('monte_carlo', {'project_id': self.project.id, 'workers': 64}),
+            ('monte_carlo', {'project_id': self.project.id, 'num_simulations': 'lots'}),
+            ('monte_carlo', {'project_id': self.project.id, 'seed': -1}),
+            ('monte_carlo', {'project_id': 999999}),
+            ('portfolio_monte_carlo', {'project_id': self.project.id}),
+            ('analyze_risk_trends', {'project_id': str(self.project.id)}),
+            ('generate_mitigation_timeline', {'project_id': self.project.id, 'constraints': []}),
+        ):
+            self.assertEqual(submit(kind, params).status_code, 400, (kind, params))
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+
+
+class DashboardAggregateTests(TestCase):
+    """Tests for the aggregate queries behind the dashboard"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.category, _ = Category.objects.get_or_create(name="Technical")
+        self.add_project("Project 0")
+    
+    def add_project(self, name):
+        project = Project.objects.create(name=name)
+        for likelihood, impact, status in [(3, 3, 'Open'), (2, 2, 'Open'), (1, 2, 'Open'), (3, 1, 'Closed')]:
+            Risk.objects.create(
+                project=project,
+                category=self.category,
+                title=f"{name} {likelihood}x{impact}",
+                likelihood=likelihood,
+                impact=impact,
+                status=status
+            )
+        return project
+    
+    def get_dashboard(self):
+        # Render a fresh response so queries for every context value are made
+        return self.client.get(reverse('dashboard'))
+    
+    def test_counts_match_python_properties(self):
+        """Aggregates agree with the risk_level property and the matrix cells"""
+        empty = Project.objects.create(name="Empty Project")
+        response = self.get_dashboard()
+        risks = list(Risk.objects.all())
+        open_risks = [risk for risk in risks if risk.status == 'Open']
+        
+        self.assertEqual(response.context['high_risks'], sum(r.risk_level == 'High' for r in open_risks))
+        self.assertEqual(response.context['medium_risks'], sum(r.risk_level == 'Medium' for r in open_risks))
+        self.assertEqual(response.context['low_risks'], sum(r.risk_level == 'Low' for r in open_risks))
+        self.assertEqual(response.context['risks_by_category'], {'Technical': 3})
+        
+        cells = {(cell['x'], cell['y']): cell['count'] for cell in response.context['risk_matrix_data']}
+        self.assertEqual(cells[(2, 2)], 1)
+        self.assertEqual(cells[(2, 0)], 0)  # Closed risks are not on the matrix
+        
+        project_rows = {row['project'].id: row for row in response.context['projects_with_risk_data']}
+        self.assertEqual(project_rows[empty.id]['total_risks'], 0)
+        first = Project.objects.get(name="Project 0")
+        self.assertEqual(project_rows[first.id]['total_risks'], 4)
+        self.assertEqual(project_rows[first.id]['open_risks'], 3)
+        self.assertEqual(project_rows[first.id]['high_risks'], 1)
+        self.assertEqual(project_rows[first.id]['medium_risks'], 2)
+    
+    def test_query_count_does_not_grow_with_projects(self):
+        """Adding projects and risks does not add dashboard queries"""
+        self.get_dashboard()
+        with CaptureQueriesContext(connection) as baseline:
+            self.get_dashboard()
+        
+        for index in range(1, 6):
+            self.add_project(f"Project {index}")
+        with self.assertNumQueries(len(baseline.captured_queries)):
+            self.get_dashboard()
+
+
+class StoredRiskScoreTests(TestCase):
+    """Tests for the database-generated score and level columns"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Scored Project")
+        self.risk = Risk.objects.create(project=self.project, title="Scored Risk", likelihood=2, impact=3)
+    
+    def test_columns_match_properties(self):
+        """Every likelihood/impact pair gets the same score and level as the properties"""
+        for likelihood in range(1, 4):
+            for impact in range(1, 4):
+                self.risk.likelihood = likelihood
+                self.risk.impact = impact
+                self.risk.save()
+                self.risk.refresh_from_db()
+                self.assertEqual(self.risk.score, self.risk.risk_score)
+                self.assertEqual(self.risk.level, self.risk.risk_level)
+    
+    def test_columns_follow_bulk_update(self):
+        """Queryset updates recompute the stored columns in SQL"""
+        Risk.objects.filter(project=self.project).update(likelihood=1, impact=1)
+        self.assertEqual(Risk.objects.filter(level='Low').count(), 1)
+        self.assertEqual(Risk.objects.filter(level='High').count(), 0)
+        self.assertEqual(Risk.objects.get(id=self.risk.id).score, 1)
+
+
+class ProjectRiskSummaryTests(TestCase):
+    """Tests for the incrementally maintained per-project risk summaries"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Summary Project")
+        self.category, _ = Category.objects.get_or_create(name="Technical")
+    
+    def add_risk(self, **fields):
+        defaults = {
+            'project': self.project,
+            'category': self.category,
+            'title': "Summary Risk",
+            'likelihood': 2,
+            'impact': 2,
+            'most_likely_cost_impact': 100,
+        }
+        defaults.update(fields)
+        return Risk.objects.create(**defaults)
+    
+    def recounted(self):
+        """Summary rows as (key, count, cost) tuples after summing duplicates"""
+        rows = (ProjectRiskSummary.objects
+                .values('project', 'category', 'status', 'likelihood', 'impact')
+                .annotate(count=Sum('risk_count'), cost=Sum('total_cost'))
+                .filter(count__gt=0)
+                .order_by('project', 'category', 'status', 'likelihood', 'impact'))
+        return [tuple(row.values()) for row in rows]
+    
+    def assertMatchesRebuild(self):
+        incremental = self.recounted()
+        ProjectRiskSummary.rebuild()
+        self.assertEqual(incremental, self.recounted())
+    
+    def test_save_and_delete_apply_deltas(self):
+        """Creating, editing and deleting risks keeps the summaries exact"""
+        first = self.add_risk()
+        second = self.add_risk(likelihood=3, impact=3, most_likely_cost_impact=250)
+        self.assertMatchesRebuild()
+        
+        first = Risk.objects.get(id=first.id)
+        first.status = 'Mitigated'
+        first.most_likely_cost_impact = 400
+        first.save()
+        self.assertMatchesRebuild()
+        
+        second.category = None
+        second.save()
+        self.assertMatchesRebuild()
+        
+        Risk.objects.get(id=second.id).delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(ProjectRiskSummary.objects.filter(risk_count=0).count(), 0)
+    
+    def test_deferred_fields_fall_back_to_rebuild(self):
+        """Saving a risk loaded with only() still leaves correct summaries"""
+        risk = self.add_risk()
+        partial = Risk.objects.only('id', 'title', 'project').get(id=risk.id)
+        partial.impact = 3
+        partial.save()
+        self.assertMatchesRebuild()
+    
+    def test_category_delete_moves_risks_to_uncategorized(self):
+        category = Category.objects.create(name="Temporary")
+        self.add_risk(category=category)
+        category.delete()
+        self.assertEqual(self.recounted(), [(self.project.id, None, 'Open', 2, 2, 1, Decimal('100'))])
+    
+    def test_rebuild_command_repairs_bulk_updates(self):
+        """Queryset updates bypass the signals until the command is run"""
+        self.add_risk()
+        Risk.objects.update(status='Closed')
+        call_command('rebuild_risk_summaries', stdout=io.StringIO())
+        summary = ProjectRiskSummary.objects.get()
+        self.assertEqual((summary.status, summary.risk_count, summary.level), ('Closed', 1, 'Medium'))
+
+
+class RiskRegisterApiTests(TestCase):
+    """Tests for the filtered, keyset-paginated register API"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Register Project")
+        self.other_project = Project.objects.create(name="Other Project")
+        self.category, _ = Category.objects.get_or_create(name="Technical")
+        for i in range(25):
+            Risk.objects.create(
+                project=self.project if i % 2 else self.other_project,
+                category=self.category if i % 3 else None,
+                title=f"Register Risk {i:02d}",
+                likelihood=i % 3 + 1,
+                impact=(i // 3) % 3 + 1,
+                owner="Alice" if i == 7 else "Bob",
+                status='Closed' if i % 5 == 0 else 'Open'
+            )
+    
+    def fetch_all(self, **params):
+        """Follow next_cursor through every page and return the risk ids"""
+        ids = []
+        response = self.client.get(reverse('risk_register_api'), {'page_size': 4, **params}).json()
+        count = response['count']
+        while True:
+            ids.extend(row['id'] for row in response['results'])
+            if not response['next_cursor']:
+                break
+            response = self.client.get(
+                reverse('risk_register_api'), {'page_size': 4, 'cursor': response['next_cursor'], **params}
+            ).json()
+            self.assertNotIn('count', response)  # Only counted on the first page
+        self.assertEqual(count, len(ids))
+        return ids
+    
+    def test_pages_follow_register_order(self):
+        """Walking the cursors returns every risk once, in register order"""
+        expected = list(Risk.objects.order_by('-likelihood', '-impact', 'title', 'id').values_list('id', flat=True))
+        self.assertEqual(self.fetch_all(), expected)
+    
+    def test_filters_run_in_sql(self):
+        """Project, level, status, category and keyword filters combine"""
+        ids = self.fetch_all(project=self.project.id, level='High', status='Open', category='Technical')
+        expected = Risk.objects.filter(project=self.project, level='High', status='Open', category=self.category)
+        self.assertEqual(set(ids), set(expected.values_list('id', flat=True)))
+        
+        self.assertEqual(len(self.fetch_all(category='None')), Risk.objects.filter(category__isnull=True).count())
+        self.assertEqual(self.fetch_all(q='risk 07'), [Risk.objects.get(title='Register Risk 07').id])
+        self.assertEqual(len(self.fetch_all(q='regist', project='all')), 25)  # Prefix match
+    
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('risk_register_api'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_cursor_values_must_match_the_ordering(self):
+        """Crafted cursors with values of the wrong type are a 400, not a query error"""
+        for values in ([[1], 2, 'a', 1], [3, 2, 'a', {'id': 1}], ['x', 2, 'a', 1], [None, 2, 'a', 1]):
+            for parameter in ('cursor', 'before'):
+                response = self.client.get(reverse('risk_register_api'), {parameter: encode_cursor(values)})
+                self.assertEqual(response.status_code, 400, (parameter, values))
+
+
+class DashboardKeysetPaginationTests(TestCase):
+    """Tests for cursor pagination of the dashboard's risk register"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        project = Project.objects.create(name="Paged Project")
+        for i in range(45):
+            Risk.objects.create(project=project, title=f"Paged Risk {i % 7}",
+                                likelihood=i % 3 + 1, impact=i % 2 + 1)
+        self.expected = list(Risk.objects.order_by('-likelihood', '-impact', 'title', 'id')
+                             .values_list('id', flat=True))
+    
+    def page_ids(self, response):
+        return [risk.id for risk in response.context['all_risks_page']]
+    
+    def test_next_and_previous_cursors(self):
+        """Following next then previous cursors walks the register in order"""
+        pages = []
+        response = self.client.get(reverse('dashboard'))
+        self.assertIsNone(response.context['register_previous_cursor'])
+        while True:
+            pages.append(self.page_ids(response))
+            cursor = response.context['register_next_cursor']
+            if not cursor:
+                break
+            response = self.client.get(reverse('dashboard'), {'cursor': cursor})
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+        
+        response = self.client.get(reverse('dashboard'), {'before': response.context['register_previous_cursor']})
+        self.assertEqual(self.page_ids(response), pages[1])
+        response = self.client.get(reverse('dashboard'), {'before': response.context['register_previous_cursor']})
+        self.assertEqual(self.page_ids(response), pages[0])
+        self.assertIsNone(response.context['register_previous_cursor'])
+    
+    def test_deep_page_does_not_count_risks(self):
+        """Later pages seek by cursor and take the total from the summary table"""
+        first = self.client.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('dashboard'), {'cursor': first.context['register_next_cursor']})
+        risk_queries = [q['sql'] for q in queries.captured_queries if 'FROM "risks_risk"' in q['sql']]
+        self.assertFalse(any('COUNT(' in sql for sql in risk_queries))
+        self.assertFalse(any('OFFSET' in sql for sql in risk_queries))
+    
+    def test_bad_cursor_shows_first_page(self):
+        response = self.client.get(reverse('dashboard'), {'cursor': 'garbage'})
+        self.assertEqual(self.page_ids(response), self.expected[:20])
+        response = self.client.get(reverse('dashboard'), {'cursor': encode_cursor([[1], 2, 'a', 1])})
+        self.assertEqual(self.page_ids(response), self.expected[:20])
+
+
+class FullTextSearchTests(TestCase):
+    """Tests for the full-text search index and ranked search endpoint"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Search Project")
+        self.category, _ = Category.objects.get_or_create(name="Financial")
+        self.budget = Risk.objects.create(
+            project=self.project, title="Budget overrun", category=self.category,
+            description="Supplier costs are rising", likelihood=3, impact=3
+        )
+        self.vendor = Risk.objects.create(
+            project=self.project, title="Vendor delay",
+            description="The supplier may miss the budget deadline", status='Closed'
+        )
+        for i in range(5):
+            Risk.objects.create(project=self.project, title=f"Unrelated risk {i}")
+    
+    def search(self, **params):
+        return self.client.get(reverse('search_risks'), params).json()['results']
+    
+    def test_ranked_by_relevance(self):
+        """Title matches outrank description matches and stemming applies"""
+        results = self.search(q='budgets')
+        self.assertEqual([row['id'] for row in results], [self.budget.id, self.vendor.id])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertEqual([row['id'] for row in self.search(q='budget', status='Closed')], [self.vendor.id])
+    
+    def test_index_follows_edits_history_and_deletes(self):
+        self.vendor.title = "Logistics slippage"
+        self.vendor.save()
+        self.assertEqual([row['id'] for row in self.search(q='logistics')], [self.vendor.id])
+        
+        RiskHistory.objects.create(risk=self.budget, title=self.budget.title, category_name='',
+                                   likelihood=3, impact=3, status='Open',
+                                   change_comment="Escalated to the steering committee")
+        self.assertEqual([row['id'] for row in self.search(q='steering')], [self.budget.id])
+        
+        self.budget.delete()
+        self.assertEqual(self.search(q='steering'), [])
+    
+    def test_smart_search_parameters_apply_directly(self):
+        """The structured output of smart_risk_search runs as a filtered search"""
+        response = self.client.post(reverse('search_risks'), {
+            'project_id': self.project.id,
+            'search_parameters': {
+                'keywords': ['supplier', 'nonexistent'],
+                'categories': ['Financial'],
+                'status': ['Open'],
+                'minimum_risk_score': 6,
+                'date_range': None,
+            },
+        }, content_type='application/json')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.budget.id])
+    
+    def test_smart_search_parameters_are_validated(self):
+        """Scalars count as one-element lists; malformed dates, scores and bodies are a 400"""
+        def post(search_parameters):
+            return self.client.post(reverse('search_risks'), {
+                'project_id': self.project.id,
+                'search_parameters': search_parameters,
+            }, content_type='application/json')
+        
+        response = post({'keywords': 'supplier', 'categories': 'Financial', 'status': 'Open',
+                         'date_range': {'from': '2000-01-01', 'to': '2999-12-31'}})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.budget.id])
+        
+        for date_range in ({'from': 'notadate'}, {'to': '2024-02-30'}, {'from': 20240101}, 'last week'):
+            response = post({'date_range': date_range})
+            self.assertEqual(response.status_code, 400, date_range)
+            self.assertFalse(response.json()['success'])
+        
+        for minimum_risk_score in ({}, [6], '6', True, float('nan')):
+            response = post({'minimum_risk_score': minimum_risk_score})
+            self.assertEqual(response.status_code, 400, minimum_risk_score)
+            self.assertFalse(response.json()['success'])
+        self.assertEqual(post({'minimum_risk_score': 6.5}).status_code, 200)
+        self.assertEqual(post(['supplier']).status_code, 400)
+        
+        for body in ('[]', '"supplier"', '6'):
+            response = self.client.post(reverse('search_risks'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertFalse(response.json()['success'])
+    
+    @patch('risks.ai_views.smart_risk_search_async', new_callable=AsyncMock)
+    def test_smart_search_rejects_malformed_ai_output(self, smart_search):
+        """An AI answer that is not an object is a 502 with a fixed message"""
+        for result in (['supplier'], 'supplier', {'search_parameters': ['supplier']}):
+            smart_search.return_value = result
+            response = self.client.post(reverse('smart_risk_search'), {'query': 'supplier'},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 502, result)
+            self.assertNotIn('supplier', response.json()['error'])
+        
+        response = self.client.post(reverse('smart_risk_search'), '["supplier"]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        
+        smart_search.side_effect = RuntimeError('secret detail')
+        response = self.client.post(reverse('smart_risk_search'), {'query': 'supplier'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn('secret', response.json()['error'])
+    
+    def test_query_syntax_is_not_interpreted(self):
+        """FTS operators and quotes in user input are treated as plain words"""
+        self.assertEqual(self.search(q='"budget* OR NEAR('), [])
+        self.assertEqual(len(self.search(q='budget"')), 2)
+
+
+class RiskSimilarityIndexTests(TestCase):
+    """Tests for the on-disk risk similarity index and duplicate warnings"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RISK_SIMILARITY_INDEX_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Similarity Project")
+        self.other_project = Project.objects.create(name="Other Project")
+        self.server = Risk.objects.create(
+            project=self.project, title="Database server outage",
+            description="The primary database server could fail during peak load",
+            most_likely_cost_impact=Decimal('5000')
+        )
+        self.vendor = Risk.objects.create(
+            project=self.project, title="Vendor contract dispute",
+            description="Disagreement over payment terms with the main supplier"
+        )
+        self.other = Risk.objects.create(
+            project=self.other_project, title="Database server outage",
+            description="Primary database failure"
+        )
+        similarity.rebuild_index()
+    
+    def test_missing_index_queues_one_rebuild(self):
+        """Queries against a missing index find nothing, warn and queue a single rebuild job"""
+        os.remove(similarity.get_index().path)
+        with self.assertLogs('risks.similarity', 'WARNING'):
+            self.assertEqual(similarity.similar_risks("Database server outage"), [])
+        self.assertEqual(similarity.find_duplicates("Database server outage"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Risk.objects.create(project=self.project, title="Database failover test")
+        self.assertFalse(similarity.get_index().exists())
+        
+        job = claim_next_job()
+        self.assertEqual(job.kind, 'rebuild_similarity_index')
+        self.assertIsNone(claim_next_job())
+        job = run_job(job)
+        self.assertEqual(job.result, {'indexed': 4})
+        self.assertGreater(similarity.similar_risks("Database server outage", k=2)[0][1], 0.9)
+    
+    def test_nearest_risks_ranked_and_scoped(self):
+        results = similarity.similar_risks("Database outage", "server failure under load",
+                                           project_id=self.project.id)
+        self.assertEqual(results[0][0], self.server)
+        self.assertNotIn(self.other, [risk for risk, _ in results])
+        self.assertNotIn(self.vendor, [risk for risk, _ in results])
+        self.assertLessEqual(results[0][1], 1.0 + 1e-3)
+        
+        everywhere = similarity.similar_risks("Database server outage", k=2)
+        self.assertEqual({risk for risk, _ in everywhere}, {self.server, self.other})
+        self.assertEqual(similarity.similar_risks("Database server outage", k=5, exclude_ids=[self.server.id],
+                                                  project_id=self.project.id), [])
+    
+    def test_index_updated_on_commit_of_save_and_delete(self):
+        similarity.rebuild_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendor.title = "Database replica lag"
+            self.vendor.save()
+            added = Risk.objects.create(project=self.project, title="Supplier insolvency")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.server.delete()
+        
+        results = similarity.similar_risks("Database replica lag", project_id=self.project.id)
+        self.assertEqual(results[0][0], self.vendor)
+        self.assertEqual(similarity.similar_risks("Supplier insolvency")[0][0], added)
+        records = similarity.get_index().records()
+        self.assertEqual(len(records), 4)
+        self.assertEqual(sorted(int(risk_id) for risk_id in records['risk_id'] if risk_id),
+                         sorted([self.vendor.id, self.other.id, added.id]))
+        
+        self.assertEqual(similarity.rebuild_index(), 3)
+        self.assertEqual(len(similarity.get_index().records()), 3)
+    
+    def test_duplicate_warning_endpoint(self):
+        response = self.client.get(reverse('duplicate_risks'), {
+            'title': "Database server outage", 'description': "database server failure",
+            'project': self.project.id,
+        })
+        data = response.json()
+        self.assertEqual([row['id'] for row in data['results']], [self.server.id])
+        self.assertGreaterEqual(data['results'][0]['similarity'], similarity.DUPLICATE_THRESHOLD)
+        
+        response = self.client.get(reverse('duplicate_risks'), {
+            'title': "Database server outage", 'project': self.project.id, 'exclude': self.server.id,
+        })
+        self.assertEqual(response.json()['count'], 0)
+        response = self.client.get(reverse('duplicate_risks'), {'title': "Office relocation"})
+        self.assertEqual(response.json()['count'], 0)
+        self.assertEqual(self.client.get(reverse('duplicate_risks'), {'title': 'x', 'project': 'abc'}).status_code, 400)
+    
+    @patch('risks.ai_views.optimize_monte_carlo_estimates_async')
+    @patch('risks.ai_views.ai_risk_scoring_assistant_async')
+    def test_ai_context_uses_similar_risks(self, scoring, optimize):
+        scoring.return_value = {}
+        optimize.return_value = {}
+        body = {'description': "The database server may go down", 'project_id': self.project.id}
+        self.client.post(reverse('ai_risk_scoring'), body, content_type='application/json')
+        context = scoring.call_args.kwargs['project_context']
+        self.assertIn("Database server outage", context)
+        self.assertNotIn("Vendor contract dispute", context)
+        
+        self.client.post(reverse('optimize_monte_carlo'), body, content_type='application/json')
+        self.assertEqual(optimize.call_args[0][2],
+                         [{'description': "Database server outage", 'cost': 5000.0, 'category': None}])
+
+
+    @patch('risks.ai_client.get_model')
+    @patch('risks.ai_features.generate_text_async', new_callable=AsyncMock, return_value='{}')
+    def test_scoring_prompt_includes_similar_risks(self, generate, get_model):
+        body = {'description': "The database server may go down", 'category': 'Technical',
+                'project_id': self.project.id}
+        response = self.client.post(reverse('ai_risk_scoring'), body, content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        prompt = generate.call_args[0][2]
+        self.assertIn("Description: The database server may go down", prompt)
+        self.assertIn("Risk Category: Technical", prompt)
+        self.assertIn("Project Context: Similarity Project", prompt)
+        self.assertIn("- Database server outage (likelihood", prompt)
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=True,
+                   AI_RESPONSE_CACHE_DISABLED_FUNCTIONS=[])
+class AIResponseCacheTests(TestCase):
+    """Tests for the persistent Gemini response cache"""
+    
+    def setUp(self):
+        patcher = patch('risks.ai_client.genai')
+        self.genai = patcher.start()
+        self.addCleanup(patcher.stop)
+        ai_client.reset()
+        self.addCleanup(ai_client.reset)
+        self.model = self.genai.GenerativeModel.return_value
+        self.model.model_name = 'models/gemini-1.5-flash'
+        self.model.generate_content.return_value.text = (
+            '```json\n{"suggested_category": "Financial", "confidence": 0.9, "reasoning": "Costs"}\n```'
+        )
+    
+    def categorize(self, description="Server outage"):
+        return ai_features.auto_categorize_risk(description, ['Technical', 'Financial'])
+    
+    def test_repeated_call_is_served_from_cache(self):
+        first = self.categorize()
+        second = self.categorize()
+        self.assertEqual(first, second)
+        self.assertEqual(first['suggested_category'], 'Financial')
+        self.assertEqual(self.model.generate_content.call_count, 1)
+        self.assertEqual(ai_cache.cache_stats()['auto_categorize_risk'],
+                         {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1})
+        
+        self.categorize("Budget overrun")
+        self.assertEqual(self.model.generate_content.call_count, 2)
+    
+    def test_key_normalizes_whitespace_and_includes_model(self):
+        config = {'temperature': 0.1, 'max_output_tokens': 2048}
+        key = ai_cache.cache_key('f', 'model-a', "  Rate   this\n\n    risk ", config)
+        self.assertEqual(key, ai_cache.cache_key('f', 'model-a', "Rate this risk", dict(reversed(config.items()))))
+        self.assertNotEqual(key, ai_cache.cache_key('f', 'model-b', "Rate this risk", config))
+        self.assertNotEqual(key, ai_cache.cache_key('g', 'model-a', "Rate this risk", config))
+        self.assertNotEqual(key, ai_cache.cache_key('f', 'model-a', "Rate this risk", dict(config, temperature=0.9)))
+    
+    def test_generation_settings_changes_miss_the_cache(self):
+        self.categorize()
+        with override_settings(AI_MAX_OUTPUT_TOKENS=4096):
+            self.categorize()
+        self.assertEqual(self.model.generate_content.call_count, 2)
+        self.categorize()
+        self.assertEqual(self.model.generate_content.call_count, 2)
+    
+    def test_expired_entries_are_not_used(self):
+        self.categorize()
+        AIResponse.objects.update(created_at=timezone.now() - timedelta(days=2))
+        with override_settings(AI_RESPONSE_CACHE_TTL=3600):
+            self.categorize()
+        self.assertEqual(self.model.generate_content.call_count, 2)
+        self.assertEqual(AIResponse.objects.count(), 1)
+    
+    @override_settings(AI_RESPONSE_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        self.categorize("first")
+        self.categorize("second")
+        AIResponse.objects.filter(function='auto_categorize_risk').update(
+            last_used_at=timezone.now() - timedelta(minutes=5))
+        self.categorize("first")
+        self.categorize("third")
+        self.assertEqual(AIResponse.objects.count(), 2)
+        self.categorize("first")
+        self.assertEqual(self.model.generate_content.call_count, 3)
+    
+    def test_per_function_opt_out_and_invalid_responses(self):
+        with override_settings(AI_RESPONSE_CACHE_DISABLED_FUNCTIONS=['auto_categorize_risk']):
+            self.categorize()
+            self.categorize()
+        self.assertEqual(self.model.generate_content.call_count, 2)
+        self.assertFalse(AIResponse.objects.exists())
+        
+        self.model.generate_content.return_value.text = "Sorry, I can't help with that"
+        self.assertEqual(self.categorize()['confidence'], 0.2)
+        self.assertFalse(AIResponse.objects.exists())
+    
+    def test_management_command_reports_and_clears(self):
+        self.categorize()
+        out = io.StringIO()
+        call_command('ai_response_cache', stdout=out)
+        self.assertIn('auto_categorize_risk: 0 hits, 1 misses', out.getvalue())
+        call_command('ai_response_cache', '--clear', stdout=io.StringIO())
+        self.assertFalse(AIResponse.objects.exists())
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_MODEL_NAME='gemini-test',
+                   AI_TEMPERATURE=0.3, AI_MAX_OUTPUT_TOKENS=512)
+class AIClientRegistryTests(TestCase):
+    """Tests for the shared Gemini client and model registry"""
+    
+    def setUp(self):
+        patcher = patch('risks.ai_client.genai')
+        self.genai = patcher.start()
+        self.addCleanup(patcher.stop)
+        ai_client.reset()
+        self.addCleanup(ai_client.reset)
+    
+    def test_configures_once_and_shares_the_model(self):
+        first = ai_client.get_model()
+        ai_features.setup_gemini_api()
+        self.assertIs(ai_client.get_model(), first)
+        self.genai.configure.assert_called_once_with(api_key='test-key')
+        self.genai.GenerativeModel.assert_called_once_with(
+            'gemini-test', generation_config=self.genai.GenerationConfig.return_value)
+        self.genai.GenerationConfig.assert_called_once_with(temperature=0.3, max_output_tokens=512)
+    
+    def test_settings_changes_take_effect(self):
+        ai_client.get_model()
+        with override_settings(AI_TEMPERATURE=0.9):
+            ai_client.get_model()
+        self.assertEqual(self.genai.GenerativeModel.call_count, 2)
+        with override_settings(GEMINI_API_KEY='rotated-key'):
+            ai_client.get_model()
+        self.assertEqual(self.genai.configure.call_count, 2)
+        with override_settings(GEMINI_API_KEY=None):
+            with self.assertRaises(ValueError):
+                ai_client.get_model()
+    
+    @override_settings(AI_RESPONSE_CACHE_ENABLED=False)
+    def test_ai_features_use_the_registry(self):
+        self.genai.GenerativeModel.return_value.generate_content.return_value.text = '{"suggested_category": "Technical"}'
+        for description in ("Server outage", "Network outage"):
+            ai_features.auto_categorize_risk(description, ['Technical'])
+        self.assertEqual(self.genai.GenerativeModel.call_count, 1)
+        self.assertEqual(self.genai.GenerativeModel.return_value.generate_content.call_count, 2)
+    
+    @override_settings(GEMINI_API_KEY=None)
+    def test_missing_api_key_is_not_a_fallback(self):
+        """A missing key raises to the caller instead of looking like a failed call"""
+        with self.assertRaises(ValueError):
+            ai_features.auto_categorize_risk("Server outage", ['Technical'])
+        with self.assertRaises(ValueError):
+            async_to_sync(ai_features.auto_categorize_risk_async)("Server outage", ['Technical'])
+        self.genai.GenerativeModel.assert_not_called()
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=False, AI_REQUEST_TIMEOUT=30,
+                   AI_MAX_RETRIES=3, AI_RETRY_BACKOFF=0.5, AI_RETRY_BACKOFF_MAX=8.0,
+                   AI_CIRCUIT_WINDOW=10, AI_CIRCUIT_MIN_CALLS=4, AI_CIRCUIT_FAILURE_RATE=0.5,
+                   AI_CIRCUIT_RESET_TIMEOUT=60)
+class AICallResilienceTests(TestCase):
+    """Tests for AI call deadlines, retries and the circuit breaker"""
+    
+    def setUp(self):
+        patcher = patch('risks.ai_client.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        ai_client.breaker.reset()
+        self.addCleanup(ai_client.breaker.reset)
+        self.model = MagicMock()
+        self.model.generate_content.return_value.text = '{"ok": true}'
+    
+    def test_transient_failures_are_retried_with_backoff(self):
+        self.model.generate_content.side_effect = [
+            google_exceptions.ServiceUnavailable('busy'),
+            google_exceptions.TooManyRequests('slow down'),
+            self.model.generate_content.return_value,
+        ]
+        self.assertEqual(ai_client.generate(self.model, 'prompt'), '{"ok": true}')
+        self.assertEqual(self.model.generate_content.call_count, 3)
+        first_delay, second_delay = [args[0] for args, _ in self.sleep.call_args_list]
+        self.assertTrue(0.25 <= first_delay <= 0.5 and 0.5 <= second_delay <= 1.0)
+        timeout = self.model.generate_content.call_args.kwargs['request_options']['timeout']
+        self.assertTrue(0 < timeout <= 30)
+    
+    def test_retries_are_bounded(self):
+        self.model.generate_content.side_effect = google_exceptions.DeadlineExceeded('hung')
+        with self.assertRaises(google_exceptions.DeadlineExceeded):
+            ai_client.generate(self.model, 'prompt')
+        self.assertEqual(self.model.generate_content.call_count, 4)
+        
+        self.model.generate_content.reset_mock()
+        self.model.generate_content.side_effect = google_exceptions.PermissionDenied('bad key')
+        with self.assertRaises(google_exceptions.PermissionDenied):
+            ai_client.generate(self.model, 'prompt')
+        self.assertEqual(self.model.generate_content.call_count, 1)
+    
+    @override_settings(AI_REQUEST_TIMEOUT=1, AI_RETRY_BACKOFF=4.0)
+    def test_no_retry_past_the_deadline(self):
+        self.model.generate_content.side_effect = google_exceptions.ServiceUnavailable('busy')
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            ai_client.generate(self.model, 'prompt')
+        self.assertEqual(self.model.generate_content.call_count, 1)
+        self.sleep.assert_not_called()
+    
+    def test_circuit_opens_and_features_fall_back(self):
+        self.model.generate_content.side_effect = google_exceptions.PermissionDenied('down')
+        for _ in range(4):
+            with self.assertRaises(google_exceptions.PermissionDenied):
+                ai_client.generate(self.model, 'prompt')
+        self.assertEqual(ai_client.breaker.state, 'open')
+        
+        with patch('risks.ai_client.get_model', return_value=self.model):
+            result = ai_features.auto_categorize_risk("Server outage", ['Technical', 'Financial'])
+        self.assertEqual(result['confidence'], 0.2)
+        self.assertEqual(self.model.generate_content.call_count, 4)
+    
+    def test_half_open_trial_closes_or_reopens(self):
+        self.model.generate_content.side_effect = google_exceptions.PermissionDenied('down')
+        for _ in range(4):
+            with self.assertRaises(google_exceptions.PermissionDenied):
+                ai_client.generate(self.model, 'prompt')
+        with override_settings(AI_CIRCUIT_RESET_TIMEOUT=0):
+            self.assertEqual(ai_client.breaker.state, 'half-open')
+            with self.assertRaises(google_exceptions.PermissionDenied):
+                ai_client.generate(self.model, 'prompt')
+        self.assertEqual(ai_client.breaker.state, 'open')
+        with self.assertRaises(ai_client.CircuitOpenError):
+            ai_client.generate(self.model, 'prompt')
+        
+        self.model.generate_content.side_effect = None
+        with override_settings(AI_CIRCUIT_RESET_TIMEOUT=0):
+            self.assertEqual(ai_client.generate(self.model, 'prompt'), '{"ok": true}')
+        self.assertEqual(ai_client.breaker.state, 'closed')
+    
+    @override_settings(AI_CIRCUIT_RESET_TIMEOUT=0)
+    def test_cancelled_half_open_trial_is_released(self):
+        """A trial cancelled mid-call or interrupted mid-retry lets the next call through"""
+        self.model.generate_content.side_effect = google_exceptions.PermissionDenied('down')
+        for _ in range(4):
+            with self.assertRaises(google_exceptions.PermissionDenied):
+                ai_client.generate(self.model, 'prompt')
+        
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(3600)
+        
+        async def cancel_trial():
+            self.model.generate_content_async = AsyncMock(side_effect=hang)
+            trial = asyncio.ensure_future(ai_client.generate_async(self.model, 'prompt'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(ai_client.breaker.allow())
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+        
+        async_to_sync(cancel_trial)()
+        self.assertEqual(ai_client.breaker.state, 'half-open')
+        self.assertTrue(ai_client.breaker.allow())
+        ai_client.breaker.release()
+        
+        self.model.generate_content.side_effect = google_exceptions.ServiceUnavailable('busy')
+        self.sleep.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            ai_client.generate(self.model, 'prompt')
+        self.sleep.side_effect = None
+        
+        self.model.generate_content.side_effect = None
+        self.assertEqual(ai_client.generate(self.model, 'prompt'), '{"ok": true}')
+        self.assertEqual(ai_client.breaker.state, 'closed')
+
+
+class AsyncAIViewTests(TestCase):
+    """Tests for the async AI views and the async Gemini calls"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Async Project")
+        Risk.objects.create(
+            project=self.project,
+            title="Vendor delay",
+            description="Key vendor may deliver late",
+            likelihood=2,
+            impact=3,
+            status='Open'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        ai_client.reset()
+        self.addCleanup(ai_client.reset)
+        ai_client.breaker.reset()
+        self.addCleanup(ai_client.breaker.reset)
+    
+    def patch_async(self, name, result):
+        patcher = patch(f'risks.ai_views.{name}', new=AsyncMock(return_value=result))
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+    
+    def test_project_analysis_returns_every_section(self):
+        self.patch_async('analyze_risk_trend_async', {'identified_patterns': []})
+        self.patch_async('analyze_risk_dependencies_async', {'critical_risks': []})
+        self.patch_async('generate_executive_summary_async', {'executive_summary': 'All good'})
+        self.patch_async('generate_mitigation_timeline_async', {'timeline_phases': []})
+        
+        response = self.client.get(reverse('project_ai_analysis', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['project_name'], "Async Project")
+        self.assertEqual(data['trends']['analysis'], {'identified_patterns': []})
+        self.assertEqual(data['dependencies']['dependency_analysis'], {'critical_risks': []})
+        self.assertEqual(data['executive_summary']['executive_summary'], {'executive_summary': 'All good'})
+        self.assertEqual(data['mitigation_timeline']['mitigation_timeline'], {'timeline_phases': []})
+    
+    def test_failed_section_does_not_sink_the_others(self):
+        self.patch_async('analyze_risk_trend_async', {'identified_patterns': []})
+        self.patch_async('analyze_risk_dependencies_async', {'critical_risks': []})
+        self.patch_async('generate_executive_summary_async', {'executive_summary': 'All good'})
+        self.patch_async('generate_mitigation_timeline_async', None).side_effect = RuntimeError("boom")
+        
+        data = self.client.get(reverse('project_ai_analysis', args=[self.project.id])).json()
+        self.assertTrue(data['trends']['success'])
+        self.assertEqual(data['mitigation_timeline'], {'success': False, 'error': 'boom'})
+    
+    def test_async_view_calls_async_ai_function(self):
+        categorize = self.patch_async('auto_categorize_risk_async', {'suggested_category': 'Technical'})
+        response = self.client.post(reverse('auto_categorize_risk'),
+                                    data={'description': 'Server outage'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['categorization'], {'suggested_category': 'Technical'})
+        categorize.assert_awaited_once()
+        self.assertEqual(categorize.await_args.args[0], 'Server outage')
+    
+    @override_settings(GEMINI_API_KEY='test-key')
+    def test_async_call_matches_sync_call(self):
+        with patch('risks.ai_client.genai') as genai:
+            model = genai.GenerativeModel.return_value
+            model.model_name = 'models/gemini-1.5-flash'
+            text = '{"suggested_category": "Financial", "confidence": 0.9, "reasoning": "Costs"}'
+            model.generate_content.return_value.text = text
+            model.generate_content_async = AsyncMock(return_value=MagicMock(text=text))
+            
+            result_async = async_to_sync(ai_features.auto_categorize_risk_async)(
+                "Budget overrun", ['Technical', 'Financial'])
+            ai_cache.clear()
+            result = ai_features.auto_categorize_risk("Budget overrun", ['Technical', 'Financial'])
+        self.assertEqual(result_async, result)
+        self.assertEqual(result['suggested_category'], 'Financial')
+        model.generate_content_async.assert_awaited_once()
+    
+    @override_settings(GEMINI_API_KEY='test-key')
+    def test_async_call_falls_back_on_error(self):
+        with patch('risks.ai_client.genai') as genai:
+            model = genai.GenerativeModel.return_value
+            model.generate_content_async = AsyncMock(side_effect=ValueError("bad request"))
+            result = async_to_sync(ai_features.auto_categorize_risk_async)(
+                "Budget overrun", ['Technical', 'Financial'])
+        self.assertEqual(result['suggested_category'], 'Technical')
+        self.assertEqual(result['confidence'], 0.2)
+
+
+class AIBatchBackfillTests(TestCase):
+    """Tests for batched AI categorization and scoring and the ai_backfill command"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Imported Project")
+        self.technical = Category.objects.get(name='Technical')
+        self.risks = [
+            Risk.objects.create(project=self.project, title=title, description=f"{title} description")
+            for title in ("Server outage", "Flaky vendor", "Data loss", "Budget cut", "Staff turnover")
+        ]
+    
+    def answers(self, rows, *args, flaky_calls=None):
+        """Categorize every row as Technical, except "Flaky vendor" on its first try"""
+        results = []
+        for row in rows:
+            if row['title'] == "Flaky vendor" and flaky_calls is not None and not flaky_calls:
+                flaky_calls.append(row)
+                results.append(None)
+            else:
+                results.append({'suggested_category': 'Technical', 'confidence': 0.9, 'reasoning': 'Systems'})
+        return results
+    
+    def test_batch_response_is_validated_per_item(self):
+        response = MagicMock(text='```json\n[{"index": 0, "suggested_category": "technical", "confidence": 2},'
+                                  '{"index": 1, "suggested_category": "Weather", "confidence": 0.5},'
+                                  '{"index": 7, "suggested_category": "Financial"}]\n```')
+        rows = [{'title': 'A', 'description': ''}, {'title': 'B', 'description': ''}, {'title': 'C', 'description': ''}]
+        with override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=False), \
+                patch('risks.ai_client.genai') as genai:
+            ai_client.reset()
+            self.addCleanup(ai_client.reset)
+            genai.GenerativeModel.return_value.generate_content.return_value = response
+            results = ai_features.batch_auto_categorize_risks(rows, ['Technical', 'Financial'])
+        self.assertEqual(results[0]['suggested_category'], 'Technical')
+        self.assertEqual(results[0]['confidence'], 1.0)
+        self.assertEqual(results[1:], [None, None])
+    
+    def test_scores_outside_the_scale_are_rejected(self):
+        response = MagicMock(text='[{"index": 0, "likelihood": 3, "impact": "2"},'
+                                  '{"index": 1, "likelihood": 4, "impact": 1},'
+                                  '{"index": 1, "likelihood": 2, "impact": 2}]')
+        with override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=False), \
+                patch('risks.ai_client.genai') as genai:
+            ai_client.reset()
+            self.addCleanup(ai_client.reset)
+            genai.GenerativeModel.return_value.generate_content.return_value = response
+            results = ai_features.batch_ai_risk_scoring([{'title': 'A'}, {'title': 'B'}])
+        self.assertEqual((results[0]['likelihood'], results[0]['impact']), (3, 2))
+        self.assertIsNone(results[1])
+    
+    def test_failed_batch_call_is_logged_and_unanswered(self):
+        """An API error leaves every risk unanswered for the backfill to retry"""
+        with override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=False), \
+                patch('risks.ai_client.genai') as genai, self.assertLogs('risks.ai_features', 'ERROR'):
+            ai_client.reset()
+            self.addCleanup(ai_client.reset)
+            genai.GenerativeModel.return_value.generate_content.side_effect = ValueError("bad request")
+            results = ai_features.batch_ai_risk_scoring([{'title': 'A'}, {'title': 'B'}])
+        self.assertEqual(results, [None, None])
+    
+    def test_failed_items_are_requeued(self):
+        flaky_calls = []
+        categorize = AsyncMock(side_effect=lambda rows, categories: self.answers(rows, flaky_calls=flaky_calls))
+        with patch('risks.ai_batch.batch_auto_categorize_risks_async', new=categorize):
+            run = ai_batch.run_backfill(ai_batch.start_run('categorize', self.project), batch_size=2,
+                                        concurrency=2)
+        self.assertEqual(run.status, 'finished')
+        self.assertEqual((run.updated, run.failed_ids), (5, []))
+        self.assertEqual(len(flaky_calls), 1)
+        # The retried risk joins the last risk in the second wave
+        self.assertEqual(categorize.await_count, 3)
+        self.assertFalse(Risk.objects.filter(project=self.project).exclude(category=self.technical).exists())
+        self.assertEqual(RiskHistory.objects.filter(change_comment__startswith='AI backfill').count(), 5)
+    
+    def test_backfill_comments_are_searchable(self):
+        categorize = AsyncMock(side_effect=lambda rows, categories: [
+            {'suggested_category': 'Technical', 'confidence': 0.9, 'reasoning': 'Mainframe dependency'}
+            for _ in rows
+        ])
+        with patch('risks.ai_batch.batch_auto_categorize_risks_async', new=categorize):
+            ai_batch.run_backfill(ai_batch.start_run('categorize', self.project))
+        found = search.ranked_search(['mainframe'], Risk.objects.filter(project=self.project))
+        self.assertEqual(sorted(risk.id for risk, _ in found), sorted(risk.id for risk in self.risks))
+    
+    def test_items_are_given_up_after_max_attempts(self):
+        categorize = AsyncMock(side_effect=lambda rows, categories: [None] * len(rows))
+        with patch('risks.ai_batch.batch_auto_categorize_risks_async', new=categorize):
+            run = ai_batch.run_backfill(ai_batch.start_run('categorize', self.project), batch_size=5,
+                                        max_attempts=2)
+        self.assertEqual(run.updated, 0)
+        self.assertEqual(sorted(run.failed_ids), sorted(risk.id for risk in self.risks))
+        self.assertEqual(categorize.await_count, 2)
+    
+    def test_resume_continues_after_checkpoint(self):
+        interrupted = AIBackfillRun.objects.create(task='categorize', project=self.project,
+                                                   last_risk_id=self.risks[2].id, failed_ids=[self.risks[0].id])
+        categorize = AsyncMock(side_effect=lambda rows, categories: self.answers(rows))
+        with patch('risks.ai_batch.batch_auto_categorize_risks_async', new=categorize):
+            run = ai_batch.run_backfill(ai_batch.start_run('categorize', self.project, resume=True))
+        self.assertEqual(run.id, interrupted.id)
+        titles = [row['title'] for call in categorize.await_args_list for row in call.args[0]]
+        self.assertEqual(titles, ["Server outage", "Budget cut", "Staff turnover"])
+    
+    def test_command_scores_risks(self):
+        Risk.objects.filter(id=self.risks[0].id).update(likelihood=2)
+        score = AsyncMock(side_effect=lambda rows, context: [
+            {'likelihood': 3, 'impact': 2, 'confidence_level': 'High', 'reasoning': 'Likely'} for _ in rows
+        ])
+        out = io.StringIO()
+        with patch('risks.ai_batch.batch_ai_risk_scoring_async', new=score):
+            call_command('ai_backfill', 'score', '--project', str(self.project.id), '--batch-size', '2',
+                         stdout=out)
+        self.assertIn('4 risk(s) updated', out.getvalue())
+        self.assertEqual(Risk.objects.filter(project=self.project, score=6).count(), 4)
+        self.assertEqual(Risk.objects.get(id=self.risks[0].id).likelihood, 2)
+        self.assertIn("Imported Project", score.await_args.args[1])
+
+
+@override_settings(AI_PROMPT_TOKEN_BUDGET=400, AI_PROMPT_DESCRIPTION_TOKENS=50,
+                   AI_PROMPT_MIN_DESCRIPTION_TOKENS=10, AI_PROMPT_MAX_CHUNKS=3)
+class PromptBudgetTests(TestCase):
+    """Tests for fitting project risk lists into the prompt token budget"""
+    
+    def entries(self, count, words=60):
+        return [(f"Risk {i+1}: Title {i+1} - {{description}}", " ".join(["word"] * words)) for i in range(count)]
+    
+    def test_truncate_cuts_at_a_word_boundary(self):
+        self.assertEqual(prompt_budget.truncate("short text", 10), "short text")
+        cut = prompt_budget.truncate("alpha beta gamma delta epsilon", 4)
+        self.assertEqual(cut, "alpha beta...")
+        self.assertLessEqual(prompt_budget.estimate_tokens(cut), 4)
+    
+    def test_small_lists_fit_in_one_prompt(self):
+        chunks, omitted = prompt_budget.pack(self.entries(3, words=5))
+        self.assertEqual((len(chunks), omitted), (1, 0))
+        self.assertEqual(chunks[0][0], "Risk 1: Title 1 - " + " ".join(["word"] * 5))
+    
+    def test_descriptions_are_shortened_before_chunking(self):
+        chunks, omitted = prompt_budget.pack(self.entries(8))
+        self.assertEqual((len(chunks), omitted), (1, 0))
+        self.assertTrue(all(entry.endswith('...') for entry in chunks[0]))
+        self.assertLessEqual(sum(map(prompt_budget.estimate_tokens, chunks[0])), 400)
+    
+    def test_large_lists_are_chunked_and_lowest_ranked_left_out(self):
+        chunks, omitted = prompt_budget.pack(self.entries(200))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(all(sum(map(prompt_budget.estimate_tokens, chunk)) <= 400 for chunk in chunks))
+        kept = [entry for chunk in chunks for entry in chunk]
+        self.assertEqual(omitted, 200 - len(kept))
+        self.assertTrue(kept[0].startswith("Risk 1:") and kept[-1].startswith(f"Risk {len(kept)}:"))
+    
+    def test_fit_json_trims_longest_lists(self):
+        data = [{'patterns': [f"pattern {i}" for i in range(500)], 'spots': ['a']}]
+        text = prompt_budget.fit_json(data, budget=100)
+        self.assertLessEqual(prompt_budget.estimate_tokens(text), 100)
+        self.assertEqual(json.loads(text)[0]['spots'], ['a'])
+    
+    def test_risks_are_ranked_by_score_then_expected_cost(self):
+        project = Project.objects.create(name="Ranked")
+        cheap = Risk.objects.create(project=project, title="Cheap", likelihood=3, impact=3,
+                                    likelihood_percentage=10, most_likely_cost_impact=100)
+        costly = Risk.objects.create(project=project, title="Costly", likelihood=3, impact=3,
+                                     likelihood_percentage=50, most_likely_cost_impact=1000)
+        minor = Risk.objects.create(project=project, title="Minor", likelihood=1, impact=1,
+                                    likelihood_percentage=90, most_likely_cost_impact=10 ** 6)
+        self.assertEqual(list(prompt_budget.by_importance(project.risks.all())), [costly, cheap, minor])
+    
+    @override_settings(GEMINI_API_KEY='test-key', AI_RESPONSE_CACHE_ENABLED=False)
+    def test_large_projects_are_analyzed_in_chunks_and_merged(self):
+        risks = [{'title': f"Risk {i}", 'description': "word " * 60, 'category': 'Technical', 'risk_score': 4}
+                 for i in range(200)]
+        partial = '{"critical_risks": [{"risk": "Risk 0"}]}'
+        merged = '{"risk_dependencies": [], "cascade_scenarios": [], "risk_clusters": [], "critical_risks": []}'
+        with patch('risks.ai_client.genai') as genai:
+            ai_client.reset()
+            self.addCleanup(ai_client.reset)
+            model = genai.GenerativeModel.return_value
+            model.generate_content.side_effect = [MagicMock(text=partial)] * 3 + [MagicMock(text=merged)]
+            result = ai_features.analyze_risk_dependencies(risks)
+            
+            model.generate_content_async = AsyncMock(
+                side_effect=[MagicMock(text=partial)] * 3 + [MagicMock(text=merged)])
+            result_async = async_to_sync(ai_features.analyze_risk_dependencies_async)(risks)
+        
+        self.assertEqual(model.generate_content.call_count, 4)
+        merge_prompt = model.generate_content.call_args.args[0]
+        self.assertIn("merge these 3 analyses", merge_prompt)
+        self.assertIn('"risk":"Risk 0"', merge_prompt)
+        self.assertGreater(result['omitted_risks'], 0)
+        self.assertEqual(result_async, result)
+        self.assertEqual(model.generate_content_async.await_count, 4)
+
+
+class CorrelatedSimulationTests(TestCase):
+    """Tests for correlated risk sampling in the Monte Carlo engine"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name="Correlated Project")
+        self.group = CorrelationGroup.objects.create(project=self.project, name="Shared database", correlation=0.8)
+        self.risks = [
+            Risk.objects.create(
+                project=self.project,
+                title=f"Database risk {i}",
+                likelihood_percentage=20,
+                optimistic_cost_impact=1000,
+                most_likely_cost_impact=2000,
+                pessimistic_cost_impact=8000,
+                status='Open'
+            )
+            for i in range(10)
+        ]
+    
+    def simulate(self, correlation=None):
+        if correlation is not None:
+            CorrelationGroup.objects.filter(id=self.group.id).update(correlation=correlation)
+            Risk.objects.filter(project=self.project).update(correlation_group=self.group)
+        return run_monte_carlo_simulation(self.project.risks, 40000, seed=5)['statistics']
+    
+    def test_normal_cdf_is_accurate(self):
+        z = np.linspace(-6, 6, 1201)
+        exact = np.array([0.5 * math.erfc(-value / math.sqrt(2)) for value in z])
+        self.assertLess(np.abs(normal_cdf(z) - exact).max(), 2e-7)
+    
+    def test_correlation_widens_the_tail_but_keeps_the_mean(self):
+        independent = self.simulate()
+        correlated = self.simulate(0.8)
+        
+        self.assertAlmostEqual(correlated['mean'], independent['mean'], delta=independent['mean'] * 0.03)
+        self.assertGreater(correlated['p95'], independent['p95'] * 1.3)
+        self.assertGreater(correlated['std_dev'], independent['std_dev'] * 1.5)
+    
+    def test_zero_correlation_matches_independent_sampling(self):
+        self.assertEqual(self.simulate(0.0), self.simulate())
+    
+    def test_fully_correlated_risks_occur_together(self):
+        Risk.objects.filter(project=self.project).update(
+            likelihood_percentage=50, optimistic_cost_impact=100, most_likely_cost_impact=100,
+            pessimistic_cost_impact=100, correlation_group=self.group)
+        CorrelationGroup.objects.filter(id=self.group.id).update(correlation=1.0)
+        
+        results = run_monte_carlo_simulation(self.project.risks, 5000, seed=2, keep_samples=True)
+        self.assertEqual(set(results['results']), {0.0, 1000.0})
+    
+    def test_correlation_changes_the_cached_run(self):
+        Risk.objects.filter(project=self.project).update(correlation_group=self.group)
+        run_cached_simulation(self.project, 1000, seed=1)
+        CorrelationGroup.objects.filter(id=self.group.id).update(correlation=0.2)
+        _, cached = run_cached_simulation(self.project, 1000, seed=1)
+        self.assertFalse(cached)
+    
+    def test_group_must_belong_to_the_risk_project(self):
+        other = Project.objects.create(name="Other Project")
+        risk = Risk(project=other, title="Stray", correlation_group=self.group)
+        with self.assertRaises(ValidationError):
+            risk.full_clean()
+
+
+class CostDistributionTests(TestCase):
+    """Tests for the per-risk cost distributions of the Monte Carlo engine"""
+    
+    def setUp(self):
+        self.generator = np.random.default_rng(11)
+    
+    def sample(self, distribution, optimistic=1000.0, most_likely=3000.0, pessimistic=10000.0):
+        sampler = distributions.prepare(distribution, optimistic, most_likely, pessimistic)
+        return sampler, sampler.sample(self.generator, 400000)
+    
+    def test_pert_matches_beta_moments(self):
+        sampler, samples = self.sample('pert')
+        self.assertAlmostEqual(sampler.mean, (1000 + 4 * 3000 + 10000) / 6)
+        self.assertAlmostEqual(samples.mean(), sampler.mean, delta=sampler.mean * 0.005)
+        self.assertGreaterEqual(samples.min(), 1000)
+        self.assertLessEqual(samples.max(), 10000)
+        # PERT has thinner tails than the triangle with the same corners
+        _, triangular = self.sample('triangular')
+        self.assertLess(np.percentile(samples, 95), np.percentile(triangular, 95))
+    
+    def test_lognormal_fits_mode_and_95th_percentile(self):
+        sampler, samples = self.sample('lognormal')
+        self.assertAlmostEqual(np.percentile(samples, 95), 10000, delta=100)
+        counts, edges = np.histogram(samples, bins=90, range=(1000, 10000))
+        self.assertAlmostEqual(edges[counts.argmax()], 3000, delta=300)
+        self.assertAlmostEqual(samples.mean(), sampler.mean, delta=sampler.mean * 0.01)
+        self.assertTrue(np.isfinite(sampler.upper))
+        self.assertLessEqual(samples.max(), sampler.upper)
+    
+    def test_lognormal_is_cut_off_above_the_pessimistic_cost(self):
+        """A wide estimate cannot draw costs far beyond its worst case"""
+        sampler, samples = self.sample('lognormal', 0.0, 1.0, 1e6)
+        cap = distributions.LOGNORMAL_MAX_MULTIPLE * 1e6
+        self.assertEqual(sampler.upper, cap)
+        self.assertLessEqual(samples.max(), cap)
+        self.assertAlmostEqual(np.percentile(samples, 95), 1e6, delta=2e4)
+        self.assertAlmostEqual(samples.mean(), sampler.mean, delta=sampler.mean * 0.01)
+        
+        project = Project.objects.create(name="Wide Estimate Project")
+        Risk.objects.create(project=project, title="Wide estimate", likelihood_percentage=100,
+                            optimistic_cost_impact=0, most_likely_cost_impact=1, pessimistic_cost_impact=10 ** 6,
+                            cost_distribution='lognormal', status='Open')
+        result = run_monte_carlo_simulation(project.risks, 20000, seed=3)
+        self.assertLessEqual(result['statistics']['max_cost'], cap)
+        self.assertLessEqual(max(result['histogram_data']['bins']), cap)
+        self.assertLess(max(result['histogram_data']['frequencies']), 20000 * 0.9)
+    
+    def test_uniform_covers_range_evenly(self):
+        sampler, samples = self.sample('uniform')
+        self.assertGreaterEqual(samples.min(), 1000)
+        self.assertLess(samples.max(), 10000)
+        self.assertAlmostEqual(np.median(samples), 5500, delta=50)
+    
+    def test_invalid_and_degenerate_costs_use_most_likely(self):
+        for distribution in ('triangular', 'pert', 'lognormal', 'uniform'):
+            for costs in ((5000.0, 3000.0, 10000.0), (2000.0, 2000.0, 2000.0)):
+                _, samples = self.sample(distribution, *costs)
+                self.assertTrue(np.all(samples == costs[1]), distribution)
+    
+    def test_extreme_variates_give_finite_costs_in_range(self):
+        """u = 0 and u = 1 stay finite, including a lognormal whose cap covers all its mass"""
+        u = np.array([0.0, 1.0])
+        for distribution in ('triangular', 'pert', 'lognormal', 'uniform'):
+            for costs in ((1000.0, 3000.0, 10000.0), (0.0, 99.0, 100.0), (2000.0, 2000.0, 2000.0)):
+                sampler = distributions.prepare(distribution, *costs)
+                samples = sampler.inverse_cdf(u)
+                self.assertTrue(np.all(np.isfinite(samples)), (distribution, costs))
+                self.assertTrue(np.all((samples >= sampler.lower) & (samples <= sampler.upper)), (distribution, costs))
+                stacked = type(sampler).stack([sampler, sampler]).inverse_cdf(np.column_stack([u, u]))
+                self.assertTrue(np.all(np.isfinite(stacked)), (distribution, costs))
+    
+    def test_lognormal_without_interior_mode_falls_back_to_triangular(self):
+        sampler = distributions.prepare('lognormal', 1000.0, 1000.0, 5000.0)
+        self.assertIsInstance(sampler, distributions.TriangularSampler)
+    
+    def test_normal_ppf_is_accurate(self):
+        u = np.array([1e-9, 1e-4, 0.01, 0.02425, 0.2, 0.5, 0.8, 0.99, 1 - 1e-9])
+        exact = [NormalDist().inv_cdf(p) for p in u]
+        np.testing.assert_allclose(distributions.normal_ppf(u), exact, rtol=1e-8)
+    
+    def test_stacked_samplers_transform_each_column(self):
+        """A stacked sampler maps each column through its own risk's sampler"""
+        u = self.generator.random((1000, 3))
+        for distribution in ('triangular', 'pert', 'lognormal', 'uniform'):
+            samplers = [distributions.prepare(distribution, 1000.0 * i, 3000.0 * i, 10000.0 * i) for i in (1, 2, 5)]
+            stacked = type(samplers[0]).stack(samplers).inverse_cdf(u)
+            expected = np.column_stack([sampler.inverse_cdf(u[:, j]) for j, sampler in enumerate(samplers)])
+            np.testing.assert_allclose(stacked, expected, rtol=1e-12, err_msg=distribution)
+        constant = distributions.ConstantSampler.stack([distributions.ConstantSampler(v) for v in (1.0, 2.0, 3.0)])
+        np.testing.assert_array_equal(constant.inverse_cdf(u), np.broadcast_to([1.0, 2.0, 3.0], u.shape))
+    
+    def test_simulation_uses_each_risks_distribution(self):
+        project = Project.objects.create(name="Distribution Project")
+        risk = Risk.objects.create(
+            project=project,
+            title="Vendor delay",
+            likelihood_percentage=100,
+            optimistic_cost_impact=1000,
+            most_likely_cost_impact=3000,
+            pessimistic_cost_impact=10000,
+            status='Open'
+        )
+        triangular = run_monte_carlo_simulation(project.risks, 20000, seed=3)['statistics']
+        self.assertAlmostEqual(triangular['mean'], 14000 / 3, delta=60)
+        
+        Risk.objects.filter(id=risk.id).update(cost_distribution='pert')
+        pert = run_monte_carlo_simulation(project.risks, 20000, seed=3)['statistics']
+        self.assertAlmostEqual(pert['mean'], 23000 / 6, delta=50)
+        
+        Risk.objects.filter(id=risk.id).update(cost_distribution='lognormal')
+        lognormal = run_monte_carlo_simulation(project.risks, 20000, seed=3)['statistics']
+        self.assertAlmostEqual(lognormal['p95'], 10000, delta=300)
+        self.assertGreater(lognormal['max_cost'], 10000)
+
+
+class WhatIfSimulationTests(TestCase):
+    """Tests for what-if re-simulation of edited risks with common random numbers"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(MONTE_CARLO_WHAT_IF_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="What-if Project")
+        group = CorrelationGroup.objects.create(project=self.project, name="Supplier", correlation=0.5)
+        self.risks = [
+            Risk.objects.create(
+                project=self.project,
+                title=f"Risk {i}",
+                likelihood_percentage=10 + 3 * i,
+                optimistic_cost_impact=1000 * (i + 1),
+                most_likely_cost_impact=2000 * (i + 1),
+                pessimistic_cost_impact=5000 * (i + 1),
+                correlation_group=group if i % 4 == 0 else None,
+                status='Open'
+            )
+            for i in range(20)
+        ]
+    
+    def full_rerun(self, seed=9):
+        return what_if._summary(simulate_project_totals(self.project.risks, 5000, seed))['statistics']
+    
+    def assertStatisticsEqual(self, first, second):
+        np.testing.assert_allclose([first[key] for key in sorted(first)],
+                                   [second[key] for key in sorted(second)], rtol=1e-9)
+    
+    def test_what_if_matches_full_rerun(self):
+        risk = self.risks[4]
+        change = {'likelihood_percentage': 60.0, 'optimistic_cost': 500.0, 'most_likely_cost': 9000.0,
+                  'pessimistic_cost': 40000.0, 'cost_distribution': 'pert'}
+        result = what_if.run_what_if(self.project, {risk.id: change}, 5000, seed=9)
+        self.assertStatisticsEqual(result['baseline']['statistics'], self.full_rerun())
+        
+        Risk.objects.filter(id=risk.id).update(likelihood_percentage=60, optimistic_cost_impact=500,
+                                               most_likely_cost_impact=9000, pessimistic_cost_impact=40000,
+                                               cost_distribution='pert')
+        self.assertStatisticsEqual(result['what_if']['statistics'], self.full_rerun())
+        self.assertGreater(result['difference']['mean'], 0)
+    
+    def test_closing_and_reopening_risks(self):
+        closed = self.risks[3]
+        Risk.objects.filter(id=closed.id).update(status='Closed')
+        opened, removed = self.risks[3], self.risks[8]
+        result = what_if.run_what_if(self.project, {opened.id: {'status': 'Open'}, removed.id: {'status': 'Closed'}},
+                                     5000, seed=9)
+        
+        Risk.objects.filter(id=opened.id).update(status='Open')
+        Risk.objects.filter(id=removed.id).update(status='Closed')
+        self.assertStatisticsEqual(result['what_if']['statistics'], self.full_rerun())
+    
+    def test_unchanged_risk_has_no_difference(self):
+        result = what_if.run_what_if(self.project, {self.risks[0].id: {}}, 5000, seed=9)
+        self.assertEqual(result['difference']['std_dev'], 0.0)
+        self.assertEqual(result['difference']['share_higher'], 0.0)
+        self.assertEqual(result['what_if']['statistics'], result['baseline']['statistics'])
+    
+    def test_baseline_is_simulated_once_and_pruned(self):
+        with patch('risks.what_if.simulate_active_totals', wraps=what_if.simulate_active_totals) as simulate:
+            for likelihood in (20.0, 40.0, 60.0):
+                what_if.run_what_if(self.project, {self.risks[1].id: {'likelihood_percentage': likelihood}},
+                                    5000, seed=9)
+        self.assertEqual(simulate.call_count, 1)
+        
+        with override_settings(MONTE_CARLO_WHAT_IF_BASELINES=2):
+            for seed in (1, 2, 3):
+                what_if.run_what_if(self.project, {}, 1000, seed=seed)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+    
+    def test_rejects_risks_of_other_projects_and_unknown_fields(self):
+        other = Risk.objects.create(project=Project.objects.create(name="Other"), title="Elsewhere")
+        with self.assertRaises(ValueError):
+            what_if.run_what_if(self.project, {other.id: {'likelihood_percentage': 50.0}}, 1000, seed=1)
+        with self.assertRaises(ValueError):
+            what_if.run_what_if(self.project, {self.risks[0].id: {'title': 'Renamed'}}, 1000, seed=1)
+    
+    def test_view_uses_latest_run_without_saving(self):
+        risk = self.risks[2]
+        run_cached_simulation(self.project, 2000, seed=77)
+        url = reverse('risk_what_if', args=[risk.id])
+        
+        response = self.client.post(url, {'likelihood_percentage': 90})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['results']['seed'], 77)
+        self.assertEqual(data['results']['num_simulations'], 2000)
+        self.assertGreater(data['results']['difference']['mean'], 0)
+        risk.refresh_from_db()
+        self.assertEqual(risk.likelihood_percentage, 16)
+        
+        response = self.client.post(url, {'optimistic_cost_impact': 9000, 'most_likely_cost_impact': 100})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+    
+    @override_settings(MONTE_CARLO_BACKGROUND_THRESHOLD=2000)
+    def test_large_baseline_is_simulated_in_the_background(self):
+        risk = self.risks[2]
+        run_cached_simulation(self.project, 2000, seed=77)
+        url = reverse('risk_what_if', args=[risk.id])
+        
+        response = self.client.post(url, {'likelihood_percentage': 90})
+        self.assertEqual(response.status_code, 202)
+        job = run_job(claim_next_job())
+        self.assertEqual(job.kind, 'monte_carlo_samples')
+        self.assertEqual(job.status, 'succeeded')
+        
+        # The job stored the baseline, so the what-if now runs inside the request
+        with patch('risks.what_if.simulate_active_totals') as simulate:
+            response = self.client.post(url, {'likelihood_percentage': 90})
+        simulate.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results']['num_simulations'], 2000)
+        self.assertIsNone(claim_next_job())
+    
+    @override_settings(BACKGROUND_JOBS_ENABLED=True)
+    def test_background_baseline_without_a_run_is_reused(self):
+        """The 202 names the seed it queued, so posting it again finds the stored baseline"""
+        self.assertFalse(self.project.simulation_runs.exists())
+        url = reverse('risk_what_if', args=[self.risks[2].id])
+        
+        response = self.client.post(url, {'likelihood_percentage': 90})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual((job.params['seed'], job.params['num_simulations']), (data['seed'], data['num_simulations']))
+        
+        response = self.client.post(url, {'likelihood_percentage': 90, 'seed': data['seed'],
+                                          'num_simulations': data['num_simulations']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results']['seed'], data['seed'])
+        self.assertIsNone(claim_next_job())
+
+
+class PortfolioSimulationTests(TestCase):
+    """Tests for the portfolio Monte Carlo simulation across projects"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.small = Project.objects.create(name="Small Project")
+        self.large = Project.objects.create(name="Large Project")
+        Project.objects.create(name="Empty Project")
+        for project, scale in ((self.small, 1), (self.large, 20)):
+            for i in range(5):
+                Risk.objects.create(
+                    project=project,
+                    title=f"{project.name} risk {i}",
+                    likelihood_percentage=30,
+                    optimistic_cost_impact=1000 * scale,
+                    most_likely_cost_impact=3000 * scale,
+                    pessimistic_cost_impact=9000 * scale,
+                    status='Open'
+                )
+    
+    def test_marginals_match_project_runs(self):
+        result = run_portfolio_simulation(5000, seed=4)
+        self.assertEqual(result['num_projects'], 2)
+        self.assertEqual(result['num_active_risks'], 10)
+        for project in result['projects']:
+            alone = run_monte_carlo_simulation(Project.objects.get(id=project['project_id']).risks, 5000, seed=4)
+            statistics, expected = project['statistics'], alone['statistics']
+            for key in ('mean', 'std_dev'):
+                self.assertAlmostEqual(statistics[key], expected[key], delta=1e-9 * expected[key])
+            for key in ('min_cost', 'max_cost'):
+                self.assertEqual(statistics[key], expected[key])
+            # Percentiles come from the coarse per-project histogram
+            bin_width = (expected['max_cost'] - expected['min_cost']) / 64
+            for key in ('median', 'p10', 'p25', 'p75', 'p90', 'p95'):
+                self.assertAlmostEqual(statistics[key], expected[key], delta=bin_width)
+        self.assertAlmostEqual(result['statistics']['mean'],
+                               sum(project['statistics']['mean'] for project in result['projects']))
+    
+    def test_contributions_add_up_to_portfolio_p95(self):
+        result = run_portfolio_simulation(20000, seed=4)
+        projects = result['projects']
+        self.assertEqual(projects[0]['project_name'], "Large Project")
+        self.assertGreater(projects[0]['p95_share'], 0.9)
+        self.assertAlmostEqual(sum(project['p95_share'] for project in projects), 1.0)
+        self.assertAlmostEqual(sum(project['p95_contribution'] for project in projects),
+                               result['statistics']['p95'], places=4)
+        self.assertGreater(result['diversification_benefit'], 0)
+    
+    def test_tail_keeps_the_highest_totals(self):
+        generator = np.random.default_rng(5)
+        blocks = [generator.random((500, 3)) for _ in range(8)]
+        accumulator = PortfolioAccumulator([(0.0, 1.0)] * 3, 100)
+        for block in blocks:
+            accumulator.update(block)
+        rows = np.concatenate(blocks)
+        highest = rows[np.argsort(rows.sum(axis=1))[-100:]]
+        self.assertEqual(accumulator.tail_project_totals.shape, (100, 3))
+        np.testing.assert_allclose(np.sort(accumulator.tail_totals), np.sort(highest.sum(axis=1)))
+        np.testing.assert_allclose(accumulator.tail_project_totals.mean(axis=0), highest.mean(axis=0))
+    
+    def test_project_marginals_are_columnar(self):
+        """Merged block accumulators give each project's moments and histogram percentiles"""
+        generator = np.random.default_rng(6)
+        blocks = [generator.random((500, 3)) * [1, 10, 100] for _ in range(6)]
+        merged = PortfolioAccumulator([(0.0, 1.0), (0.0, 10.0), (0.0, 100.0)], 50)
+        for block in blocks:
+            accumulator = PortfolioAccumulator([(0.0, 1.0), (0.0, 10.0), (0.0, 100.0)], 50)
+            accumulator.update(block)
+            merged.merge(accumulator)
+        rows = np.concatenate(blocks)
+        self.assertEqual(merged.bin_counts.shape, (3, 256))
+        for statistics, column, scale in zip(merged.project_statistics(), rows.T, (1, 10, 100)):
+            self.assertAlmostEqual(statistics['mean'], column.mean())
+            self.assertAlmostEqual(statistics['std_dev'], column.std(ddof=1))
+            self.assertEqual(statistics['max_cost'], column.max())
+            self.assertAlmostEqual(statistics['p90'], np.percentile(column, 90), delta=scale / 256)
+    
+    def test_loads_all_risks_in_one_query(self):
+        with self.assertNumQueries(2):
+            run_portfolio_simulation(1000, seed=1)
+    
+    def test_without_open_risks(self):
+        Risk.objects.update(status='Closed')
+        result = run_portfolio_simulation(1000, seed=1)
+        self.assertEqual(result['projects'], [])
+        self.assertEqual(result['statistics']['mean'], 0)
+    
+    def test_portfolio_view(self):
+        url = reverse('portfolio_monte_carlo')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Active Risks: 10 in 2 projects")
+        
+        response = self.client.post(url, {'num_simulations': 1000, 'seed': 8})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['results']['seed'], 8)
+        self.assertEqual(len(data['results']['projects']), 2)
+        self.assertIn('p95_contribution', data['results']['projects'][0]['formatted'])
+        
+        response = self.client.post(url + '?background=1', {'num_simulations': 1000, 'seed': 8})
+        self.assertEqual(response.status_code, 202)
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.result['results']['statistics'], data['results']['statistics'])
+
+
+class SensitivityAnalysisTests(TestCase):
+    """Tests for the one-pass sensitivity (tornado) analysis"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name="Sensitivity Project")
+        for i in range(4):
+            Risk.objects.create(
+                project=self.project,
+                title=f"Small risk {i}",
+                likelihood_percentage=40,
+                optimistic_cost_impact=1000,
+                most_likely_cost_impact=2000,
+                pessimistic_cost_impact=4000,
+                status='Open'
+            )
+        self.large = Risk.objects.create(
+            project=self.project,
+            title="Large risk",
+            likelihood_percentage=20,
+            optimistic_cost_impact=50000,
+            most_likely_cost_impact=80000,
+            pessimistic_cost_impact=150000,
+            status='Open'
+        )
+    
+    def test_explains_the_simulated_run(self):
+        result = run_sensitivity_analysis(self.project.risks, 20000, seed=6)
+        totals = simulate_project_totals(self.project.risks, 20000, seed=6)
+        self.assertEqual(result['num_active_risks'], 5)
+        self.assertAlmostEqual(result['mean'], totals.mean(), places=6)
+        self.assertAlmostEqual(result['std_dev'], totals.std(ddof=1), places=6)
+        self.assertAlmostEqual(sum(risk['mean'] for risk in result['risks']), totals.mean(), places=6)
+        self.assertAlmostEqual(sum(risk['variance_share'] for risk in result['risks']), 1.0)
+        
+        # The tail means of the risks add up to the mean of the highest totals
+        worst = np.sort(totals)[::-1]
+        self.assertAlmostEqual(result['tail_mean_p90'], worst[:2000].mean(), places=4)
+        self.assertAlmostEqual(result['tail_mean_p95'], worst[:1000].mean(), places=4)
+        self.assertAlmostEqual(sum(risk['tail_mean_p95'] for risk in result['risks']), result['tail_mean_p95'],
+                               places=4)
+    
+    def test_ranks_the_largest_risk_first(self):
+        result = run_sensitivity_analysis(self.project.risks, 20000, seed=6)
+        largest = result['risks'][0]
+        self.assertEqual(largest['risk_id'], self.large.id)
+        self.assertGreater(largest['variance_share'], 0.9)
+        self.assertGreater(largest['rank_correlation'], max(risk['rank_correlation'] for risk in result['risks'][1:]))
+        self.assertGreater(largest['tail_mean_p95'], largest['mean'])
+    
+    def test_workers_give_the_same_result(self):
+        self.assertEqual(run_sensitivity_analysis(self.project.risks, 20000, seed=6),
+                         run_sensitivity_analysis(self.project.risks, 20000, seed=6, workers=3))
+    
+    def test_without_open_risks(self):
+        self.project.risks.update(status='Closed')
+        result = run_sensitivity_analysis(self.project.risks, 1000, seed=1)
+        self.assertEqual(result['risks'], [])
+        self.assertEqual(result['std_dev'], 0.0)
+    
+    def test_sensitivity_view(self):
+        url = reverse('monte_carlo_sensitivity', args=[self.project.id])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        
+        response = self.client.post(url, {'num_simulations': 1000, 'seed': 3})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['results']['seed'], 3)
+        self.assertEqual(data['results']['risks'][0]['title'], "Large risk")
+        self.assertIn('tail_mean_p95', data['results']['risks'][0]['formatted'])
+        
+        with self.settings(MONTE_CARLO_SENSITIVITY_MAX_SIMULATIONS=2000):
+            response = self.client.post(url, {'num_simulations': 100000, 'seed': 3})
+        self.assertEqual(response.json()['results']['num_simulations'], 2000)
+        
+        response = self.client.post(url + '?background=1', {'num_simulations': 1000, 'seed': 3})
+        self.assertEqual(response.status_code, 202)
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.result['results']['risks'], data['results']['risks'])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, job_views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -9,6 +9,7 @@ urlpatterns = [
     path('project/<int:project_id>/delete/', views.delete_project, name='delete_project'),
     path('project/<int:project_id>/add_risk/', views.add_risk, name='add_risk'),
     path('risk/<int:risk_id>/edit/', views.edit_risk, name='edit_risk'),
+    path('risk/<int:risk_id>/what-if/', views.risk_what_if, name='risk_what_if'),
     path('risk/<int:risk_id>/delete/', views.delete_risk, name='delete_risk'),
     
     # New category URLs
@@ -22,6 +23,9 @@ urlpatterns = [
     path('accounts/profile/', views.profile, name='profile'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('reports/export-csv/', views.export_risks_csv, name='export_risks_csv'),
+    path('api/risks/', views.risk_register_api, name='risk_register_api'),
+    path('api/risks/search/', views.search_risks, name='search_risks'),
+    path('api/risks/duplicates/', views.duplicate_risks, name='duplicate_risks'),
     
     # Risk detail and responses
     path('risk/<int:risk_id>/detail/', views.risk_detail, name='risk_detail'),
@@ -32,6 +36,14 @@ urlpatterns = [
     
     # Monte Carlo simulation
     path('project/<int:project_id>/monte-carlo/', views.monte_carlo_simulation, name='monte_carlo_simulation'),
+    path('project/<int:project_id>/monte-carlo/samples/', views.monte_carlo_samples, name='monte_carlo_samples'),
+    path('project/<int:project_id>/monte-carlo/sensitivity/', views.monte_carlo_sensitivity, name='monte_carlo_sensitivity'),
+    path('portfolio/monte-carlo/', views.portfolio_monte_carlo, name='portfolio_monte_carlo'),
+    
+    # Background jobs
+    path('jobs/submit/', job_views.submit_job, name='submit_job'),
+    path('jobs/<int:job_id>/', job_views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/result/', job_views.job_result, name='job_result'),
     
     # AI Risk Scoring Assistant
     path('ai/risk-scoring-suggestions/', views.ai_risk_scoring_suggestions, name='ai_risk_scoring_suggestions'),
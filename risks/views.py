@@ -1,22 +1,44 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from .models import Project, Risk, Category, RiskHistory, RiskResponse, UserProfile
+from .models import (Project, Risk, Category, RiskHistory, RiskResponse, UserProfile,
+                     ProjectRiskSummary)
 from .forms import (ProjectForm, RiskForm, CategoryForm, RiskHistoryForm, 
-                    RiskResponseForm, UserProfileForm, RiskEditForm)
+                    RiskResponseForm, UserProfileForm, RiskEditForm, RiskWhatIfForm)
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.conf import settings
+from django.db.models import Q
+from django.forms.models import model_to_dict
 import csv
-from django.http import HttpResponse, JsonResponse
+import io
+import numpy as np
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime
 from .notifications import send_high_risk_notification, send_risk_status_change_notification
 from django.urls import reverse
-from .monte_carlo import run_monte_carlo_simulation, format_currency
+from .monte_carlo import load_active_risks, simulate_active_totals, format_currency, new_seed
+from .simulation_cache import run_cached_simulation
+from .what_if import baseline_totals, run_what_if, stored_baseline_totals
+from .portfolio import run_portfolio_simulation
+from .sensitivity import run_sensitivity_analysis
+from .pagination import REGISTER_ORDERING, keyset_page
+from . import search, similarity
+from .jobs import check_param_names, job_project_id, should_run_in_background
+from .job_views import background_job_response
 from .ai_features import ai_risk_scoring_assistant
 import json
 from .ai_features import ai_risk_scoring_assistant
 
+# Rows fetched per database round trip when streaming the CSV export
+CSV_EXPORT_CHUNK_SIZE = 2000
+
+# Largest page the risk register API returns
+REGISTER_MAX_PAGE_SIZE = 100
+
+# Largest seed a simulation accepts; SimulationRun.seed is a signed 64-bit BigIntegerField
+MAX_SIMULATION_SEED = 2 ** 63 - 1
+
 # User registration view
 def signup(request):
     if request.method == 'POST':
@@ -49,29 +71,30 @@ def home(request):
 def project_detail(request, project_id):
     project = get_object_or_404(Project, id=project_id)
     # Order by likelihood and impact which together determine the risk score
-    risks = project.risks.all().order_by('-likelihood', '-impact', 'title')
+    risks = project.risks.select_related('category').order_by('-likelihood', '-impact', 'title')
     
-    # Count risks by level
-    high_risks = sum(1 for risk in risks if risk.risk_level == 'High')
-    medium_risks = sum(1 for risk in risks if risk.risk_level == 'Medium')
-    low_risks = sum(1 for risk in risks if risk.risk_level == 'Low')
-    
-    # Count risks by status
-    open_risks = sum(1 for risk in risks if risk.status == 'Open')
-    mitigated_risks = sum(1 for risk in risks if risk.status == 'Mitigated')
-    closed_risks = sum(1 for risk in risks if risk.status == 'Closed')
+    # Count risks by level and status
+    total = ProjectRiskSummary.risk_total
+    counts = project.risk_summaries.aggregate(
+        high_risks=total(Q(level='High')),
+        medium_risks=total(Q(level='Medium')),
+        low_risks=total(Q(level='Low')),
+        open_risks=total(Q(status='Open')),
+        mitigated_risks=total(Q(status='Mitigated')),
+        closed_risks=total(Q(status='Closed')),
+    )
     
     context = {
         'project': project,
         'risks': risks,
         'risk_stats': {
             'total': len(risks),
-            'high': high_risks,
-            'medium': medium_risks,
-            'low': low_risks,
-            'open': open_risks,
-            'mitigated': mitigated_risks,
-            'closed': closed_risks,
+            'high': counts['high_risks'],
+            'medium': counts['medium_risks'],
+            'low': counts['low_risks'],
+            'open': counts['open_risks'],
+            'mitigated': counts['mitigated_risks'],
+            'closed': counts['closed_risks'],
         }
     }
     return render(request, 'risks/project_detail.html', context)
@@ -175,7 +198,7 @@ def delete_category(request, category_id):
 def add_risk(request, project_id):
     project = get_object_or_404(Project, id=project_id)
     if request.method == 'POST':
-        form = RiskForm(request.POST)
+        form = RiskForm(request.POST, project=project)
         if form.is_valid():
             risk = form.save(commit=False)
             risk.project = project
@@ -203,7 +226,7 @@ def add_risk(request, project_id):
             messages.success(request, f'Risk "{risk.title}" added successfully!')
             return redirect('project_detail', project_id=project.id)
     else:
-        form = RiskForm()
+        form = RiskForm(project=project)
     return render(request, 'risks/add_risk.html', {'form': form, 'project': project})
 
 @login_required
@@ -270,57 +293,59 @@ def dashboard(request):
     open_risks_queryset = risks.filter(status='Open')
     
     # Project statistics
-    project_count = projects.count()
-    
-    # Risk statistics (all risks)
-    risk_count = risks.count()
-    
-    # Calculate risk levels based on Open risks only (for dashboard focus)
-    high_risks = sum(1 for risk in open_risks_queryset if risk.risk_level == 'High')
-    medium_risks = sum(1 for risk in open_risks_queryset if risk.risk_level == 'Medium')
-    low_risks = sum(1 for risk in open_risks_queryset if risk.risk_level == 'Low')
-      # Risks by status
-    open_risks = open_risks_queryset.count()
-    mitigated_risks = risks.filter(status='Mitigated').count()
-    closed_risks = risks.filter(status='Closed').count()
-    
-    # Risks by category (Open risks only for dashboard focus)
-    categories = Category.objects.all()
-    risks_by_category = {}
-    for category in categories:
-        count = open_risks_queryset.filter(category=category).count()
-        if count > 0:  # Only include categories that have open risks
-            risks_by_category[category.name] = count    # Recent risks (last 10) - focus on recent Open risks for dashboard relevance
-    recent_risks = open_risks_queryset.order_by('-created_at')[:10]
-    
-    # All risks with pagination - ordered by risk score (likelihood * impact) descending
-    all_risks_queryset = risks.order_by('-likelihood', '-impact', 'title')
-    
-    # Handle pagination for all risks
-    page = request.GET.get('page', 1)
-    paginator = Paginator(all_risks_queryset, 20)  # Show 20 risks per page
+    project_count = len(projects)
+    
+    # Status, severity and risk matrix counts in a single aggregate over the
+    # materialized summaries
+    summaries = ProjectRiskSummary.objects.all()
+    total = ProjectRiskSummary.risk_total
+    is_open = Q(status='Open')
+    levels = ['High', 'Medium', 'Low']
+    aggregates = {
+        'total_risks': total(),
+        'open_risks': total(is_open),
+        'mitigated_risks': total(Q(status='Mitigated')),
+        'closed_risks': total(Q(status='Closed')),
+    }
+    for level in levels:
+        # Risk levels are based on Open risks only (for dashboard focus)
+        aggregates[f'{level.lower()}_risks'] = total(is_open & Q(level=level))
+    for likelihood in range(1, 4):
+        for impact in range(1, 4):
+            aggregates[f'matrix_{likelihood}_{impact}'] = total(
+                is_open & Q(likelihood=likelihood, impact=impact)
+            )
+    totals = summaries.aggregate(**aggregates)
+    
+    risk_count = totals['total_risks']
+    high_risks = totals['high_risks']
+    medium_risks = totals['medium_risks']
+    low_risks = totals['low_risks']
+    open_risks = totals['open_risks']
+    mitigated_risks = totals['mitigated_risks']
+    closed_risks = totals['closed_risks']
+    
+    # Risks by category (Open risks only for dashboard focus); only categories
+    # that have open risks appear in the grouped result
+    category_counts = (summaries.filter(is_open, category__isnull=False, risk_count__gt=0)
+                       .values('category__name')
+                       .annotate(count=total())
+                       .order_by('category__name'))
+    risks_by_category = {row['category__name']: row['count'] for row in category_counts}
+    
+    # Recent risks (last 10) - focus on recent Open risks for dashboard relevance
+    recent_risks = open_risks_queryset.select_related('project', 'category').order_by('-created_at')[:10]
     
+    # All risks with keyset pagination - ordered by risk score (likelihood * impact)
+    # descending. The total comes from the summary counts above instead of a COUNT(*)
+    all_risks_queryset = risks.select_related('project', 'category')
     try:
-        all_risks_page = paginator.page(page)
-    except PageNotAnInteger:
-        all_risks_page = paginator.page(1)
-    except EmptyPage:
-        all_risks_page = paginator.page(paginator.num_pages)
-    
-    # Prepare data for risk matrix (heat map) - use only Open risks for active risk management
-    risk_matrix = [
-        [0, 0, 0],  # Low likelihood: [low impact, med impact, high impact]
-        [0, 0, 0],  # Med likelihood: [low impact, med impact, high impact]
-        [0, 0, 0],  # High likelihood: [low impact, med impact, high impact]
-    ]
-    
-    # Count risks for each cell in the matrix (Open risks only)
-    for risk in open_risks_queryset:
-        if risk.likelihood > 0 and risk.impact > 0:  # Ensure valid values
-            li = risk.likelihood - 1  # 0-based index (likelihood is 1, 2, or 3)
-            im = risk.impact - 1      # 0-based index (impact is 1, 2, or 3)
-            if 0 <= li < 3 and 0 <= im < 3:  # Ensure within valid range
-                risk_matrix[li][im] += 1
+        all_risks_page, next_cursor, previous_cursor = keyset_page(
+            all_risks_queryset, REGISTER_ORDERING, request.GET.get('cursor'), 20,  # Show 20 risks per page
+            request.GET.get('before'),
+        )
+    except ValueError:
+        all_risks_page, next_cursor, previous_cursor = keyset_page(all_risks_queryset, REGISTER_ORDERING)
     
     # Prepare data for JSON serialization
     severity_data = {
@@ -345,13 +370,27 @@ def dashboard(request):
         for y in range(3):  # Impact (0=Low, 1=Medium, 2=High)
             # Calculate risk score (likelihood+1 * impact+1)
             score = (x + 1) * (y + 1)
-            count = risk_matrix[x][y]
+            count = totals[f'matrix_{x + 1}_{y + 1}']
             risk_matrix_data.append({
                 'x': x,
                 'y': y,
                 'v': score,
                 'count': count
-            })    
+            })
+    
+    # Per-project counts for the modals, grouped in one query
+    project_aggregates = {
+        'total_risks': total(),
+        'open_risks': total(is_open),
+    }
+    for level in levels:
+        project_aggregates[f'{level.lower()}_risks'] = total(Q(level=level))
+    project_counts = {
+        row.pop('project'): row
+        for row in summaries.values('project').annotate(**project_aggregates).order_by()
+    }
+    empty_counts = dict.fromkeys(project_aggregates, 0)
+    
     context = {
         'projects': projects,
         'project_count': project_count,
@@ -365,53 +404,188 @@ def dashboard(request):
         'risks_by_category': risks_by_category,
         'recent_risks': recent_risks,
         'all_risks_page': all_risks_page,
+        'register_next_cursor': next_cursor,
+        'register_previous_cursor': previous_cursor,
         'severity_data': severity_data,
         'category_data': category_data,
         'status_data': status_data,
         'risk_matrix_data': risk_matrix_data,
         # Add project-specific risk data for modals
         'projects_with_risk_data': [
-            {
-                'project': project,
-                'total_risks': project.risks.count(),
-                'open_risks': project.risks.filter(status='Open').count(),
-                'high_risks': sum(1 for risk in project.risks.all() if risk.risk_level == 'High'),
-                'medium_risks': sum(1 for risk in project.risks.all() if risk.risk_level == 'Medium'),
-                'low_risks': sum(1 for risk in project.risks.all() if risk.risk_level == 'Low'),
-            }
+            {'project': project, **project_counts.get(project.id, empty_counts)}
             for project in projects
         ]
     }
     
     return render(request, 'risks/dashboard.html', context)
 
+def filter_register_risks(params, risks=None):
+    """
+    Apply the Complete Risk Register filters from request parameters.
+    
+    Supported parameters are project (id), level, status, category (name or
+    "None" for uncategorized) and q (full-text keywords); missing or "all"
+    values are ignored.
+    """
+    if risks is None:
+        risks = Risk.objects.all()
+    
+    def value(name):
+        raw = params.get(name, '').strip()
+        return '' if raw == 'all' else raw
+    
+    if value('project'):
+        risks = risks.filter(project_id=value('project'))
+    if value('level'):
+        risks = risks.filter(level=value('level'))
+    if value('status'):
+        risks = risks.filter(status=value('status'))
+    if value('category') == 'None':
+        risks = risks.filter(category__isnull=True)
+    elif value('category'):
+        risks = risks.filter(category__name=value('category'))
+    if value('q'):
+        # Every word must match, the last one as a prefix while typing
+        risks = risks.filter(search.matching_filter(value('q').split(), prefix=True))
+    return risks
+
+def register_row(risk):
+    """JSON representation of a risk for the Complete Risk Register"""
+    return {
+        'id': risk.id,
+        'title': risk.title,
+        'project_id': risk.project_id,
+        'project_name': risk.project.name,
+        'category': risk.category.name if risk.category else None,
+        'score': risk.score,
+        'level': risk.level,
+        'likelihood': risk.get_likelihood_display(),
+        'impact': risk.get_impact_display(),
+        'owner': risk.owner,
+        'status': risk.status,
+        'detail_url': reverse('risk_detail', args=[risk.id]),
+        'edit_url': reverse('edit_risk', args=[risk.id]),
+        'add_response_url': reverse('add_risk_response', args=[risk.id]),
+        'created_at': risk.created_at.isoformat(),
+        'updated_at': risk.updated_at.isoformat(),
+    }
+
+@login_required
+def risk_register_api(request):
+    """
+    Filtered, keyset-paginated page of the Complete Risk Register as JSON.
+    
+    Pass the returned next_cursor as ?cursor= to fetch the following page, or
+    previous_cursor as ?before= for the one before. The total count is only
+    computed for the first page.
+    """
+    try:
+        page_size = min(max(int(request.GET.get('page_size', 20)), 1), REGISTER_MAX_PAGE_SIZE)
+        risks = filter_register_risks(request.GET).select_related('project', 'category')
+        cursor = request.GET.get('cursor') or None
+        before = request.GET.get('before') or None
+        rows, next_cursor, previous_cursor = keyset_page(risks, REGISTER_ORDERING, cursor, page_size, before)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    data = {
+        'success': True,
+        'results': [register_row(risk) for risk in rows],
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+    }
+    if cursor is None and before is None:
+        data['count'] = risks.count()
+    return JsonResponse(data)
+
+@login_required
+def search_risks(request):
+    """
+    Ranked full-text search over risk titles, descriptions and history comments.
+    
+    GET takes q plus the register filters (project, level, status, category).
+    POST takes JSON {"search_parameters": {...}, "project_id": ...} in the
+    format returned by the AI smart search, and runs it directly.
+    """
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                raise ValueError('The request body must be a JSON object')
+            risks = Risk.objects.all()
+            if data.get('project_id'):
+                risks = risks.filter(project_id=data['project_id'])
+            results = search.apply_search_parameters(data.get('search_parameters') or {}, risks)
+        else:
+            risks = filter_register_risks({key: value for key, value in request.GET.items() if key != 'q'})
+            results = search.ranked_search(request.GET.get('q', '').split(), risks)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'results': [dict(register_row(risk), rank=rank) for risk, rank in results],
+        'count': len(results),
+    })
+
+@login_required
+def duplicate_risks(request):
+    """
+    Existing risks that look like the one being entered, for the add-risk form.
+    
+    GET takes title and description, plus optional project and exclude (the id
+    of a risk being edited).
+    """
+    title = request.GET.get('title', '').strip()
+    description = request.GET.get('description', '').strip()
+    if not title and not description:
+        return JsonResponse({'success': True, 'results': [], 'count': 0})
+    try:
+        project_id = int(request.GET['project']) if request.GET.get('project') else None
+        exclude_ids = [int(request.GET['exclude'])] if request.GET.get('exclude') else []
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'project and exclude must be risk or project ids'}, status=400)
+    
+    results = similarity.find_duplicates(title, description, project_id, exclude_ids)
+    return JsonResponse({
+        'success': True,
+        'results': [dict(register_row(risk), similarity=round(score, 3)) for risk, score in results],
+        'count': len(results),
+    })
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+    def write(self, value):
+        return value
+
 @login_required
 def export_risks_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="risks_export_{datetime.now().strftime("%Y%m%d%H%M%S")}.csv"'
+    risks = (Risk.objects.select_related('project', 'category')
+             .order_by('project__name', '-likelihood', '-impact'))
     
-    writer = csv.writer(response)
-    writer.writerow(['Project', 'Risk Title', 'Description', 'Category', 'Likelihood', 'Impact', 
-                    'Risk Score', 'Risk Level', 'Owner', 'Status', 'Created', 'Updated'])
-    
-    risks = Risk.objects.all().order_by('project__name', '-likelihood', '-impact')
-    
-    for risk in risks:
-        writer.writerow([
-            risk.project.name,
-            risk.title,
-            risk.description,
-            risk.category.name if risk.category else '',
-            risk.get_likelihood_display(),
-            risk.get_impact_display(),
-            risk.risk_score,
-            risk.risk_level,
-            risk.owner,
-            risk.status,
-            risk.created_at.strftime('%Y-%m-%d'),
-            risk.updated_at.strftime('%Y-%m-%d'),
-        ])
+    def rows():
+        yield ['Project', 'Risk Title', 'Description', 'Category', 'Likelihood', 'Impact', 
+               'Risk Score', 'Risk Level', 'Owner', 'Status', 'Created', 'Updated']
+        for risk in risks.iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE):
+            yield [
+                risk.project.name,
+                risk.title,
+                risk.description,
+                risk.category.name if risk.category else '',
+                risk.get_likelihood_display(),
+                risk.get_impact_display(),
+                risk.risk_score,
+                risk.risk_level,
+                risk.owner,
+                risk.status,
+                risk.created_at.strftime('%Y-%m-%d'),
+                risk.updated_at.strftime('%Y-%m-%d'),
+            ]
     
+    # Stream the rows as they are read instead of building the file in memory
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows()), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="risks_export_{datetime.now().strftime("%Y%m%d%H%M%S")}.csv"'
     return response
 
 @login_required
@@ -550,36 +724,128 @@ def edit_user_profile(request):
     
     return render(request, 'risks/edit_profile.html', {'form': form})
 
+def _simulation_parameters(params):
+    """
+    Read and clamp the iteration count and seed of a simulation request.
+    
+    Returns (num_simulations, seed, workers); raises ValueError with a
+    user-facing message for malformed input.
+    """
+    try:
+        # Get number of simulations from request (default to 5000)
+        num_simulations = int(params.get('num_simulations', 5000))
+        seed = params.get('seed', '').strip()
+        seed = int(seed) if seed else None
+    except ValueError:
+        raise ValueError('Number of simulations and seed must be whole numbers')
+    
+    if seed is not None and seed < 0:
+        raise ValueError('Seed must not be negative')
+    if seed is not None and seed > MAX_SIMULATION_SEED:
+        raise ValueError(f'Seed must not be greater than {MAX_SIMULATION_SEED}')
+    
+    # Validate simulation count
+    if num_simulations < 100:
+        num_simulations = 100
+    elif num_simulations > settings.MONTE_CARLO_MAX_SIMULATIONS:
+        num_simulations = settings.MONTE_CARLO_MAX_SIMULATIONS
+    
+    # Large runs are split across the worker pool
+    workers = 1
+    if num_simulations >= settings.MONTE_CARLO_PARALLEL_THRESHOLD:
+        workers = settings.MONTE_CARLO_WORKERS
+    
+    return num_simulations, seed, workers
+
+def _run_in_background(request, num_simulations):
+    """Whether to queue a simulation: when asked to, or when it is too large to run inside the request"""
+    return should_run_in_background(request) or num_simulations >= settings.MONTE_CARLO_BACKGROUND_THRESHOLD
+
+def _samples_url(project_id, num_simulations, seed):
+    """Download URL of every iteration total of a seeded project run"""
+    url = reverse('monte_carlo_samples', args=[project_id])
+    return url + f"?num_simulations={num_simulations}&seed={seed}"
+
+def _simulation_job_params(params, allowed):
+    """
+    Check the params submitted for a simulation job with the same parsing
+    and limits as the simulation views.
+    
+    Returns the checked params without the project and the simulation
+    parameters as (num_simulations, seed, workers).
+    """
+    check_param_names(params, allowed)
+    seed = params.get('seed')
+    return _simulation_parameters({
+        'num_simulations': str(params.get('num_simulations', 5000)),
+        'seed': '' if seed is None else str(seed),
+    })
+
+def monte_carlo_job_params(params):
+    """Check the params submitted for a project simulation job"""
+    num_simulations, seed, workers = _simulation_job_params(
+        params, ('project_id', 'num_simulations', 'seed', 'include_cdf'))
+    include_cdf = params.get('include_cdf', False)
+    if not isinstance(include_cdf, bool):
+        raise ValueError('include_cdf must be true or false')
+    return {
+        'project_id': job_project_id(params),
+        'num_simulations': num_simulations,
+        'seed': seed,
+        'workers': workers,
+        'include_cdf': include_cdf,
+    }
+
+def monte_carlo_payload(project_id, num_simulations, seed=None, workers=1, include_cdf=False):
+    """Run (or fetch from the cache) a project simulation and build its JSON payload"""
+    project = Project.objects.get(id=project_id)
+    
+    # Run the simulation, or reuse a stored run with identical inputs
+    results, cached = run_cached_simulation(project, num_simulations, seed=seed, workers=workers)
+    
+    # Only the summary is returned; the full sample is a separate download
+    if not include_cdf:
+        results = {key: value for key, value in results.items() if key != 'cdf'}
+    
+    # Format results for display
+    formatted_stats = {}
+    for key, value in results['statistics'].items():
+        formatted_stats[key] = format_currency(value)
+    
+    samples_url = _samples_url(project.id, results['num_simulations'], results['seed'])
+    
+    return {
+        'success': True,
+        'results': results,
+        'formatted_stats': formatted_stats,
+        'project_name': project.name,
+        'samples_url': samples_url,
+        'cached': cached
+    }
+
 @login_required
 def monte_carlo_simulation(request, project_id):
     """Run Monte Carlo simulation for project risk costs"""
     project = get_object_or_404(Project, id=project_id)
     
     if request.method == 'POST':
-        # Get number of simulations from request (default to 5000)
-        num_simulations = int(request.POST.get('num_simulations', 5000))
-        
-        # Validate simulation count
-        if num_simulations < 100:
-            num_simulations = 100
-        elif num_simulations > 10000:
-            num_simulations = 10000
-        
-        # Run the simulation
-        results = run_monte_carlo_simulation(project.risks, num_simulations)
+        try:
+            num_simulations, seed, workers = _simulation_parameters(request.POST)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         
-        # Format results for display
-        formatted_stats = {}
-        for key, value in results['statistics'].items():
-            formatted_stats[key] = format_currency(value)
+        params = {
+            'project_id': project.id,
+            'num_simulations': num_simulations,
+            'seed': seed,
+            'workers': workers,
+            'include_cdf': request.POST.get('include_cdf') in ('1', 'true'),
+        }
+        if _run_in_background(request, num_simulations):
+            return background_job_response(request, 'monte_carlo', params)
         
         # Return JSON response for AJAX
-        return JsonResponse({
-            'success': True,
-            'results': results,
-            'formatted_stats': formatted_stats,
-            'project_name': project.name
-        })
+        return JsonResponse(monte_carlo_payload(**params))
     
     # For GET request, show the simulation page
     active_risks = project.risks.filter(status='Open')
@@ -589,6 +855,243 @@ def monte_carlo_simulation(request, project_id):
         'total_active_risks': active_risks.count()
     })
 
+def monte_carlo_sensitivity_payload(project_id, num_simulations, seed=None, workers=1):
+    """Rank a project's open risks by how much they drive its total cost and build the JSON payload"""
+    project = Project.objects.get(id=project_id)
+    results = run_sensitivity_analysis(project.risks, num_simulations, seed=seed, workers=workers)
+    
+    for risk in results['risks']:
+        risk['formatted'] = {
+            'mean': format_currency(risk['mean']),
+            'tail_mean_p90': format_currency(risk['tail_mean_p90']),
+            'tail_mean_p95': format_currency(risk['tail_mean_p95']),
+        }
+    
+    return {
+        'success': True,
+        'results': results,
+        'project_name': project.name,
+    }
+
+def _sensitivity_parameters(parameters):
+    """Cap parsed simulation parameters at MONTE_CARLO_SENSITIVITY_MAX_SIMULATIONS"""
+    num_simulations, seed, workers = parameters
+    num_simulations = min(num_simulations, settings.MONTE_CARLO_SENSITIVITY_MAX_SIMULATIONS)
+    if num_simulations < settings.MONTE_CARLO_PARALLEL_THRESHOLD:
+        workers = 1
+    return num_simulations, seed, workers
+
+def monte_carlo_sensitivity_job_params(params):
+    """Check the params submitted for a sensitivity analysis job"""
+    num_simulations, seed, workers = _sensitivity_parameters(
+        _simulation_job_params(params, ('project_id', 'num_simulations', 'seed')))
+    return {
+        'project_id': job_project_id(params),
+        'num_simulations': num_simulations,
+        'seed': seed,
+        'workers': workers,
+    }
+
+@login_required
+def monte_carlo_sensitivity(request, project_id):
+    """
+    Sensitivity (tornado) analysis of a project simulation.
+    
+    Posted with the seed and iteration count of a run, it explains that run.
+    The iterations are capped at MONTE_CARLO_SENSITIVITY_MAX_SIMULATIONS;
+    larger runs are explained by a shorter run with the same seed.
+    """
+    project = get_object_or_404(Project, id=project_id)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Only POST requests are allowed'}, status=405)
+    
+    try:
+        num_simulations, seed, workers = _sensitivity_parameters(_simulation_parameters(request.POST))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    params = {
+        'project_id': project.id,
+        'num_simulations': num_simulations,
+        'seed': seed,
+        'workers': workers,
+    }
+    if _run_in_background(request, num_simulations):
+        return background_job_response(request, 'monte_carlo_sensitivity', params)
+    
+    return JsonResponse(monte_carlo_sensitivity_payload(**params))
+
+def portfolio_monte_carlo_payload(num_simulations, seed=None, workers=1):
+    """Run a portfolio simulation across all projects and build its JSON payload"""
+    results = run_portfolio_simulation(num_simulations, seed=seed, workers=workers)
+    
+    formatted_stats = {key: format_currency(value) for key, value in results['statistics'].items()}
+    for project in results['projects']:
+        project['formatted'] = {
+            'mean': format_currency(project['statistics']['mean']),
+            'p95': format_currency(project['statistics']['p95']),
+            'p95_contribution': format_currency(project['p95_contribution']),
+        }
+    
+    return {
+        'success': True,
+        'results': results,
+        'formatted_stats': formatted_stats,
+        'formatted_diversification_benefit': format_currency(results['diversification_benefit']),
+    }
+
+def portfolio_monte_carlo_job_params(params):
+    """Check the params submitted for a portfolio simulation job"""
+    num_simulations, seed, workers = _simulation_job_params(params, ('num_simulations', 'seed'))
+    return {'num_simulations': num_simulations, 'seed': seed, 'workers': workers}
+
+@login_required
+def portfolio_monte_carlo(request):
+    """Run a Monte Carlo simulation of the open risks of every project together"""
+    if request.method == 'POST':
+        try:
+            num_simulations, seed, workers = _simulation_parameters(request.POST)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        
+        params = {
+            'num_simulations': num_simulations,
+            'seed': seed,
+            'workers': workers,
+        }
+        if _run_in_background(request, num_simulations):
+            return background_job_response(request, 'portfolio_monte_carlo', params)
+        
+        return JsonResponse(portfolio_monte_carlo_payload(**params))
+    
+    # For GET request, show the simulation page
+    active_risks = Risk.objects.filter(status='Open')
+    return render(request, 'risks/portfolio_monte_carlo.html', {
+        'total_active_risks': active_risks.count(),
+        'total_projects': active_risks.values('project').distinct().count(),
+    })
+
+def monte_carlo_samples_payload(project_id, num_simulations, seed, workers=1):
+    """Simulate and store the iteration totals of a seeded project run, and return their download URL"""
+    project = Project.objects.get(id=project_id)
+    baseline_totals(load_active_risks(project.risks), num_simulations, seed, workers)
+    return {
+        'success': True,
+        'samples_url': _samples_url(project.id, num_simulations, seed),
+    }
+
+def monte_carlo_samples_job_params(params):
+    """Check the params submitted for a sample download job"""
+    num_simulations, seed, workers = _simulation_job_params(params, ('project_id', 'num_simulations', 'seed'))
+    if seed is None:
+        raise ValueError('A seed is required to download samples')
+    return {
+        'project_id': job_project_id(params),
+        'num_simulations': num_simulations,
+        'seed': seed,
+        'workers': workers,
+    }
+
+@login_required
+def monte_carlo_samples(request, project_id):
+    """Download every iteration total of a seeded simulation run as a float32 .npy file"""
+    project = get_object_or_404(Project, id=project_id)
+    
+    if not request.GET.get('seed', '').strip():
+        return JsonResponse({'success': False, 'error': 'A seed is required to download samples'}, status=400)
+    try:
+        num_simulations, seed, workers = _simulation_parameters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    # Large runs are simulated by a job worker, which stores the totals for this download
+    active_risks = load_active_risks(project.risks)
+    totals = stored_baseline_totals(active_risks, num_simulations, seed)
+    if totals is None:
+        if _run_in_background(request, num_simulations):
+            return background_job_response(request, 'monte_carlo_samples', {
+                'project_id': project.id,
+                'num_simulations': num_simulations,
+                'seed': seed,
+                'workers': workers,
+            })
+        totals = simulate_active_totals(active_risks, num_simulations, seed, workers)
+    
+    buffer = io.BytesIO()
+    np.save(buffer, totals.astype(np.float32))
+    response = HttpResponse(buffer.getvalue(), content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="monte_carlo_{project.id}_{seed}_{num_simulations}.npy"'
+    return response
+
+@login_required
+def risk_what_if(request, risk_id):
+    """
+    Simulate the risk's project as if the risk had the posted simulation
+    inputs, without saving them.
+    
+    Posted fields left out keep the risk's current values. Without a seed
+    the project's latest simulation run (seed and iteration count) is used
+    as the baseline, so repeated what-ifs on one run only re-sample the
+    edited risk. A large baseline that is not stored yet is simulated by a
+    'monte_carlo_samples' job, which stores it; the 202 response carries the
+    seed and iteration count to post the what-if again with once the job is
+    done.
+    """
+    risk = get_object_or_404(Risk, id=risk_id)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Only POST requests are allowed'}, status=405)
+    
+    try:
+        num_simulations, seed, workers = _simulation_parameters(request.POST)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if seed is None:
+        latest = risk.project.simulation_runs.first()
+        if latest is not None:
+            seed = latest.seed
+            if 'num_simulations' not in request.POST:
+                num_simulations = latest.num_simulations
+        else:
+            seed = new_seed()
+    
+    data = model_to_dict(risk, fields=RiskWhatIfForm.Meta.fields)
+    data.update({key: value for key, value in request.POST.items() if key in data})
+    form = RiskWhatIfForm(data, instance=risk)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'error': 'Invalid inputs', 'errors': form.errors}, status=400)
+    
+    if (_run_in_background(request, num_simulations)
+            and stored_baseline_totals(load_active_risks(risk.project.risks), num_simulations, seed) is None):
+        # The client posts the what-if again with this seed and iteration
+        # count once the job has stored their baseline
+        return background_job_response(request, 'monte_carlo_samples', {
+            'project_id': risk.project_id,
+            'num_simulations': num_simulations,
+            'seed': seed,
+            'workers': workers,
+        }, extra={'seed': seed, 'num_simulations': num_simulations})
+    
+    change = {
+        'likelihood_percentage': float(form.cleaned_data['likelihood_percentage']),
+        'optimistic_cost': float(form.cleaned_data['optimistic_cost_impact']),
+        'most_likely_cost': float(form.cleaned_data['most_likely_cost_impact']),
+        'pessimistic_cost': float(form.cleaned_data['pessimistic_cost_impact']),
+        'cost_distribution': form.cleaned_data['cost_distribution'],
+        'status': form.cleaned_data['status'],
+    }
+    results = run_what_if(risk.project, {risk.id: change}, num_simulations, seed, workers)
+    
+    formatted_stats = {
+        scenario: {key: format_currency(value) for key, value in results[scenario]['statistics'].items()}
+        for scenario in ('baseline', 'what_if')
+    }
+    return JsonResponse({
+        'success': True,
+        'results': results,
+        'formatted_stats': formatted_stats,
+        'formatted_difference': format_currency(results['difference']['mean']),
+    })
+
 @login_required
 def ai_risk_scoring_suggestions(request):
     """
@@ -0,0 +1,189 @@
+"""
+What-if re-simulation with common random numbers.
+
+Each risk adds its own column of costs to the iteration totals of a run,
+drawn from random streams keyed by the run seed and the risk id. Changing
+one risk therefore only changes its column: the what-if totals are the
+baseline totals minus the risk's old column plus its new column, both
+regenerated from the same streams in O(iterations) however many risks the
+project has. The baseline totals of a seeded run are kept as .npy files
+under MONTE_CARLO_WHAT_IF_DIR, named by the hash of the run's inputs, so
+only the first what-if on a run pays for a full simulation; the
+MONTE_CARLO_WHAT_IF_BASELINES most recently used files are kept.
+
+Since the baseline and the what-if share every random draw, their
+difference carries no sampling noise from the unchanged risks, and a
+comparison needs far fewer iterations than two independent runs would.
+"""
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .monte_carlo import (create_histogram_data, load_active_risks, load_risk_inputs, risk_column,
+                          simulate_active_totals)
+from .simulation_cache import simulation_inputs_hash
+
+# Simulation inputs a what-if may change, in load_active_risks form, plus
+# 'status' to take a risk out of (or into) the simulation
+WHAT_IF_FIELDS = ('likelihood_percentage', 'optimistic_cost', 'most_likely_cost', 'pessimistic_cost',
+                  'cost_distribution', 'status')
+
+
+def _prune(directory: Path) -> None:
+    """Delete the least recently used baselines beyond MONTE_CARLO_WHAT_IF_BASELINES"""
+    files = sorted(directory.glob('*.npy'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in files[settings.MONTE_CARLO_WHAT_IF_BASELINES:]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _baseline_path(active_risks: List[Dict[str, Any]], num_simulations: int, seed: int) -> Path:
+    directory = Path(settings.MONTE_CARLO_WHAT_IF_DIR)
+    return directory / f'{simulation_inputs_hash(active_risks, num_simulations, seed)}.npy'
+
+
+def stored_baseline_totals(active_risks: List[Dict[str, Any]], num_simulations: int,
+                           seed: int) -> Optional[np.ndarray]:
+    """Iteration totals of the seeded run of these risks if they are stored on disk, else None"""
+    path = _baseline_path(active_risks, num_simulations, seed)
+    try:
+        totals = np.load(path)
+    except (OSError, ValueError, EOFError):
+        return None
+    if totals.shape != (num_simulations,):
+        return None
+    # Mark the baseline as recently used
+    os.utime(path)
+    return totals
+
+
+def baseline_totals(active_risks: List[Dict[str, Any]], num_simulations: int, seed: int,
+                    workers: int = 1) -> np.ndarray:
+    """
+    Iteration totals of the seeded run of these risks, from disk when stored.
+
+    Args:
+        active_risks: Risks loaded with load_active_risks
+        num_simulations: Number of simulation iterations
+        seed: Run seed
+        workers: Number of worker processes if the run has to be simulated
+
+    Returns:
+        Array of length num_simulations with the total cost of each iteration
+    """
+    totals = stored_baseline_totals(active_risks, num_simulations, seed)
+    if totals is not None:
+        return totals
+
+    path = _baseline_path(active_risks, num_simulations, seed)
+    directory = path.parent
+    totals = simulate_active_totals(active_risks, num_simulations, seed, workers)
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as handle:
+        np.save(handle, totals)
+    os.replace(handle.name, path)
+    _prune(directory)
+    return totals
+
+
+def _summary(totals: np.ndarray) -> Dict[str, Any]:
+    """Statistics and chart histogram of a run's totals, in the simulation's result format"""
+    if totals.size == 0:
+        statistics = {key: 0 for key in ('mean', 'median', 'std_dev', 'min_cost', 'max_cost',
+                                          'p10', 'p25', 'p75', 'p90', 'p95')}
+    else:
+        p10, p25, median, p75, p90, p95 = np.percentile(totals, [10, 25, 50, 75, 90, 95]).tolist()
+        statistics = {
+            'mean': float(totals.mean()),
+            'median': median,
+            'std_dev': float(totals.std(ddof=1)) if totals.size > 1 else 0.0,
+            'min_cost': float(totals.min()),
+            'max_cost': float(totals.max()),
+            'p10': p10,
+            'p25': p25,
+            'p75': p75,
+            'p90': p90,
+            'p95': p95,
+        }
+    return {'statistics': statistics, 'histogram_data': create_histogram_data(totals, num_bins=20)}
+
+
+def _difference(difference: np.ndarray) -> Dict[str, float]:
+    """Distribution of the per-iteration change in total cost"""
+    if difference.size == 0:
+        return {'mean': 0.0, 'std_dev': 0.0, 'p10': 0.0, 'median': 0.0, 'p90': 0.0, 'share_higher': 0.0}
+    p10, median, p90 = np.percentile(difference, [10, 50, 90]).tolist()
+    return {
+        'mean': float(difference.mean()),
+        'std_dev': float(difference.std(ddof=1)) if difference.size > 1 else 0.0,
+        'p10': p10,
+        'median': median,
+        'p90': p90,
+        'share_higher': float(np.count_nonzero(difference > 0) / difference.size),
+    }
+
+
+def run_what_if(project, changes: Dict[int, Dict[str, Any]], num_simulations: int, seed: int,
+                workers: int = 1) -> Dict[str, Any]:
+    """
+    Compare a seeded project run with the same run after changing some risks.
+
+    Nothing is saved to the risks. Each changed risk costs two column
+    simulations of O(iterations); only a baseline that is not stored yet
+    costs a full run. The what-if totals equal those of a full run with the
+    changes saved, up to floating-point rounding.
+
+    Args:
+        project: Project whose open risks are simulated
+        changes: New values per risk id, keyed like WHAT_IF_FIELDS; fields
+            left out keep the risk's current value
+        num_simulations: Number of simulation iterations
+        seed: Run seed
+        workers: Number of worker processes if the baseline has to be simulated
+
+    Returns:
+        Dictionary with the baseline and what-if statistics and histograms,
+        and the distribution of the per-iteration difference
+
+    Raises:
+        ValueError: If a risk is not in the project or a field cannot be changed
+    """
+    num_simulations = max(num_simulations, 0)
+    active_risks = load_active_risks(project.risks)
+    baseline = baseline_totals(active_risks, num_simulations, seed, workers)
+
+    current = {risk['id']: risk for risk in active_risks}
+    active_ids = set(current)
+    others = [risk_id for risk_id in changes if risk_id not in current]
+    if others:
+        current.update({risk['id']: risk for risk in load_risk_inputs(project.risks.filter(id__in=others))})
+
+    difference = np.zeros(num_simulations, dtype=float)
+    for risk_id, change in changes.items():
+        if risk_id not in current:
+            raise ValueError(f"Risk {risk_id} is not part of project {project.name}")
+        unknown = set(change) - set(WHAT_IF_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot change {', '.join(sorted(unknown))} in a what-if")
+
+        if risk_id in active_ids:
+            difference -= risk_column(current[risk_id], num_simulations, seed)
+        risk = {**current[risk_id], **change}
+        status = risk.pop('status', None)
+        if status == 'Open' or (status is None and risk_id in active_ids):
+            difference += risk_column(risk, num_simulations, seed)
+
+    return {
+        'num_simulations': num_simulations,
+        'seed': seed,
+        'changed_risks': list(changes),
+        'baseline': _summary(baseline),
+        'what_if': _summary(baseline + difference),
+        'difference': _difference(difference),
+    }